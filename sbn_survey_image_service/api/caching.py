@@ -0,0 +1,152 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""HTTP validators and conditional requests.
+
+Responses carry a strong ETag and, for files, a Last-Modified date, so that
+browsers and shared caches may revalidate them.  Requests with a matching
+If-None-Match, or else a satisfied If-Modified-Since, are answered with 304
+Not Modified.  Cache-Control is configured per endpoint with the
+SBNSIS_CACHE_CONTROL_* environment variables.
+
+"""
+
+__all__ = ["file_etag", "json_etag", "file_response", "json_response"]
+
+import os
+import json
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+
+from connexion import request
+from starlette.responses import FileResponse, Response
+
+from ..config.env import ENV
+
+
+def _etag(key: str) -> str:
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+
+def file_etag(filename: str, stat: os.stat_result | None = None) -> str:
+    """Strong entity tag for a file.
+
+    Files in the cutout cache are named after a hash of their request
+    parameters, so the name within the cache and the size identify the
+    contents, whichever worker rendered them, and however often they are
+    rendered again.  Other files, e.g., labels, are identified by their path,
+    size, and modification time.
+
+    """
+
+    if stat is None:
+        stat = os.stat(filename)
+
+    path: str = os.path.realpath(filename)
+    cache: str = os.path.realpath(ENV.SBNSIS_CUTOUT_CACHE)
+    if os.path.commonpath((path, cache)) == cache:
+        return _etag(f"{os.path.relpath(path, cache)}:{stat.st_size}")
+
+    return _etag(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+
+
+def json_etag(body: dict | list) -> str:
+    """Strong entity tag for a JSON response body."""
+    return _etag(json.dumps(body, sort_keys=True))
+
+
+def _not_modified(etag: str, last_modified: float | None) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+    if_none_match: str | None = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags: list[str] = [
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        ]
+        return "*" in tags or etag in tags
+
+    if_modified_since: str | None = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+
+    try:
+        since: float = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        # invalid dates are ignored
+        return False
+    return int(last_modified) <= since
+
+
+def _headers(etag: str, last_modified: float | None, cache_control: str) -> dict:
+    headers: dict = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    return headers
+
+
+def file_response(
+    filename: str,
+    media_type: str,
+    download_filename: str,
+    cache_control: str,
+    download: bool = False,
+) -> Response:
+    """Serve a file, or 304 Not Modified.
+
+
+    Parameters
+    ----------
+    filename : str
+        The file to serve.
+
+    media_type : str
+        The file's MIME type.
+
+    download_filename : str
+        The file name suggested to the client.
+
+    cache_control : str
+        Cache-Control header value, or an empty string for none.
+
+    download : bool, optional
+        Set to ``True`` to prompt web browsers to save the file.
+
+    """
+
+    stat: os.stat_result = os.stat(filename)
+    headers: dict = _headers(file_etag(filename, stat), stat.st_mtime, cache_control)
+    if _not_modified(headers["ETag"], stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        filename,
+        media_type=media_type,
+        filename=download_filename,
+        content_disposition_type="attachment" if download else "inline",
+        headers=headers,
+        stat_result=stat,
+    )
+
+
+def json_response(
+    body: dict | list, cache_control: str
+) -> tuple[dict | list, int, dict] | Response:
+    """Serve a JSON body, or 304 Not Modified.
+
+    There is no modification date for database queries, so only the ETag
+    validates the response.
+
+
+    Parameters
+    ----------
+    body : dict or list
+        The response, to be serialized by connexion.
+
+    cache_control : str
+        Cache-Control header value, or an empty string for none.
+
+    """
+
+    headers: dict = _headers(json_etag(body), None, cache_control)
+    if _not_modified(headers["ETag"], None):
+        return Response(status_code=304, headers=headers)
+    return body, 200, headers
@@ -0,0 +1,96 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Client identification for the per-client render limits.
+
+Behind a reverse proxy, the socket peer is the proxy.  The client's own
+address is taken from the X-Forwarded-For header, as appended by the proxies
+listed in SBNSIS_TRUSTED_PROXIES.
+
+"""
+
+__all__ = ["client_address", "identify_client"]
+
+import ipaddress
+from functools import lru_cache
+from typing import List
+
+from connexion import request
+
+from ..config.env import ENV
+from ..services.admission import CLIENT
+
+Network = ipaddress.IPv4Network | ipaddress.IPv6Network
+
+
+@lru_cache
+def _networks(proxies: str) -> List[Network]:
+    return [
+        ipaddress.ip_network(proxy.strip(), strict=False)
+        for proxy in proxies.split(",")
+        if proxy.strip()
+    ]
+
+
+def _is_trusted(address: str, proxies: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in _networks(proxies))
+
+
+def client_address(
+    peer: str | None, forwarded_for: str | None, proxies: str | None = None
+) -> str | None:
+    """The client's address.
+
+    The socket peer, then the X-Forwarded-For addresses from right to left,
+    are examined.  The first address that is not a trusted proxy is the
+    client, i.e., addresses added by the client itself are ignored.
+
+
+    Parameters
+    ----------
+    peer : str or None
+        The socket peer address.
+
+    forwarded_for : str or None
+        The X-Forwarded-For header.
+
+    proxies : str, optional
+        Comma-separated addresses or networks of trusted proxies.  Default:
+        SBNSIS_TRUSTED_PROXIES.
+
+
+    Returns
+    -------
+    address : str or None
+
+    """
+
+    if peer is None:
+        return None
+
+    proxies = ENV.SBNSIS_TRUSTED_PROXIES if proxies is None else proxies
+    hops: List[str] = [peer]
+    if forwarded_for:
+        hops.extend(
+            hop.strip() for hop in reversed(forwarded_for.split(",")) if hop.strip()
+        )
+
+    for hop in hops:
+        if not _is_trusted(hop, proxies):
+            return hop
+
+    # only proxies
+    return hops[-1]
+
+
+def identify_client() -> None:
+    """Identify the client of the current request, for admission control."""
+
+    CLIENT.set(
+        client_address(
+            getattr(request.client, "host", None),
+            request.headers.get("x-forwarded-for"),
+        )
+    )
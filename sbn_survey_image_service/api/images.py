@@ -4,28 +4,102 @@ import os
 import json
 import uuid
 
-from flask import send_file, Response
+from starlette.responses import Response
 
+from .caching import file_response
+from .clients import identify_client
 from ..config import MIME_TYPES
 from ..config.logging import get_logger
-from ..config.exceptions import ParameterValueError
+from ..config.env import ENV
+from ..config.exceptions import JobRequired, ParameterValueError
 from ..services.label import label_query
-from ..services.image import image_query
+from ..services.image import image_query_async
+from ..services import jobs
+from ..services.executors import run_io
 
+BROWSE_FORMATS: list[str] = ["jpeg", "png", "webp", "avif"]
 
-def get_image(
+
+def check_parameters(
+    ra: float | None,
+    dec: float | None,
+    size: str | None,
+    align: bool,
+    format: str,
+    max_size: int | None,
+    bin: int | None,
+    quality: int | None,
+    compress_level: int | None,
+    subsampling: str | None,
+    compress: str | None,
+) -> None:
+    """Check the combination of image parameters.
+
+
+    Raises
+    ------
+    ParameterValueError
+
+    """
+
+    # Either define all, or none
+    cutout_params_exist = [p is not None for p in (ra, dec, size)]
+    if not all(cutout_params_exist) and any(cutout_params_exist):
+        raise ParameterValueError(
+            "If one of ra, dec, or size is defined, then all must be defined."
+        )
+
+    if align and not any(cutout_params_exist):
+        raise ParameterValueError("align=true is only allowed for cutouts.")
+
+    if align and format.lower() not in BROWSE_FORMATS:
+        raise ParameterValueError(
+            f"align=true requires format={', '.join(BROWSE_FORMATS)}"
+        )
+
+    if (max_size is not None or bin is not None) and (
+        format.lower() not in BROWSE_FORMATS
+    ):
+        raise ParameterValueError(
+            f"max_size and bin require format={', '.join(BROWSE_FORMATS)}"
+        )
+
+    encoder_options = [quality, compress_level, subsampling]
+    if any(x is not None for x in encoder_options) and (
+        format.lower() not in BROWSE_FORMATS
+    ):
+        raise ParameterValueError(
+            "quality, compress_level, and subsampling require"
+            f" format={', '.join(BROWSE_FORMATS)}"
+        )
+
+    if compress is not None and format.lower() != "fits":
+        raise ParameterValueError("compress requires format=fits")
+
+
+async def get_image(
     id: str,
     ra: float | None = None,
     dec: float | None = None,
     size: str | None = None,
     align: bool = False,
     format: str = "fits",
+    stretch: str = "image",
+    max_size: int | None = None,
+    bin: int | None = None,
+    quality: int | None = None,
+    compress_level: int | None = None,
+    subsampling: str | None = None,
+    compress: str | None = None,
+    quantize: float | None = None,
     download: bool = False,
-) -> Response:
+) -> Response | tuple[dict, int, dict]:
     """Controller for survey image service."""
 
     logger = get_logger()
     job_id = uuid.uuid4()
+    # renders are limited per client
+    identify_client()
     logger.info(
         json.dumps(
             {
@@ -37,33 +111,75 @@ def get_image(
                 "size": size,
                 "align": align,
                 "format": format,
+                "stretch": stretch,
+                "max_size": max_size,
+                "bin": bin,
+                "quality": quality,
+                "compress_level": compress_level,
+                "subsampling": subsampling,
+                "compress": compress,
+                "quantize": quantize,
                 "download": download,
             }
         )
     )
 
-    # Either define all, or none
-    cutout_params_exist = [p is not None for p in (ra, dec, size)]
-    if not all(cutout_params_exist) and any(cutout_params_exist):
-        raise ParameterValueError(
-            "If one of ra, dec, or size is defined, then all must be defined."
-        )
-
-    if align and not any(cutout_params_exist):
-        raise ParameterValueError("align=true is only allowed for cutouts.")
-
-    align_requires = ["jpeg", "png"]
-    if align and format.lower() not in align_requires:
-        raise ParameterValueError(
-            f"align=true requires format={', '.join(align_requires)}"
-        )
+    check_parameters(
+        ra,
+        dec,
+        size,
+        align,
+        format,
+        max_size,
+        bin,
+        quality,
+        compress_level,
+        subsampling,
+        compress,
+    )
 
     if format.lower() == "label":
-        filename, download_filename = label_query(id)
+        filename, download_filename = await run_io(label_query, id)
     else:
-        filename, download_filename = image_query(
-            id, ra=ra, dec=dec, size=size, align=align, format=format
+        parameters: dict = dict(
+            ra=ra,
+            dec=dec,
+            size=size,
+            align=align,
+            format=format,
+            stretch=stretch,
+            max_size=max_size,
+            bin=bin,
+            quality=quality,
+            compress_level=compress_level,
+            subsampling=subsampling,
+            compress=compress,
+            quantize=quantize,
         )
+        try:
+            filename, download_filename = await image_query_async(
+                id, max_cost=ENV.SBNSIS_JOB_THRESHOLD or None, **parameters
+            )
+        except JobRequired as exc:
+            # too costly to render now, continue as a job
+            job: dict = await jobs.submit(
+                {"obs_id": id, **parameters, "download": download}
+            )
+            logger.info(
+                json.dumps(
+                    {
+                        "job_id": job_id.hex,
+                        "job": "images",
+                        "cost": exc.cost,
+                        "image_job": job["job_id"],
+                    }
+                )
+            )
+            return (
+                job,
+                202,
+                {"Location": job["url"], "Content-Type": "application/json"},
+            )
 
     mime_type = MIME_TYPES.get(
         os.path.splitext(download_filename.lower())[1], "text/plain"
@@ -81,9 +197,10 @@ def get_image(
         )
     )
 
-    return send_file(
+    return file_response(
         filename,
-        mimetype=mime_type,
-        as_attachment=download,
-        download_name=download_filename,
+        mime_type,
+        download_filename,
+        ENV.SBNSIS_CACHE_CONTROL_IMAGES,
+        download=download,
     )
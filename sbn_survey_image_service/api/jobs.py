@@ -0,0 +1,107 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import json
+
+from .images import check_parameters
+from .clients import identify_client
+from ..config.logging import get_logger
+from ..config.exceptions import InvalidJob, ParameterValueError
+from ..services import jobs
+from ..services.executors import run_io
+
+
+async def post_job(
+    id: str,
+    ra: float | None = None,
+    dec: float | None = None,
+    size: str | None = None,
+    align: bool = False,
+    format: str = "fits",
+    stretch: str = "image",
+    max_size: int | None = None,
+    bin: int | None = None,
+    quality: int | None = None,
+    compress_level: int | None = None,
+    subsampling: str | None = None,
+    compress: str | None = None,
+    quantize: float | None = None,
+    download: bool = False,
+) -> tuple[dict, int, dict]:
+    """Controller for image job submission."""
+
+    if format.lower() == "label":
+        raise ParameterValueError("Labels are not rendered, use the images endpoint.")
+
+    check_parameters(
+        ra,
+        dec,
+        size,
+        align,
+        format,
+        max_size,
+        bin,
+        quality,
+        compress_level,
+        subsampling,
+        compress,
+    )
+
+    # renders are limited per client
+    identify_client()
+    job: dict = await jobs.submit(
+        dict(
+            obs_id=id,
+            ra=ra,
+            dec=dec,
+            size=size,
+            align=align,
+            format=format,
+            stretch=stretch,
+            max_size=max_size,
+            bin=bin,
+            quality=quality,
+            compress_level=compress_level,
+            subsampling=subsampling,
+            compress=compress,
+            quantize=quantize,
+            download=download,
+        )
+    )
+
+    get_logger().info(
+        json.dumps({"job": "jobs", "job_id": job["job_id"], "phase": job["phase"]})
+    )
+    return job, 202, {"Location": job["url"]}
+
+
+async def _get(job_id: str) -> tuple[jobs.JobQueue, dict]:
+    queue: jobs.JobQueue = jobs.job_queue()
+    job: dict | None = await run_io(queue.get, job_id)
+    if job is None:
+        raise InvalidJob(f"Job {job_id} is unknown or has expired.")
+    return queue, job
+
+
+async def get_job(job_id: str) -> dict:
+    """Controller for job status."""
+
+    queue: jobs.JobQueue
+    job: dict
+    queue, job = await _get(job_id)
+    return queue.describe(job)
+
+
+async def get_result(job_id: str) -> tuple[str, int, dict]:
+    """Controller for job results: redirect to the image.
+
+    Jobs that are not completed redirect to the job, which describes their
+    phase, or error.
+
+    """
+
+    job: dict
+    queue, job = await _get(job_id)
+    if job["phase"] != "COMPLETED":
+        return "", 303, {"Location": queue.describe(job)["url"]}
+
+    return "", 303, {"Location": jobs.result_url(job["parameters"])}
@@ -5,11 +5,16 @@ import uuid
 import logging
 from typing import Dict, List
 
+from starlette.responses import Response
+
+from .caching import json_response
+from ..config.env import ENV
 from ..config.logging import get_logger
 from ..services.metadata import metadata_query
+from ..services.executors import run_io
 
 
-def run_query(
+async def run_query(
     collection: str | None = None,
     facility: str | None = None,
     instrument: str | None = None,
@@ -17,7 +22,7 @@ def run_query(
     format: str = "fits",
     maxrec: int = 100,
     offset: int = 0,
-) -> Dict[str, int | List[dict]]:
+) -> tuple[Dict[str, int | List[dict]], int, dict] | Response:
     """Controller for metadata queries."""
 
     logger: logging.Logger = get_logger()
@@ -38,7 +43,8 @@ def run_query(
         )
     )
 
-    total, results = metadata_query(
+    total, results = await run_io(
+        metadata_query,
         collection=collection,
         facility=facility,
         instrument=instrument,
@@ -48,4 +54,7 @@ def run_query(
         offset=offset,
     )
 
-    return {"total": total, "offset": offset, "count": len(results), "results": results}
+    return json_response(
+        {"total": total, "offset": offset, "count": len(results), "results": results},
+        ENV.SBNSIS_CACHE_CONTROL_QUERY,
+    )
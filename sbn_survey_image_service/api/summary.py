@@ -5,17 +5,22 @@ import uuid
 import logging
 from typing import List
 
+from starlette.responses import Response
+
+from .caching import json_response
+from ..config.env import ENV
 from ..config.logging import get_logger
 from ..services.metadata import metadata_summary
+from ..services.executors import run_io
 
 
-def get_summary() -> List[dict]:
+async def get_summary() -> tuple[List[dict], int, dict] | Response:
     """Controller for summaries."""
 
     logger: logging.Logger = get_logger()
     job_id: uuid.UUID = uuid.uuid4()
     logger.info(json.dumps({"job_id": job_id.hex}))
 
-    summary: List[dict] = metadata_summary()
+    summary: List[dict] = await run_io(metadata_summary)
 
-    return summary
+    return json_response(summary, ENV.SBNSIS_CACHE_CONTROL_SUMMARY)
@@ -0,0 +1,64 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import os
+import json
+import uuid
+import logging
+
+from starlette.responses import Response
+
+from .caching import file_response, json_response
+from .clients import identify_client
+from ..config import MIME_TYPES
+from ..config.env import ENV
+from ..config.logging import get_logger
+from ..services.tiles import pyramid_query_async, tile_query_async
+
+
+async def get_pyramid(
+    id: str, format: str = "jpeg"
+) -> tuple[dict, int, dict] | Response:
+    """Controller for tile pyramid metadata."""
+
+    logger: logging.Logger = get_logger()
+    job_id: uuid.UUID = uuid.uuid4()
+    # renders are limited per client
+    identify_client()
+    logger.info(
+        json.dumps({"job_id": job_id.hex, "job": "tiles", "id": id, "format": format})
+    )
+
+    pyramid: dict = await pyramid_query_async(id, format=format)
+    return json_response(pyramid, ENV.SBNSIS_CACHE_CONTROL_TILES)
+
+
+async def get_tile(id: str, z: int, x: int, y: int, format: str = "jpeg") -> Response:
+    """Controller for image tiles."""
+
+    logger: logging.Logger = get_logger()
+    job_id: uuid.UUID = uuid.uuid4()
+    # renders are limited per client
+    identify_client()
+    logger.info(
+        json.dumps(
+            {
+                "job_id": job_id.hex,
+                "job": "tiles",
+                "id": id,
+                "z": z,
+                "x": x,
+                "y": y,
+                "format": format,
+            }
+        )
+    )
+
+    filename, download_filename = await tile_query_async(id, z, x, y, format=format)
+
+    mime_type = MIME_TYPES.get(
+        os.path.splitext(download_filename.lower())[1], "text/plain"
+    )
+
+    return file_response(
+        filename, mime_type, download_filename, ENV.SBNSIS_CACHE_CONTROL_TILES
+    )
@@ -1,11 +1,21 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 """
-Entry point to Flask-Connexion API
+Entry point to the Connexion API
+
+The API is an ASGI application.  Controllers are coroutines: blocking work is
+run on the worker's executors (`services.executors`), so that each worker
+serves many requests at once.  Each worker starts its render process pool
+(`services.renderpool`) before serving requests.
+
 """
 
+import math
 import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 import connexion
+from connexion.lifecycle import ConnexionRequest, ConnexionResponse
 from connexion.middleware import MiddlewarePosition
 from starlette.middleware.cors import CORSMiddleware
 
@@ -13,10 +23,28 @@ from . import __version__ as version
 from .config.logging import get_logger
 from .config.env import ENV
 from .config.exceptions import SBNSISException
-from .services.database_provider import db_session
+from .services import jobs, renderpool
+from .services.executors import run_io
 
 logger: logging.Logger = get_logger()
-app = connexion.FlaskApp(__name__, specification_dir="api/")
+
+
+@asynccontextmanager
+async def lifespan(app: connexion.AsyncApp) -> AsyncIterator[None]:
+    """Start the render pool with the worker, and stop it on shutdown.
+
+    Jobs left by stopped workers are resumed.
+
+    """
+    await run_io(renderpool.start)
+    await jobs.resume()
+    try:
+        yield
+    finally:
+        await run_io(renderpool.shutdown)
+
+
+app = connexion.AsyncApp(__name__, specification_dir="api/", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,39 +62,49 @@ app.add_api(
         "base_href": ENV.BASE_HREF,
     },
 )
-application = app.app
-
-
-@application.teardown_appcontext
-def shutdown_db_session(exception: Exception = None) -> None:
-    db_session.remove()
 
 
-@application.errorhandler(SBNSISException)
-def handle_sbnsis_error(error: Exception):
+def handle_sbnsis_error(
+    request: ConnexionRequest, error: SBNSISException
+) -> ConnexionResponse:
     """Log errors.
 
     The HTTP status code is based on the exception, or 500 if it is not defined.
+    Exceptions with a ``retry_after`` delay (seconds) set the Retry-After
+    header.
 
     """
 
-    get_logger().exception("SBS Survey Image Service error.")
-    return str(error), getattr(error, "code", 500)
+    get_logger().exception("SBS Survey Image Service error.", exc_info=error)
+    headers: dict = {}
+    if error.retry_after:
+        headers["Retry-After"] = str(int(math.ceil(error.retry_after)))
+    return ConnexionResponse(
+        status_code=getattr(error, "code", 500),
+        body=str(error),
+        content_type="text/plain",
+        headers=headers,
+    )
 
 
-@application.errorhandler(Exception)
-def handle_other_error(error: Exception):
+def handle_other_error(
+    request: ConnexionRequest, error: Exception
+) -> ConnexionResponse:
     """Log errors."""
 
-    get_logger().exception("An error occurred.")
-    return (
-        "Unexpected error.  Please report if the problem persists.",
-        getattr(error, "code", 500),
+    get_logger().exception("An error occurred.", exc_info=error)
+    return ConnexionResponse(
+        status_code=getattr(error, "code", 500),
+        body="Unexpected error.  Please report if the problem persists.",
+        content_type="text/plain",
     )
 
 
+app.add_error_handler(SBNSISException, handle_sbnsis_error)
+app.add_error_handler(Exception, handle_other_error)
+
+
 if __name__ == "__main__":
     # for development
     logger.info("Running " + ENV.APP_NAME)
-    logger.info(application.url_map)
     app.run("sbn_survey_image_service.app:app", host=ENV.API_HOST, port=ENV.API_PORT)
@@ -5,4 +5,6 @@ MIME_TYPES = {
     ".fz": "image/fits",
     ".jpeg": "image/jpeg",
     ".png": "image/png",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
 }
@@ -0,0 +1,265 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Per-collection data profiles.
+
+A profile describes how a survey's data are stored and best read: the FITS
+extensions with the WCS and data, label checks and fixes applied at ingest,
+header fixes, and remote read settings.  Collections are matched to profiles
+by PDS4 logical identifier prefix.
+
+The built-in profiles may be modified, and new profiles added, with a JSON
+file named by SBNSIS_COLLECTIONS, e.g.,
+
+.. code:: json
+
+    [
+      {"name": "atlas", "block_size": 1048576, "read_ahead": 0},
+      {"name": "example", "lid_prefix": "urn:nasa:pds:example.survey",
+       "wcs_ext": 1, "data_ext": 1}
+    ]
+
+Profiles are loaded once, when this module is imported.
+
+"""
+
+__all__ = [
+    "CollectionProfile",
+    "DEFAULT_PROFILE",
+    "BUILTIN_PROFILES",
+    "PROFILES",
+    "load_profiles",
+    "save_profile",
+    "profile",
+]
+
+import os
+import json
+import dataclasses
+from dataclasses import dataclass
+from typing import List
+
+from astropy.io import fits
+
+from .env import ENV
+
+READERS: List[str] = ["auto", "fsspec"]
+
+
+@dataclass(frozen=True)
+class CollectionProfile:
+    """Data storage and access settings for a survey collection.
+
+
+    Parameters
+    ----------
+    name : str
+        Profile name.
+
+    lid_prefix : str
+        Logical identifier prefix of the collection(s).
+
+    wcs_ext, data_ext : int, optional
+        FITS HDU extensions with the WCS and the data.
+
+    image_suffix : str, optional
+        Suffix appended to the labeled file name to form the image URL, e.g.,
+        ".fz" for a locally compressed archive.
+
+    pixel_scales : tuple, optional
+        (substring, arcsec) pairs: the pixel scale for logical identifiers
+        containing substring, overriding the label.  The first match is used;
+        use an empty substring for the default.
+
+    label_check : str, optional
+        Name of the label validation at ingest, see
+        `~sbn_survey_image_service.data.add.LABEL_CHECKS`.
+
+    header_fixes : tuple of str, optional
+        Header keywords to remove before interpreting the WCS.
+
+    block_size : int, optional
+        Remote read block size in bytes.  Default: SBNSIS_BLOCK_SIZE.
+
+    cache_type : str, optional
+        fsspec cache type for remote reads.  Default: the persistent block
+        cache.
+
+    read_ahead : int, optional
+        Blocks to read ahead after a block cache miss.  Default:
+        SBNSIS_READ_AHEAD.
+
+    reader : str, optional
+        "auto" to memory map local files and use fsspec for remote files, or
+        "fsspec" to always use fsspec.
+
+    mirrors : tuple, optional
+        (prefix, mirror) pairs: remote URLs starting with prefix are also
+        available with the prefix replaced by mirror, for hedged reads (see
+        `~sbn_survey_image_service.services.hedge`).
+
+    """
+
+    name: str
+    lid_prefix: str
+    wcs_ext: int = 0
+    data_ext: int = 0
+    image_suffix: str = ""
+    pixel_scales: tuple[tuple[str, float], ...] = ()
+    label_check: str = ""
+    header_fixes: tuple[str, ...] = ()
+    block_size: int | None = None
+    cache_type: str | None = None
+    read_ahead: int | None = None
+    reader: str = "auto"
+    mirrors: tuple[tuple[str, str], ...] = ()
+
+    def __post_init__(self) -> None:
+        if self.reader not in READERS:
+            raise ValueError(f"Invalid reader for profile {self.name}: {self.reader}")
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "CollectionProfile":
+        """Profile from JSON-compatible values, i.e., lists for tuples."""
+
+        d = dict(d)
+        if "pixel_scales" in d:
+            d["pixel_scales"] = tuple(tuple(x) for x in d["pixel_scales"])
+        if "header_fixes" in d:
+            d["header_fixes"] = tuple(d["header_fixes"])
+        if "mirrors" in d:
+            d["mirrors"] = tuple(tuple(x) for x in d["mirrors"])
+        return cls(**d)
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+    def pixel_scale(self, lid: str) -> float | None:
+        """Pixel scale override for an image, in degrees."""
+
+        for substring, scale in self.pixel_scales:
+            if substring in lid:
+                return scale / 3600
+        return None
+
+    def fix_header(self, header: fits.Header) -> fits.Header:
+        """Remove problematic keywords from a header, in place."""
+
+        for keyword in self.header_fixes:
+            header.remove(keyword, ignore_missing=True, remove_all=True)
+        return header
+
+
+DEFAULT_PROFILE: CollectionProfile = CollectionProfile(name="default", lid_prefix="")
+
+BUILTIN_PROFILES: List[CollectionProfile] = [
+    CollectionProfile(
+        name="neat",
+        lid_prefix="urn:nasa:pds:gbo.ast.neat.survey",
+        wcs_ext=1,
+        data_ext=1,
+        # our archive is compressed
+        image_suffix=".fz",
+        pixel_scales=(("geodss", 1.43), ("", 1.01)),
+        label_check="neat",
+        # these cause wcslib to look for DSS distortion keywords
+        header_fixes=("XPIXELSZ", "YPIXELSZ"),
+    ),
+    CollectionProfile(
+        name="atlas",
+        lid_prefix="urn:nasa:pds:gbo.ast.atlas.survey",
+        wcs_ext=1,
+        data_ext=1,
+        # local ATLAS archive is compressed
+        image_suffix=".fz",
+        label_check="atlas",
+    ),
+]
+
+
+def load_profiles(path: str = "") -> dict[str, CollectionProfile]:
+    """Built-in profiles, updated with those in a JSON file.
+
+    Entries with the name of a built-in profile replace the given settings.
+    Other entries define new profiles.
+
+
+    Parameters
+    ----------
+    path : str, optional
+        The JSON file name.  Ignored if empty or the file does not exist.
+
+
+    Returns
+    -------
+    profiles : dict
+        Profiles keyed by name.
+
+    """
+
+    profiles: dict[str, CollectionProfile] = {p.name: p for p in BUILTIN_PROFILES}
+    if not path or not os.path.exists(path):
+        return profiles
+
+    with open(path) as inf:
+        entries: List[dict] = json.load(inf)
+
+    for entry in entries:
+        name: str = entry["name"]
+        if name in profiles:
+            entry = {**profiles[name].to_dict(), **entry}
+        profiles[name] = CollectionProfile.from_dict(entry)
+
+    return profiles
+
+
+def save_profile(path: str, name: str, **settings) -> None:
+    """Save profile settings to a JSON profile file.
+
+    The file is created, or the named entry is updated, as needed.
+
+
+    Parameters
+    ----------
+    path : str
+        The JSON file name.
+
+    name : str
+        The profile name.
+
+    **settings
+        Profile settings to save.
+
+    """
+
+    entries: List[dict] = []
+    if os.path.exists(path):
+        with open(path) as inf:
+            entries = json.load(inf)
+
+    for entry in entries:
+        if entry["name"] == name:
+            entry.update(settings)
+            break
+    else:
+        entries.append({"name": name, **settings})
+
+    with open(path, "w") as outf:
+        json.dump(entries, outf, indent=2)
+
+
+PROFILES: dict[str, CollectionProfile] = load_profiles(ENV.SBNSIS_COLLECTIONS)
+
+
+def profile(lid: str) -> CollectionProfile:
+    """The profile for a collection or image logical identifier.
+
+    The profile with the longest matching prefix is used, or else
+    `DEFAULT_PROFILE`.
+
+    """
+
+    matches: List[CollectionProfile] = [
+        p for p in PROFILES.values() if p.lid_prefix and lid.startswith(p.lid_prefix)
+    ]
+    if len(matches) == 0:
+        return DEFAULT_PROFILE
+    return max(matches, key=lambda p: len(p.lid_prefix))
@@ -25,7 +25,43 @@ class SBNSISEnvironment:
     # Data parameters
     TEST_DATA_PATH: str = os.path.abspath("./data/test")
     SBNSIS_CUTOUT_CACHE: str = "/tmp"
+    SBNSIS_COLLECTIONS: str = ""
+    SBNSIS_STORAGE: str = ""
+    SBNSIS_BLOCK_CACHE: str = ""
+    SBNSIS_BLOCK_CACHE_SIZE: int = 4096
+    SBNSIS_BLOCK_SIZE: int = 524288
+    SBNSIS_READ_AHEAD: int = 1
+    SBNSIS_DECOMPRESS_THREADS: int = 4
+    SBNSIS_ACCESS_WINDOW: float = 24.0
+    SBNSIS_MIRROR: str = ""
+    SBNSIS_MIRROR_SIZE: int = 16384
+    SBNSIS_MIRROR_THRESHOLD: int = 5
+    SBNSIS_TRANSCODE: str = ""
+    SBNSIS_TRANSCODE_SIZE: int = 16384
+    SBNSIS_TRANSCODE_THRESHOLD: int = 5
+    SBNSIS_CONNECT_TIMEOUT: float = 5.0
+    SBNSIS_READ_TIMEOUT: float = 30.0
+    SBNSIS_HOST_CONCURRENCY: int = 8
+    SBNSIS_RETRIES: int = 2
+    SBNSIS_BREAKER_THRESHOLD: int = 5
+    SBNSIS_BREAKER_RESET: float = 30.0
+    SBNSIS_HEDGE_PERCENTILE: float = 95.0
+    SBNSIS_HEDGE_BUDGET: float = 0.05
     MAXIMUM_CUTOUT_SIZE: int = 1024
+    SBNSIS_RENDER_MEMORY_LIMIT: int = 2048
+    SBNSIS_RENDER_COST_LIMIT: float = 5e7
+    SBNSIS_CLIENT_RATE: float = 2e7
+    SBNSIS_CLIENT_BURST: float = 2e8
+    SBNSIS_CLIENT_RENDERS: int = 2
+    SBNSIS_TRUSTED_PROXIES: str = "127.0.0.1,::1"
+    SBNSIS_GLOBAL_RATE: float = -1.0
+    SBNSIS_JOB_THRESHOLD: float = 0.0
+    SBNSIS_JOB_EXPIRY: float = 24.0
+    SBNSIS_CACHE_CONTROL_IMAGES: str = "public, max-age=86400"
+    SBNSIS_CACHE_CONTROL_TILES: str = "public, max-age=86400"
+    SBNSIS_CACHE_CONTROL_QUERY: str = "public, max-age=300"
+    SBNSIS_CACHE_CONTROL_SUMMARY: str = "public, max-age=300"
+    SBNSIS_TRACE_MEMORY: str = "FALSE"
 
     # Database parameters
     DB_HOST: str = ""
@@ -36,6 +72,9 @@ class SBNSISEnvironment:
 
     # Gunicorn parameters
     LIVE_GUNICORN_INSTANCES: int = -1
+    SBNSIS_IO_THREADS: int = 32
+    SBNSIS_RENDER_PROCESSES: int = -1
+    SBNSIS_RENDER_QUEUE: int = 32
     APP_NAME: str = "sbnsis-service"
     API_HOST: str = "127.0.0.1"
     API_PORT: int = 5000
@@ -57,7 +96,12 @@ class SBNSISEnvironment:
                 setattr(self, key, value_type(value))
 
         if self.LIVE_GUNICORN_INSTANCES < 0:
-            self.LIVE_GUNICORN_INSTANCES = multiprocessing.cpu_count() * 2
+            self.LIVE_GUNICORN_INSTANCES = multiprocessing.cpu_count()
+
+        if self.SBNSIS_RENDER_PROCESSES < 0:
+            self.SBNSIS_RENDER_PROCESSES = max(
+                1, multiprocessing.cpu_count() // self.LIVE_GUNICORN_INSTANCES
+            )
 
 
 ENV: SBNSISEnvironment = SBNSISEnvironment()
@@ -93,6 +137,62 @@ DB_DATABASE={SBNSISEnvironment.DB_DATABASE}
 # Local cache location for served data
 SBNSIS_CUTOUT_CACHE={SBNSISEnvironment.SBNSIS_CUTOUT_CACHE}
 
+# JSON file of collection profiles, modifying or adding to the built-in
+# profiles (see sbnsis benchmark)
+SBNSIS_COLLECTIONS={SBNSISEnvironment.SBNSIS_COLLECTIONS}
+
+# JSON file of archive storage locations, in lookup order, e.g., a local
+# mirror of the archive to read instead of the image URLs
+SBNSIS_STORAGE={SBNSISEnvironment.SBNSIS_STORAGE}
+
+# Block cache for remote images: location (default: "blocks" in the cutout
+# cache), maximum size in MiB (0 to disable), block size in bytes, and number of
+# blocks to read ahead
+SBNSIS_BLOCK_CACHE={SBNSISEnvironment.SBNSIS_BLOCK_CACHE}
+SBNSIS_BLOCK_CACHE_SIZE={SBNSISEnvironment.SBNSIS_BLOCK_CACHE_SIZE}
+SBNSIS_BLOCK_SIZE={SBNSISEnvironment.SBNSIS_BLOCK_SIZE}
+SBNSIS_READ_AHEAD={SBNSISEnvironment.SBNSIS_READ_AHEAD}
+
+# Number of threads used to decompress tile-compressed images, per worker
+SBNSIS_DECOMPRESS_THREADS={SBNSISEnvironment.SBNSIS_DECOMPRESS_THREADS}
+
+# Image accesses are counted over this many hours to find frequently used
+# images
+SBNSIS_ACCESS_WINDOW={SBNSISEnvironment.SBNSIS_ACCESS_WINDOW}
+
+# Local mirror of frequently used remote images: location (default: "mirror"
+# in the cutout cache), maximum size in MiB (0 to disable), and number of
+# accesses before an image is considered for mirroring
+SBNSIS_MIRROR={SBNSISEnvironment.SBNSIS_MIRROR}
+SBNSIS_MIRROR_SIZE={SBNSISEnvironment.SBNSIS_MIRROR_SIZE}
+SBNSIS_MIRROR_THRESHOLD={SBNSISEnvironment.SBNSIS_MIRROR_THRESHOLD}
+
+# Uncompressed copies of frequently read tile-compressed images: location
+# (default: "raw" in the cutout cache), maximum size in MiB (0 to disable), and
+# number of accesses before an image is transcoded
+SBNSIS_TRANSCODE={SBNSISEnvironment.SBNSIS_TRANSCODE}
+SBNSIS_TRANSCODE_SIZE={SBNSISEnvironment.SBNSIS_TRANSCODE_SIZE}
+SBNSIS_TRANSCODE_THRESHOLD={SBNSISEnvironment.SBNSIS_TRANSCODE_THRESHOLD}
+
+# Remote archive requests: connect and read timeouts in seconds, maximum
+# concurrent requests per archive host (shared by all workers), and retries
+# after a timeout or server error
+SBNSIS_CONNECT_TIMEOUT={SBNSISEnvironment.SBNSIS_CONNECT_TIMEOUT}
+SBNSIS_READ_TIMEOUT={SBNSISEnvironment.SBNSIS_READ_TIMEOUT}
+SBNSIS_HOST_CONCURRENCY={SBNSISEnvironment.SBNSIS_HOST_CONCURRENCY}
+SBNSIS_RETRIES={SBNSISEnvironment.SBNSIS_RETRIES}
+
+# Circuit breaker: after this many consecutive failed requests to an archive
+# host, requests fail immediately (HTTP 503) for SBNSIS_BREAKER_RESET seconds
+SBNSIS_BREAKER_THRESHOLD={SBNSISEnvironment.SBNSIS_BREAKER_THRESHOLD}
+SBNSIS_BREAKER_RESET={SBNSISEnvironment.SBNSIS_BREAKER_RESET}
+
+# Hedged reads from collection mirrors: a remote read slower than this
+# percentile of recent reads from the same host is also requested from a
+# mirror, for at most this fraction of extra requests (0 to disable)
+SBNSIS_HEDGE_PERCENTILE={SBNSISEnvironment.SBNSIS_HEDGE_PERCENTILE}
+SBNSIS_HEDGE_BUDGET={SBNSISEnvironment.SBNSIS_HEDGE_BUDGET}
+
 ################################
 # Editing generally not needed #
 ################################
@@ -112,10 +212,63 @@ PUBLIC_URL=https://sbnsurveys.astro.umd.edu/api
 # Cutout CONFIG
 MAXIMUM_CUTOUT_SIZE={SBNSISEnvironment.MAXIMUM_CUTOUT_SIZE}
 
+# Approximate memory limit for rendering a JPEG or PNG image, in MiB; larger
+# requests are rejected, 0 for no limit
+SBNSIS_RENDER_MEMORY_LIMIT={SBNSISEnvironment.SBNSIS_RENDER_MEMORY_LIMIT}
+
+# Approximate limit for the cost of rendering one image, in pixels read and
+# rendered; larger browse images are downsampled, 0 for no limit
+SBNSIS_RENDER_COST_LIMIT={SBNSISEnvironment.SBNSIS_RENDER_COST_LIMIT}
+
+# Render budget per client and worker: pixels per second, maximum burst, and
+# concurrent renders; 0 for no limit
+SBNSIS_CLIENT_RATE={SBNSISEnvironment.SBNSIS_CLIENT_RATE}
+SBNSIS_CLIENT_BURST={SBNSISEnvironment.SBNSIS_CLIENT_BURST}
+SBNSIS_CLIENT_RENDERS={SBNSISEnvironment.SBNSIS_CLIENT_RENDERS}
+
+# Comma-separated addresses or networks of reverse proxies whose
+# X-Forwarded-For headers identify clients for the render budget
+SBNSIS_TRUSTED_PROXIES={SBNSISEnvironment.SBNSIS_TRUSTED_PROXIES}
+
+# Render budget per worker, pixels per second; if -1 then it's determined by
+# the number of render processes, 0 for no limit
+SBNSIS_GLOBAL_RATE={SBNSISEnvironment.SBNSIS_GLOBAL_RATE}
+
+# Images estimated to cost more than this many pixels to render are requested
+# as asynchronous jobs: the images endpoint answers 202 with a link to the
+# job; 0 to always render synchronously
+SBNSIS_JOB_THRESHOLD={SBNSISEnvironment.SBNSIS_JOB_THRESHOLD}
+
+# Hours to keep finished jobs
+SBNSIS_JOB_EXPIRY={SBNSISEnvironment.SBNSIS_JOB_EXPIRY}
+
+# Cache-Control headers for the images (and labels), tiles, query, and summary
+# endpoints; leave empty for none.  Responses also carry ETag (and for files,
+# Last-Modified) validators, so that caches may revalidate them
+SBNSIS_CACHE_CONTROL_IMAGES="{SBNSISEnvironment.SBNSIS_CACHE_CONTROL_IMAGES}"
+SBNSIS_CACHE_CONTROL_TILES="{SBNSISEnvironment.SBNSIS_CACHE_CONTROL_TILES}"
+SBNSIS_CACHE_CONTROL_QUERY="{SBNSISEnvironment.SBNSIS_CACHE_CONTROL_QUERY}"
+SBNSIS_CACHE_CONTROL_SUMMARY="{SBNSISEnvironment.SBNSIS_CACHE_CONTROL_SUMMARY}"
+
+# Set to TRUE to log the peak memory allocated while rendering each image
+# (slower)
+SBNSIS_TRACE_MEMORY={SBNSISEnvironment.SBNSIS_TRACE_MEMORY}
+
 # Gunicorn settings
 # if LIVE_GUNICORN_INSTANCES==-1 then it's determined by CPU count
 LIVE_GUNICORN_INSTANCES={SBNSISEnvironment.LIVE_GUNICORN_INSTANCES}
 
+# Threads per worker for database queries, label look ups, and cached images
+SBNSIS_IO_THREADS={SBNSISEnvironment.SBNSIS_IO_THREADS}
+
+# Render processes per worker for cutouts, browse images, and tile pyramids;
+# if -1 then the CPUs are divided among the gunicorn workers, if 0 then images
+# are rendered by the worker's threads
+SBNSIS_RENDER_PROCESSES={SBNSISEnvironment.SBNSIS_RENDER_PROCESSES}
+
+# Maximum number of render jobs waiting per worker; more are rejected
+SBNSIS_RENDER_QUEUE={SBNSISEnvironment.SBNSIS_RENDER_QUEUE}
+
 # local file path for generated test data set
 TEST_DATA_PATH={SBNSISEnvironment.TEST_DATA_PATH}
 
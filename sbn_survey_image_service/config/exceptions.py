@@ -8,7 +8,14 @@ codes.
 
 
 class SBNSISException(Exception):
-    """Generic SBN Survey Image Service exception."""
+    """Generic SBN Survey Image Service exception.
+
+    ``retry_after``, if set, is the suggested delay in seconds before trying
+    again.
+
+    """
+
+    retry_after: float | None = None
 
 
 class InvalidImageID(SBNSISException):
@@ -17,6 +24,83 @@ class InvalidImageID(SBNSISException):
     code = 404
 
 
+class InvalidTile(SBNSISException):
+    """Image tile is not in the pyramid."""
+
+    code = 404
+
+
+class ImageTooLarge(SBNSISException):
+    """Image is too large to process within the memory budget."""
+
+    code = 422
+
+
+class UpstreamUnavailable(SBNSISException):
+    """Remote archive is not responding.
+
+    ``retry_after`` is the suggested delay in seconds before trying again.
+
+    """
+
+    code = 503
+    retry_after: float
+
+    def __init__(self, message: str, retry_after: float = 0) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RenderQueueFull(SBNSISException):
+    """Too many render jobs are waiting.
+
+    ``retry_after`` is the suggested delay in seconds before trying again.
+
+    """
+
+    code = 503
+    retry_after: float
+
+    def __init__(self, message: str, retry_after: float = 0) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TooManyRequests(SBNSISException):
+    """Client or service render budget is spent.
+
+    ``retry_after`` is the suggested delay in seconds before trying again.
+
+    """
+
+    code = 429
+    retry_after: float
+
+    def __init__(self, message: str, retry_after: float = 0) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobRequired(SBNSISException):
+    """Request is too costly to answer synchronously, submit a job instead.
+
+    ``cost`` is the estimated cost in pixels.
+
+    """
+
+    code = 202
+
+    def __init__(self, message: str, cost: float = 0) -> None:
+        super().__init__(message)
+        self.cost = cost
+
+
+class InvalidJob(SBNSISException):
+    """Job ID is unknown or expired."""
+
+    code = 404
+
+
 class InvalidImageURL(SBNSISException):
     """Image URL is invalid."""
 
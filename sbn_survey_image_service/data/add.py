@@ -5,11 +5,13 @@ May be run as a command-line script via python3 -m sbn_survey_image_service.data
 
 """
 
+import io
 import os
+import asyncio
 import logging
 import argparse
 from urllib.parse import urlparse, urlunparse
-from typing import Dict, List
+from typing import Callable, Dict, List
 import xml.etree.ElementTree as ET
 
 import numpy as np
@@ -25,9 +27,11 @@ from ..config.exceptions import (
     SBNSISWarning,
 )
 from ..services.database_provider import data_provider_session, db_engine
+from .remote import is_remote, fetch_labels
 from ..models import Base
 from ..models.image import Image
 from ..config.logging import get_logger
+from ..config.collections import CollectionProfile, profile
 
 
 def _remove_prefix(s: str, prefix: str):
@@ -51,24 +55,20 @@ PDS4CalibrationLevel = {
 }
 
 
-def add_label(
+def label_to_image(
     label_path: str,
-    session: Session,
     base_url: str = "file://",
     strip_leading: str = "",
     relax: bool = False,
-    dry_run: bool = False,
-) -> bool:
-    """Add label and image data to database.
+    content: bytes | None = None,
+) -> Image | None:
+    """Read a label and form the image data object with proper URLs.
 
 
     Parameters
     ----------
     label_path : string
-        Local path to PDS label.
-
-    session : sqlalchemy Session
-        Database session object.
+        Local path or URL to PDS label.
 
     base_url : str, optional
         Prepend the file path with this string to form a URL.  Default is to
@@ -80,14 +80,16 @@ def add_label(
     relax : bool, optional
         Set to ``True`` and errors will be logged, but otherwise ignored.
 
-    dry_run : bool, optional
-        Do everything other than update the database.
+    content : bytes, optional
+        The label itself, e.g., previously fetched from ``label_path``.  If
+        ``None``, then the label is read from ``label_path``.
 
 
     Returns
     -------
-    success : bool
-        ``True``, if the label was successfully added.
+    im : Image or None
+        The image data object, or ``None`` if the label could not be read and
+        ``relax`` is ``True``.
 
     """
 
@@ -95,16 +97,16 @@ def add_label(
 
     exc: Exception
     try:
-        im = pds4_image(label_path)
+        im = pds4_image(label_path, content=content)
     except SBNSISWarning as exc:
         logger.warning(exc)
         if relax:
-            return False
+            return None
         raise exc
     except (LabelError, InvalidImageURL) as exc:
         logger.error(exc)
         if relax:
-            return False
+            return None
         raise exc
 
     # make proper URLs
@@ -115,6 +117,57 @@ def add_label(
         "".join((base_url, _remove_prefix(im.image_url, strip_leading)))
     )
 
+    return im
+
+
+def add_label(
+    label_path: str,
+    session: Session,
+    base_url: str = "file://",
+    strip_leading: str = "",
+    relax: bool = False,
+    dry_run: bool = False,
+) -> bool:
+    """Add label and image data to database.
+
+
+    Parameters
+    ----------
+    label_path : string
+        Local path to PDS label.
+
+    session : sqlalchemy Session
+        Database session object.
+
+    base_url : str, optional
+        Prepend the file path with this string to form a URL.  Default is to
+        use file://.
+
+    strip_leading : str, optional
+        Remove this leading string from the path before forming the URL.
+
+    relax : bool, optional
+        Set to ``True`` and errors will be logged, but otherwise ignored.
+
+    dry_run : bool, optional
+        Do everything other than update the database.
+
+
+    Returns
+    -------
+    success : bool
+        ``True``, if the label was successfully added.
+
+    """
+
+    logger: logging.Logger = get_logger()
+
+    im: Image | None = label_to_image(
+        label_path, base_url=base_url, strip_leading=strip_leading, relax=relax
+    )
+    if im is None:
+        return False
+
     count = session.query(Image).where(Image.obs_id == im.obs_id).count()
     if count != 0:
         # obs_id already exists
@@ -128,7 +181,108 @@ def add_label(
     return True
 
 
-def pds4_image(label_path: str) -> Image:
+class ImageBatch:
+    """Add images to the database in batches.
+
+    Duplicate observation IDs are tested once per batch, rather than once per
+    image, and each batch is committed as a single transaction.
+
+
+    Parameters
+    ----------
+    session : sqlalchemy Session
+        Database session object.
+
+    batch_size : int, optional
+        Write to the database after this many images have been queued.
+
+    dry_run : bool, optional
+        Do everything other than update the database.
+
+    update : bool, optional
+        Set to ``True`` to update images already in the database, e.g., for
+        revised labels.  Otherwise, they are skipped.
+
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        batch_size: int = 1000,
+        dry_run: bool = False,
+        update: bool = False,
+    ):
+        self.session = session
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.update = update
+        self.images: Dict[str, Image] = {}
+        self.n_added: int = 0
+        self.n_updated: int = 0
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def add(self, im: Image) -> None:
+        """Queue an image for addition, flushing the batch as needed."""
+        if self.update:
+            # the latest version wins
+            self.images[im.obs_id] = im
+        else:
+            self.images.setdefault(im.obs_id, im)
+        if len(self.images) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write queued images to the database.
+
+
+        Returns
+        -------
+        n : int
+            The number of images added, i.e., excluding those already in the
+            database.
+
+        """
+
+        if len(self.images) == 0:
+            return 0
+
+        existing: Dict[str, Image] = {
+            im.obs_id: im
+            for im in self.session.query(Image).where(
+                Image.obs_id.in_(list(self.images.keys()))
+            )
+        }
+        new: List[Image] = [
+            im for obs_id, im in self.images.items() if obs_id not in existing
+        ]
+
+        n_updated: int = 0
+        if self.update and not self.dry_run:
+            for obs_id, row in existing.items():
+                for column in Image.__table__.columns:
+                    value = getattr(self.images[obs_id], column.name)
+                    # column defaults are only applied on insert
+                    if column.primary_key or (value is None and column.default):
+                        continue
+                    setattr(row, column.name, value)
+                n_updated += self.session.is_modified(row)
+        self.images = {}
+
+        if not self.dry_run:
+            self.session.add_all(new)
+            self.session.commit()
+
+        self.n_added += len(new)
+        self.n_updated += n_updated
+        get_logger().debug(
+            "Added %d and updated %d images in the database", len(new), n_updated
+        )
+        return len(new)
+
+
+def pds4_image(label_path: str, content: bytes | None = None) -> Image:
     """Examine PDS4 label for image data product ID and file name.
 
     This function may need to be edited when adding a new
@@ -138,7 +292,11 @@ def pds4_image(label_path: str) -> Image:
     Parameters
     ----------
     label_path : str
-        Path to the data label.
+        Path or URL to the data label.
+
+    content : bytes, optional
+        The label itself.  If ``None``, then the label is read from
+        ``label_path``.
 
     Returns
     -------
@@ -149,7 +307,8 @@ def pds4_image(label_path: str) -> Image:
     exc: Exception
     try:
         label: ET.ElementTree = pds4_read_label(
-            label_path, enforce_default_prefixes=True
+            label_path if content is None else io.BytesIO(content),
+            enforce_default_prefixes=True,
         )
     except Exception as exc:
         raise PDS4LabelError(str(exc)) from exc
@@ -190,19 +349,16 @@ def pds4_image(label_path: str) -> Image:
         # probably not a useful label
         raise PDS4LabelError(str(exc)) from exc
 
-    # is this in a recognized data collection that needs special handling?
-    fz_compressed: bool = False  # some of our archive is compressed
-    if lid.startswith("urn:nasa:pds:gbo.ast.neat.survey"):
-        fz_compressed = True
-        test_valid_neat_image(label_path, label)
-        im.pixel_scale = (1.43 if "geodss" in lid else 1.01) / 3600
-    elif lid.startswith("urn:nasa:pds:gbo.ast.atlas.survey"):
-        # local ATLAS archive is compressed
-        fz_compressed = True
-        test_valid_atlas_image(label_path, label)
+    # does this collection need special handling?
+    p: CollectionProfile = profile(lid)
+    if p.label_check:
+        LABEL_CHECKS[p.label_check](label_path, label)
+
+    pixel_scale: float | None = p.pixel_scale(lid)
+    if pixel_scale is not None:
+        im.pixel_scale = pixel_scale
 
-    if fz_compressed:
-        im.image_url += ".fz"
+    im.image_url += p.image_suffix
 
     return im
 
@@ -261,6 +417,13 @@ def test_valid_atlas_image(label_path: str, label: ET.ElementTree) -> None:
         )
 
 
+# label validation for collection profiles
+LABEL_CHECKS: Dict[str, Callable[[str, ET.ElementTree], None]] = {
+    "neat": test_valid_neat_image,
+    "atlas": test_valid_atlas_image,
+}
+
+
 def add_directory(
     path: str,
     session: Session,
@@ -320,13 +483,97 @@ def add_directory(
     )
 
 
+def add_remote(
+    urls: List[str],
+    session: Session,
+    recursive: bool = False,
+    extensions: List[str] | None = None,
+    max_connections: int = 10,
+    batch_size: int = 1000,
+    relax: bool = True,
+    dry_run: bool = False,
+) -> None:
+    """Crawl remote directories for labels and add to database.
+
+    Labels are fetched concurrently and written to the database in batches.
+    Image URLs are formed relative to the label URLs.  Labels are parsed and
+    batches are written in a thread, so that fetches continue meanwhile.
+
+
+    Parameters
+    ----------
+    urls : list of str
+        Directory (ending with "/") or label URLs.
+
+    session : sqlalchemy Session
+        Database session object.
+
+    recursive : bool, optional
+        Set to ``True`` to recursively search directories.
+
+    extensions : list of strings, optional
+        Files with these extensions are considered PDS labels.  Default:
+        .xml.
+
+    max_connections : int, optional
+        Maximum number of concurrent HTTP requests.
+
+    batch_size : int, optional
+        Number of images per database transaction.
+
+    relax : bool, optional
+        Set to ``False`` to stop at the first label error.  By default, label
+        errors are logged and the label is skipped.
+
+    dry_run : bool, optional
+        Do everything other than update the database.
+
+    """
+
+    logger: logging.Logger = get_logger()
+    logger.info("Searching %d remote location(s)", len(urls))
+
+    batch: ImageBatch = ImageBatch(session, batch_size=batch_size, dry_run=dry_run)
+
+    async def crawl() -> int:
+        n_files: int = 0
+        async for url, content in fetch_labels(
+            urls,
+            recursive=recursive,
+            extensions=extensions,
+            max_connections=max_connections,
+        ):
+            n_files += 1
+            im: Image | None = await asyncio.to_thread(
+                label_to_image, url, base_url="", relax=relax, content=content
+            )
+            if im is not None:
+                await asyncio.to_thread(batch.add, im)
+
+        await asyncio.to_thread(batch.flush)
+        return n_files
+
+    n_files: int = asyncio.run(crawl())
+
+    logger.info(
+        "Found %d remote labels, %d added.",
+        n_files,
+        batch.n_added,
+    )
+
+
 def _parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Add data to SBN Survey Image Service database.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
     parser.add_argument(
-        "labels_or_directories", nargs="+", help="PDS labels or directories"
+        "labels_or_directories",
+        nargs="+",
+        help=(
+            "PDS labels or directories; HTTP(S) URLs are crawled remotely,"
+            " directory URLs must end with /"
+        ),
     )
     parser.add_argument(
         "-r", action="store_true", help="recursively search directories"
@@ -353,6 +600,28 @@ def _parse_args() -> argparse.Namespace:
         default="",
         help="strip this leading string before forming the URL",
     )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=10,
+        help="maximum number of concurrent HTTP requests for remote URLs",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="number of images per database transaction for remote URLs",
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="stop at the first invalid remote label, rather than skipping it",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="do everything other than update the database",
+    )
     parser.add_argument("-v", action="store_true", help="verbose logging")
     return parser.parse_args()
 
@@ -364,14 +633,33 @@ def __main__() -> None:
     logger.setLevel(logging.DEBUG if args.v else logging.INFO)
 
     # options to pass on to add_* functions:
-    kwargs = dict(base_url=args.base_url, strip_leading=args.strip_leading.rstrip("/"))
+    kwargs = dict(
+        base_url=args.base_url,
+        strip_leading=args.strip_leading.rstrip("/"),
+        dry_run=args.dry_run,
+    )
     session: Session
     with data_provider_session() as session:
         if args.create:
             Base.metadata.create_all(db_engine)
 
+        remote: List[str] = [ld for ld in args.labels_or_directories if is_remote(ld)]
+        if len(remote) > 0:
+            add_remote(
+                remote,
+                session,
+                recursive=args.r,
+                extensions=args.e,
+                max_connections=args.max_connections,
+                batch_size=args.batch_size,
+                relax=not args.strict,
+                dry_run=args.dry_run,
+            )
+
         for ld in args.labels_or_directories:
-            if os.path.isdir(ld):
+            if is_remote(ld):
+                continue
+            elif os.path.isdir(ld):
                 add_directory(
                     ld, session, recursive=args.r, extensions=args.e, **kwargs
                 )
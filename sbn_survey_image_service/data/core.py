@@ -1,41 +1,74 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 """Data functions."""
 
-__all__ = ["url_to_local_file", "generate_cache_filename"]
+__all__ = [
+    "url_to_local_file",
+    "generate_cache_filename",
+    "atomic_write",
+    "try_lock",
+]
 
 import os
+import fcntl
+import shutil
 import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Iterator
+import fsspec
 import requests
 from requests.models import HTTPError
 from urllib.parse import urlparse
 
 from ..config.env import ENV
 from ..services import network
+from ..services.upstream import timeouts
+from ..services.hedge import hedged_request
 
 
-def url_to_local_file(url: str) -> str:
-    """Returns path to a local file, fetching remote files as needed."""
+def url_to_local_file(url: str, storage_options: dict | None = None) -> str:
+    """Returns path to a local file, fetching remote files as needed.
+
+
+    Parameters
+    ----------
+    url : str
+        File name, or file or HTTP URL.  Other protocols are read with fsspec.
+
+    storage_options : dict, optional
+        fsspec storage options for the URL.
+
+    """
 
     p = urlparse(url)
-    if p.scheme == "file":
-        path = os.path.abspath(p.path)
-    else:
+    if p.scheme in ["", "file"]:
+        return os.path.abspath(p.path)
+
+    path = generate_cache_filename(url)
+    hedged_request(url, _download, path, storage_options)
+
+    # rw-rw-r--
+    # In [16]: (stat.S_IFREG | stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)
+    # Out[16]: 33204
+    os.chmod(path, 33204)
+
+    return path
+
+
+def _download(url: str, path: str, storage_options: dict | None) -> None:
+    if urlparse(url).scheme in ["http", "https"]:
         with network.session() as s:
-            s = requests.get(url)
+            s = requests.get(url, timeout=timeouts())
 
             if s.status_code != 200:
-                raise HTTPError(s.status_code)
+                raise HTTPError(s.status_code, response=s)
 
-            path = generate_cache_filename(url)
-            with open(path, "wb") as outf:
+            with atomic_write(path) as outf:
                 outf.write(s.content)
-
-        # rw-rw-r--
-        # In [16]: (stat.S_IFREG | stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)
-        # Out[16]: 33204
-        os.chmod(path, 33204)
-
-    return path
+    else:
+        with fsspec.open(url, "rb", **(storage_options or {})) as inf:
+            with atomic_write(path) as outf:
+                shutil.copyfileobj(inf, outf)
 
 
 def generate_cache_filename(*args: str) -> str:
@@ -52,3 +85,78 @@ def generate_cache_filename(*args: str) -> str:
     m = hashlib.md5()
     m.update("".join(args).encode())
     return os.path.join(ENV.SBNSIS_CUTOUT_CACHE, m.hexdigest())
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "wb") -> Iterator[IO]:
+    """Write a file to a temporary name, then move it into place.
+
+    Readers never see a partially written file.  The file permissions are set
+    to rw-rw-r--.  On error, the temporary file is removed and ``path`` is
+    unchanged.
+
+
+    Parameters
+    ----------
+    path : str
+        The file name.
+
+    mode : str, optional
+        File mode: "wb" or "w".
+
+    """
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as outf:
+            yield outf
+        os.chmod(tmp, 33204)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+@contextmanager
+def try_lock(path: str) -> Iterator[bool]:
+    """Take an exclusive lock file, without waiting.
+
+    Yields ``True`` if the lock was taken, else ``False``.  The lock file is
+    removed before the lock is released.  A process that opened the file
+    before it was removed does not take the lock, so that at most one process
+    holds a lock by this name.
+
+
+    Parameters
+    ----------
+    path : str
+        The lock file name.
+
+    """
+
+    with open(path, "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            current: os.stat_result | None = os.stat(path)
+        except FileNotFoundError:
+            current = None
+
+        opened: os.stat_result = os.fstat(lock.fileno())
+        if current is None or (current.st_dev, current.st_ino) != (
+            opened.st_dev,
+            opened.st_ino,
+        ):
+            # removed by the previous holder
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            os.unlink(path)
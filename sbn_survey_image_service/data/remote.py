@@ -0,0 +1,250 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Crawl remote archives for PDS labels.
+
+Directory listings (e.g., as generated by Apache or nginx) are searched for
+labels, which are fetched concurrently by a fixed number of workers, one per
+HTTP connection.  Each URL is fetched once, even if it is linked more than
+once.
+
+"""
+
+__all__ = ["is_remote", "fetch_labels"]
+
+import asyncio
+import logging
+from html.parser import HTMLParser
+from typing import AsyncIterator, List, Set, Tuple
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+
+from ..config.logging import get_logger
+from ..services import network
+
+
+def is_remote(path: str) -> bool:
+    """Returns ``True`` if ``path`` is an HTTP(S) URL."""
+    return urlparse(path).scheme in ["http", "https"]
+
+
+class _LinkParser(HTMLParser):
+    """Collect anchor targets from an HTML page."""
+
+    def __init__(self):
+        super().__init__()
+        self.links: List[str] = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, str | None]]) -> None:
+        if tag != "a":
+            return
+
+        for name, value in attrs:
+            if name == "href" and value:
+                self.links.append(value)
+
+
+def parse_directory_listing(url: str, html: str) -> Tuple[List[str], List[str]]:
+    """Find sub-directories and files in a directory listing.
+
+    Only links that are below ``url`` are returned, which excludes parent
+    directories, column sorting links, and links to other sites.
+
+
+    Parameters
+    ----------
+    url : str
+        The URL of the directory listing.
+
+    html : str
+        The directory listing.
+
+
+    Returns
+    -------
+    directories : list of str
+        Sub-directory URLs.
+
+    files : list of str
+        File URLs.
+
+    """
+
+    parser = _LinkParser()
+    parser.feed(html)
+
+    directories: List[str] = []
+    files: List[str] = []
+    link: str
+    for link in parser.links:
+        target: str = urljoin(url, link)
+        parsed = urlparse(target)
+        if parsed.query or parsed.fragment:
+            continue
+
+        if not target.startswith(url) or target == url:
+            continue
+
+        if target.endswith("/"):
+            directories.append(target)
+        else:
+            files.append(target)
+
+    return directories, files
+
+
+class _Crawler:
+    """Concurrent label crawler."""
+
+    def __init__(
+        self,
+        recursive: bool,
+        extensions: List[str],
+        max_connections: int,
+        timeout: float,
+    ):
+        self.recursive = recursive
+        self.extensions = [x.lower() for x in extensions]
+        self.max_connections = max_connections
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.todo: asyncio.Queue = asyncio.Queue()
+        self.visited: Set[str] = set()
+        self.results: asyncio.Queue = asyncio.Queue(maxsize=max_connections * 2)
+        self.logger: logging.Logger = get_logger()
+        self.n_dirs: int = 0
+        self.n_errors: int = 0
+
+    def is_label(self, url: str) -> bool:
+        return urlparse(url).path.lower().endswith(tuple(self.extensions))
+
+    def enqueue(self, url: str) -> None:
+        """Add a URL to the queue, unless it was already visited."""
+        if url not in self.visited:
+            self.visited.add(url)
+            self.todo.put_nowait(url)
+
+    async def get(self, session: aiohttp.ClientSession, url: str) -> bytes | None:
+        """Fetch a URL, logging errors."""
+        try:
+            async with session.get(url, timeout=self.timeout) as response:
+                response.raise_for_status()
+                return await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            self.n_errors += 1
+            self.logger.error("Error fetching %s: %s", url, exc)
+            return None
+
+    async def visit(self, session: aiohttp.ClientSession, url: str) -> None:
+        """Visit a URL: either a label or a directory listing."""
+
+        if not url.endswith("/"):
+            if self.is_label(url):
+                content: bytes | None = await self.get(session, url)
+                if content is not None:
+                    await self.results.put((url, content))
+            return
+
+        listing: bytes | None = await self.get(session, url)
+        if listing is None:
+            return
+
+        self.n_dirs += 1
+        directories, files = parse_directory_listing(
+            url, listing.decode(errors="replace")
+        )
+        for target in files:
+            if self.is_label(target):
+                self.enqueue(target)
+
+        if self.recursive:
+            for target in directories:
+                self.enqueue(target)
+
+    async def work(self, session: aiohttp.ClientSession) -> None:
+        """Visit queued URLs until cancelled."""
+        while True:
+            url: str = await self.todo.get()
+            try:
+                await self.visit(session, url)
+            finally:
+                self.todo.task_done()
+
+    async def crawl(self, urls: List[str]) -> None:
+        headers = {"User-Agent": network.user_agent}
+        try:
+            for url in urls:
+                self.enqueue(url)
+
+            async with aiohttp.ClientSession(headers=headers) as session:
+                async with asyncio.TaskGroup() as tg:
+                    workers: List[asyncio.Task] = [
+                        tg.create_task(self.work(session))
+                        for i in range(self.max_connections)
+                    ]
+                    await self.todo.join()
+                    for worker in workers:
+                        worker.cancel()
+        finally:
+            await self.results.put(None)
+
+
+async def fetch_labels(
+    urls: List[str],
+    recursive: bool = False,
+    extensions: List[str] | None = None,
+    max_connections: int = 10,
+    timeout: float = 60,
+) -> AsyncIterator[Tuple[str, bytes]]:
+    """Crawl remote directories and fetch PDS labels.
+
+
+    Parameters
+    ----------
+    urls : list of str
+        Directory (ending with "/") or label URLs.
+
+    recursive : bool, optional
+        Set to ``True`` to recursively search directories.
+
+    extensions : list of strings, optional
+        Files with these extensions are considered PDS labels.  Default:
+        .xml.
+
+    max_connections : int, optional
+        Maximum number of concurrent HTTP requests.
+
+    timeout : float, optional
+        Total timeout for each HTTP request, in seconds.
+
+
+    Yields
+    ------
+    url : str
+        The label's URL.
+
+    content : bytes
+        The label.
+
+    """
+
+    crawler = _Crawler(
+        recursive,
+        [".xml"] if extensions is None else extensions,
+        max_connections,
+        timeout,
+    )
+    task: asyncio.Task = asyncio.create_task(crawler.crawl(urls))
+
+    while True:
+        item: Tuple[str, bytes] | None = await crawler.results.get()
+        if item is None:
+            break
+        yield item
+
+    # propagate any exceptions
+    await task
+
+    crawler.logger.info(
+        "Searched %d remote directories, %d fetch errors.",
+        crawler.n_dirs,
+        crawler.n_errors,
+    )
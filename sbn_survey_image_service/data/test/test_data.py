@@ -6,7 +6,7 @@ from tempfile import mkstemp
 import pytest
 import numpy as np
 from astropy.io import fits
-from .. import url_to_local_file
+from .. import url_to_local_file, atomic_write
 
 
 @pytest.mark.remote_data
@@ -37,3 +37,23 @@ def test_url_to_local_file_local_path():
 
     fn = url_to_local_file("file://" + os.path.abspath(fn))
     assert open(fn, "r").read() == "asdf"
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "test.txt"
+    with atomic_write(str(path), "w") as outf:
+        outf.write("test")
+        # nothing at the final location until the write is complete
+        assert not path.exists()
+
+    assert path.read_text() == "test"
+    assert os.stat(path).st_mode == 33204
+
+    # errors leave the original file in place, and no temporary files
+    with pytest.raises(ValueError):
+        with atomic_write(str(path), "w") as outf:
+            outf.write("incomplete")
+            raise ValueError
+
+    assert path.read_text() == "test"
+    assert os.listdir(tmp_path) == ["test.txt"]
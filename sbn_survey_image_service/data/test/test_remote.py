@@ -0,0 +1,126 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test remote data ingestion with a local stand-in HTTP server."""
+
+import os
+import shutil
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from . import generate
+from ..add import add_remote
+from ...config.exceptions import LabelError
+from ..remote import fetch_labels, parse_directory_listing
+from ...models import Base
+from ...models.image import Image
+from ...services.database_provider import data_provider_session
+from ...config.env import ENV
+from ...test.http_server import serve_directory
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """Small archive with nested directories."""
+
+    with data_provider_session() as session:
+        if not generate.exists(session):
+            generate.create_tables()
+            generate.create_data(session, ENV.TEST_DATA_PATH)
+
+    for i in range(1, 11):
+        subdir = tmp_path / "data" / f"night{i % 2}"
+        subdir.mkdir(parents=True, exist_ok=True)
+        for ext in ["xml", "fits"]:
+            shutil.copy(os.path.join(ENV.TEST_DATA_PATH, f"test-{i:06d}.{ext}"), subdir)
+
+    return tmp_path
+
+
+@pytest.fixture
+def session():
+    # labels are added from a thread, so share one in-memory database
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def test_parse_directory_listing():
+    html = """
+    <a href="?C=N;O=D">Name</a>
+    <a href="/pds4/">Parent Directory</a>
+    <a href="obsdata/">obsdata/</a>
+    <a href="a.xml">a.xml</a>
+    <a href="https://example.com/b.xml">b.xml</a>
+    """
+    directories, files = parse_directory_listing(
+        "https://example.com/pds4/survey/", html
+    )
+    assert directories == ["https://example.com/pds4/survey/obsdata/"]
+    assert files == ["https://example.com/pds4/survey/a.xml"]
+
+
+def test_fetch_labels_once(archive):
+    # like Apache listings, link each entry twice: icon and name
+    (archive / "data" / "index.html").write_text("""
+        <a href="night0/"><img src="/icons/folder.gif"></a>
+        <a href="night0/">night0/</a>
+        <a href="night1/"><img src="/icons/folder.gif"></a>
+        <a href="night1/">night1/</a>
+        <a href="night0/test-000002.xml">test-000002.xml</a>
+        """)
+
+    async def fetch(urls):
+        return [label async for label, content in fetch_labels(urls, recursive=True)]
+
+    requests = []
+    with serve_directory(str(archive), requests) as url:
+        labels = asyncio.run(fetch([url, url + "data/", url + "data/night1/"]))
+
+    assert len(labels) == 10
+    assert len(set(labels)) == 10
+    paths = [path for path, byte_range in requests]
+    assert len(paths) == len(set(paths))
+
+
+def test_add_remote(archive, session):
+    with serve_directory(str(archive)) as url:
+        add_remote([url], session, recursive=True, max_connections=4, batch_size=3)
+
+        images = session.query(Image).all()
+        assert len(images) == 10
+        for im in images:
+            assert im.label_url.startswith(url + "data/night")
+            assert im.image_url == im.label_url.replace(".xml", ".fits")
+
+        # adding again does not duplicate
+        add_remote([url], session, recursive=True)
+        assert session.query(Image).count() == 10
+
+
+def test_add_remote_not_recursive(archive, session):
+    with serve_directory(str(archive)) as url:
+        add_remote([url], session, recursive=False)
+        assert session.query(Image).count() == 0
+
+        add_remote([url + "data/night0/", url + "data/night1/test-000001.xml"], session)
+        assert session.query(Image).count() == 6
+
+
+def test_add_remote_invalid_label(archive, session):
+    (archive / "data" / "night0" / "bad.xml").write_text("not a label")
+
+    with serve_directory(str(archive)) as url:
+        with pytest.raises(LabelError):
+            add_remote([url], session, recursive=True, relax=False)
+
+        # by default, invalid labels are skipped
+        add_remote([url], session, recursive=True)
+        assert session.query(Image).count() == 10
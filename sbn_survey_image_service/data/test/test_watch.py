@@ -0,0 +1,142 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test watch-mode label ingestion."""
+
+import os
+import shutil
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from . import generate
+from ..add import ImageBatch
+from ..watch import InotifyWatcher, PollingWatcher, LabelIngester
+from ...models import Base
+from ...models.image import Image
+from ...services.database_provider import data_provider_session
+from ...config.env import ENV
+
+
+@pytest.fixture
+def labels():
+    with data_provider_session() as session:
+        if not generate.exists(session):
+            generate.create_tables()
+            generate.create_data(session, ENV.TEST_DATA_PATH)
+
+    return [os.path.join(ENV.TEST_DATA_PATH, f"test-{i:06d}.xml") for i in (1, 2, 3)]
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def test_polling_watcher(tmp_path, labels):
+    shutil.copy(labels[0], tmp_path)
+    (tmp_path / "night").mkdir()
+
+    watcher = PollingWatcher([str(tmp_path)], recursive=True, interval=0)
+    assert watcher.changes(0) == []
+
+    shutil.copy(labels[1], tmp_path / "night")
+    shutil.copy(labels[2], tmp_path / "night" / "test.txt")
+    assert watcher.changes(0) == [str(tmp_path / "night" / "test-000002.xml")]
+
+    # modified
+    os.utime(tmp_path / "test-000001.xml", (0, 0))
+    assert watcher.changes(0) == [str(tmp_path / "test-000001.xml")]
+
+
+def test_inotify_watcher(tmp_path, labels):
+    try:
+        watcher = InotifyWatcher([str(tmp_path)], recursive=True)
+    except OSError:
+        pytest.skip("inotify is not available")
+
+    try:
+        (tmp_path / "night").mkdir()
+        assert watcher.changes(0.1) == []
+
+        shutil.copy(labels[0], tmp_path / "night")
+        shutil.copy(labels[1], tmp_path / "night" / "test.txt")
+        assert watcher.changes(1) == [str(tmp_path / "night" / "test-000001.xml")]
+    finally:
+        watcher.close()
+
+
+def test_inotify_watcher_rescan(tmp_path, labels):
+    try:
+        watcher = InotifyWatcher([str(tmp_path)], recursive=True)
+    except OSError:
+        pytest.skip("inotify is not available")
+
+    try:
+        # as if the events were lost in a queue overflow
+        os.makedirs(tmp_path / "night")
+        shutil.copy(labels[0], tmp_path / "night")
+        shutil.copy(labels[1], tmp_path)
+        changed = watcher.rescan(os.stat(tmp_path / "night").st_ctime)
+        assert sorted(changed) == [
+            str(tmp_path / "night" / "test-000001.xml"),
+            str(tmp_path / "test-000002.xml"),
+        ]
+        assert str(tmp_path / "night") in watcher.watches.values()
+    finally:
+        watcher.close()
+
+
+def test_label_ingester(tmp_path, labels, session):
+    watcher = PollingWatcher([str(tmp_path)], interval=0)
+    ingester = LabelIngester(session, watcher, debounce=60, batch_size=2)
+
+    shutil.copy(labels[0], tmp_path)
+    assert ingester.step(0) == 0  # waiting for more labels
+    assert len(ingester.pending) == 1
+
+    shutil.copy(labels[1], tmp_path)
+    shutil.copy(labels[2], tmp_path)
+    assert ingester.step(0) == 2  # batch size reached
+    assert len(ingester.pending) == 1
+    assert session.query(Image).count() == 2
+
+    ingester.debounce = 0
+    assert ingester.step(0) == 1
+    assert session.query(Image).count() == 3
+
+    # changed labels update existing rows
+    label = tmp_path / "test-000001.xml"
+    label.write_text(label.read_text().replace(">Multiple<", ">Sky<"))
+    os.utime(label, (0, 0))
+    assert ingester.step(0) == 1
+    assert ingester.n_added == 3
+    assert ingester.n_updated == 1
+    assert session.query(Image.target).filter(Image.target == "Sky").count() == 1
+
+
+def test_label_ingester_retry(tmp_path, labels, session, monkeypatch):
+    watcher = PollingWatcher([str(tmp_path)], interval=0)
+    ingester = LabelIngester(session, watcher, debounce=0)
+    shutil.copy(labels[0], tmp_path)
+
+    def locked(batch):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    with monkeypatch.context() as m:
+        m.setattr(ImageBatch, "flush", locked)
+        assert ingester.step(0) == 0
+
+    # the label is kept, and retried later
+    assert len(ingester.pending) == 1
+    assert ingester.backoff == 1
+    assert ingester.step(0) == 0
+
+    ingester.retry_at = 0
+    assert ingester.step(0) == 1
+    assert len(ingester.pending) == 0
+    assert ingester.backoff == 0
+    assert session.query(Image).count() == 1
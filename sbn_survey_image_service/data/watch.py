@@ -0,0 +1,509 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Watch directories for new or changed labels and add them to the database.
+
+Uses Linux inotify, if available, otherwise polls the file system.  Note that
+inotify does not report changes made by other hosts on network file systems,
+in which case polling should be used.
+
+"""
+
+__all__ = ["InotifyWatcher", "PollingWatcher", "LabelIngester", "get_watcher"]
+
+import os
+import json
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import logging
+from typing import Dict, List, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.session import Session
+
+from .add import label_to_image, ImageBatch
+from ..models.image import Image
+from ..config.logging import get_logger
+
+
+class PollingWatcher:
+    """Find new or changed files by periodically scanning directories.
+
+
+    Parameters
+    ----------
+    paths : list of str
+        Directories to watch.
+
+    recursive : bool, optional
+        Set to ``True`` to also watch sub-directories.
+
+    extensions : list of strings, optional
+        Files with these extensions are considered PDS labels.  Default:
+        .xml.
+
+    interval : float, optional
+        Minimum time between directory scans, in seconds.
+
+    """
+
+    def __init__(
+        self,
+        paths: List[str],
+        recursive: bool = False,
+        extensions: List[str] | None = None,
+        interval: float = 10,
+    ):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.recursive = recursive
+        self.extensions = tuple(
+            x.lower() for x in ([".xml"] if extensions is None else extensions)
+        )
+        self.interval = interval
+        self.mtimes: Dict[str, float] = {}
+        self.last_scan: float = -interval
+
+        # baseline: existing files are not reported
+        self.scan()
+
+    def is_label(self, path: str) -> bool:
+        return path.lower().endswith(self.extensions)
+
+    def scan(self) -> List[str]:
+        """Scan directories, returning new or modified labels."""
+
+        self.last_scan = time.monotonic()
+        changed: List[str] = []
+        mtimes: Dict[str, float] = {}
+        for path in self.paths:
+            for dirpath, dirnames, filenames in os.walk(path):
+                for filename in filenames:
+                    if not self.is_label(filename):
+                        continue
+
+                    fn: str = os.path.join(dirpath, filename)
+                    try:
+                        mtimes[fn] = os.stat(fn).st_mtime
+                    except FileNotFoundError:
+                        continue
+
+                    if self.mtimes.get(fn) != mtimes[fn]:
+                        changed.append(fn)
+
+                if not self.recursive:
+                    break
+
+        self.mtimes = mtimes
+        return changed
+
+    def changes(self, timeout: float) -> List[str]:
+        """Wait up to ``timeout`` seconds for new or modified labels."""
+
+        wait: float = self.last_scan + self.interval - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+
+        time.sleep(max(wait, 0))
+        return self.scan()
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """Find new or changed files with Linux inotify.
+
+    Files are reported after they are closed for writing or moved into a
+    watched directory.  New sub-directories are automatically watched when
+    ``recursive`` is ``True``.  If the kernel's event queue overflows, the
+    watched directories are scanned for labels changed since the last read.
+
+
+    Parameters
+    ----------
+    paths : list of str
+        Directories to watch.
+
+    recursive : bool, optional
+        Set to ``True`` to also watch sub-directories.
+
+    extensions : list of strings, optional
+        Files with these extensions are considered PDS labels.  Default:
+        .xml.
+
+
+    Raises
+    ------
+    OSError
+        If inotify is not available.
+
+    """
+
+    IN_CLOSE_WRITE: int = 0x00000008
+    IN_MOVED_TO: int = 0x00000080
+    IN_CREATE: int = 0x00000100
+    IN_DELETE_SELF: int = 0x00000400
+    IN_Q_OVERFLOW: int = 0x00004000
+    IN_IGNORED: int = 0x00008000
+    IN_ISDIR: int = 0x40000000
+    IN_NONBLOCK: int = os.O_NONBLOCK
+    IN_CLOEXEC: int = os.O_CLOEXEC
+    MASK: int = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+    EVENT: struct.Struct = struct.Struct("iIII")
+
+    def __init__(
+        self,
+        paths: List[str],
+        recursive: bool = False,
+        extensions: List[str] | None = None,
+    ):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.recursive = recursive
+        self.extensions = tuple(
+            x.lower() for x in ([".xml"] if extensions is None else extensions)
+        )
+        self.logger: logging.Logger = get_logger()
+        # time of the last read, for rescans after an overflow
+        self.last_read: float = time.time()
+
+        libc_name: str | None = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self._libc = libc
+        self.fd: int = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.watches: Dict[int, str] = {}
+        for path in self.paths:
+            self.add_watch(path)
+
+    def is_label(self, path: str) -> bool:
+        return path.lower().endswith(self.extensions)
+
+    def add_watch(self, path: str) -> None:
+        """Watch a directory, and its sub-directories if recursive."""
+
+        wd: int = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch {path}")
+        self.watches[wd] = path
+
+        if self.recursive:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self.add_watch(entry.path)
+
+    def rescan(self, since: float) -> List[str]:
+        """Scan the watched directories for labels changed since a time.
+
+        Directories that are not yet watched are added, if recursive.  The
+        inode change time is compared, as file modification times may be
+        preserved by copies.
+
+
+        Parameters
+        ----------
+        since : float
+            POSIX time.
+
+
+        Returns
+        -------
+        changed : list of str
+            The labels.
+
+        """
+
+        changed: List[str] = []
+        watched: set[str] = set(self.watches.values())
+        for path in self.paths:
+            for dirpath, dirnames, filenames in os.walk(path):
+                if dirpath not in watched:
+                    self.add_watch(dirpath)
+                    watched = set(self.watches.values())
+
+                for filename in filenames:
+                    if not self.is_label(filename):
+                        continue
+
+                    fn: str = os.path.join(dirpath, filename)
+                    try:
+                        if os.stat(fn).st_ctime >= since:
+                            changed.append(fn)
+                    except FileNotFoundError:
+                        continue
+
+                if not self.recursive:
+                    break
+
+        return changed
+
+    def changes(self, timeout: float) -> List[str]:
+        """Wait up to ``timeout`` seconds for new or modified labels."""
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return []
+
+        # with a margin for coarse file system timestamps
+        since: float = self.last_read - 1
+        try:
+            buf: bytes = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        self.last_read = time.time()
+
+        changed: List[str] = []
+        offset: int = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = self.EVENT.unpack_from(buf, offset)
+            offset += self.EVENT.size
+            name: str = os.fsdecode(buf[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                # events were lost
+                self.logger.warning("inotify event queue overflowed, rescanning.")
+                changed.extend(self.rescan(since))
+                continue
+
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+
+            if wd not in self.watches:
+                continue
+
+            path: str = os.path.join(self.watches[wd], name)
+            if mask & self.IN_ISDIR:
+                if self.recursive and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.add_watch(path)
+                    # files may have been written before the watch was added
+                    for dirpath, dirnames, filenames in os.walk(path):
+                        changed.extend(
+                            os.path.join(dirpath, fn)
+                            for fn in filenames
+                            if self.is_label(fn)
+                        )
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                if self.is_label(name):
+                    changed.append(path)
+
+        # labels may be reported more than once, e.g., after a rescan
+        return list(dict.fromkeys(changed))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def get_watcher(
+    paths: List[str],
+    recursive: bool = False,
+    extensions: List[str] | None = None,
+    poll: bool = False,
+    interval: float = 10,
+) -> InotifyWatcher | PollingWatcher:
+    """Return an inotify watcher, falling back to polling if needed."""
+
+    if not poll:
+        try:
+            return InotifyWatcher(paths, recursive=recursive, extensions=extensions)
+        except (OSError, AttributeError) as exc:
+            get_logger().warning("inotify unavailable (%s), polling instead.", exc)
+
+    return PollingWatcher(
+        paths, recursive=recursive, extensions=extensions, interval=interval
+    )
+
+
+class LabelIngester:
+    """Debounce label changes and add them to the database in small batches.
+
+    A batch is written when no new labels have arrived for ``debounce``
+    seconds, when ``batch_size`` labels are pending, or when the oldest
+    pending label has waited ``max_delay`` seconds.  Labels for images
+    already in the database update the existing rows.  If a batch cannot be
+    written, e.g., the database is locked, its labels remain pending and the
+    write is retried, waiting twice as long after each failure, up to
+    ``max_backoff`` seconds.
+
+
+    Parameters
+    ----------
+    session : sqlalchemy Session
+        Database session object.
+
+    watcher : InotifyWatcher or PollingWatcher
+        Source of new or changed labels.
+
+    debounce : float, optional
+        Quiet period before writing a batch, in seconds.
+
+    batch_size : int, optional
+        Maximum number of labels per batch.
+
+    max_delay : float, optional
+        Maximum time a label may wait to be written, in seconds.
+
+    max_backoff : float, optional
+        Maximum time to wait before retrying a failed write, in seconds.
+
+    **kwargs
+        Keyword arguments for ``label_to_image``, e.g., ``base_url``.
+
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        watcher: InotifyWatcher | PollingWatcher,
+        debounce: float = 2,
+        batch_size: int = 100,
+        max_delay: float = 30,
+        max_backoff: float = 60,
+        **kwargs,
+    ):
+        self.session = session
+        self.watcher = watcher
+        self.debounce = debounce
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_backoff = max_backoff
+        self.kwargs = kwargs
+        self.kwargs.setdefault("relax", True)
+        self.logger: logging.Logger = get_logger()
+
+        # path: (first seen, last seen), monotonic clock
+        self.pending: Dict[str, Tuple[float, float]] = {}
+        self.n_batches: int = 0
+        self.n_added: int = 0
+        self.n_updated: int = 0
+
+        # after a failed write: the current wait, and when to retry
+        self.backoff: float = 0
+        self.retry_at: float = 0
+
+    def ready(self, now: float) -> bool:
+        """Returns ``True`` if the pending labels should be written."""
+
+        if len(self.pending) == 0 or now < self.retry_at:
+            return False
+
+        first: float = min(t[0] for t in self.pending.values())
+        last: float = max(t[1] for t in self.pending.values())
+        return (
+            len(self.pending) >= self.batch_size
+            or now - last >= self.debounce
+            or now - first >= self.max_delay
+        )
+
+    def step(self, timeout: float = 1) -> int:
+        """Wait for changes, and write a batch if ready.
+
+
+        Returns
+        -------
+        n : int
+            Number of labels written to the database.
+
+        """
+
+        now: float
+        for path in self.watcher.changes(timeout):
+            now = time.monotonic()
+            first: float = self.pending.get(path, (now, now))[0]
+            self.pending[path] = (first, now)
+
+        if not self.ready(time.monotonic()):
+            return 0
+
+        return self.flush()
+
+    def flush(self) -> int:
+        """Read pending labels and write up to one batch to the database.
+
+        The labels remain pending if the database write fails.
+
+        """
+
+        paths: List[str] = sorted(self.pending)[: self.batch_size]
+        batch: ImageBatch = ImageBatch(
+            self.session, batch_size=len(paths) + 1, update=True
+        )
+        delivered: List[float] = []
+        for path in paths:
+            try:
+                delivered.append(os.stat(path).st_mtime)
+            except FileNotFoundError:
+                continue
+
+            im: Image | None = label_to_image(path, **self.kwargs)
+            if im is not None:
+                batch.add(im)
+
+        try:
+            batch.flush()
+        except SQLAlchemyError:
+            self.session.rollback()
+            self.backoff = min(max(2 * self.backoff, 1), self.max_backoff)
+            self.retry_at = time.monotonic() + self.backoff
+            self.logger.exception(
+                "Failed to write %d labels, retrying in %g s.",
+                len(paths),
+                self.backoff,
+            )
+            return 0
+
+        committed: float = time.time()
+        self.backoff = 0
+        self.retry_at = 0
+        for path in paths:
+            del self.pending[path]
+
+        self.n_batches += 1
+        self.n_added += batch.n_added
+        self.n_updated += batch.n_updated
+
+        # lag: time from label delivery (modification time) to commit
+        lag: List[float] = [committed - t for t in delivered]
+        self.logger.info(
+            json.dumps(
+                {
+                    "job": "ingest",
+                    "batch": self.n_batches,
+                    "labels": len(paths),
+                    "added": batch.n_added,
+                    "updated": batch.n_updated,
+                    "pending": len(self.pending),
+                    "lag_mean": round(sum(lag) / len(lag), 3) if lag else None,
+                    "lag_max": round(max(lag), 3) if lag else None,
+                }
+            )
+        )
+
+        return batch.n_added + batch.n_updated
+
+    def run(self) -> None:
+        """Ingest labels until interrupted."""
+
+        self.logger.info("Watching for labels with %s.", type(self.watcher).__name__)
+        try:
+            while True:
+                self.step()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            while len(self.pending) > 0:
+                n: int = len(self.pending)
+                self.flush()
+                if len(self.pending) == n:
+                    self.logger.error("%d labels were not added to the database.", n)
+                    break
+            self.watcher.close()
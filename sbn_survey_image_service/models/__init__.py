@@ -3,3 +3,4 @@
 
 from .base import Base
 from .image import Image
+from .statistics import ImageStatistics
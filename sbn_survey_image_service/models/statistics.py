@@ -0,0 +1,64 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""SBN Survey Image Service data models.
+
+ImageStatistics: ORM Model for table of image display statistics.
+
+"""
+
+from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy.sql.sqltypes import Float
+from .base import Base
+
+
+class ImageStatistics(Base):
+    """ORM class for image display statistics.
+
+    Computed from a sample of the image data, and used to consistently
+    stretch browse images and cutouts.
+    """
+
+    __tablename__ = "image_statistics"
+
+    id: int = Column(Integer, primary_key=True)
+
+    image_id: int = Column(
+        Integer,
+        ForeignKey("image.id", ondelete="CASCADE"),
+        unique=True,
+        nullable=False,
+        index=True,
+    )
+    """
+        Image table row ID.
+    """
+
+    zscale_min: float = Column(Float, nullable=True)
+    """
+        Lower display limit from the zscale algorithm.
+    """
+
+    zscale_max: float = Column(Float, nullable=True)
+    """
+        Upper display limit from the zscale algorithm.
+    """
+
+    median: float = Column(Float, nullable=True)
+    """
+        Median pixel value.
+    """
+
+    mad: float = Column(Float, nullable=True)
+    """
+        Median absolute deviation of the pixel values.
+    """
+
+    saturation: float = Column(Float, nullable=True)
+    """
+        Saturation level, if known.
+    """
+
+    def __repr__(self) -> str:
+        return (
+            f"ImageStatistics(image_id={self.image_id},"
+            f" zscale_min={self.zscale_min}, zscale_max={self.zscale_max})"
+        )
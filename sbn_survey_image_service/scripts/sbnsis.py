@@ -6,8 +6,10 @@ import time
 import signal
 import argparse
 import subprocess
+from typing import List
 from argparse import ArgumentParser
 from sqlalchemy import MetaData
+from sqlalchemy.orm import Session
 
 from sbn_survey_image_service import models
 from sbn_survey_image_service.config.env import ENV, env_example
@@ -15,6 +17,15 @@ from sbn_survey_image_service.services.database_provider import (
     db_engine,
     data_provider_session,
 )
+from sbn_survey_image_service.services.statistics import update_statistics
+from sbn_survey_image_service.services.tiles import build_pyramids
+from sbn_survey_image_service.services.benchmark import benchmark_collection
+from sbn_survey_image_service.data.watch import (
+    InotifyWatcher,
+    PollingWatcher,
+    LabelIngester,
+    get_watcher,
+)
 
 
 class ServiceException(Exception):
@@ -277,6 +288,118 @@ class SBNSISService:
         if not missing:
             print_color("All tables verified")
 
+    def ingest(self) -> None:
+        """Add labels to the database, optionally watching for new labels."""
+
+        kwargs: dict = dict(
+            base_url=self.args.base_url,
+            strip_leading=self.args.strip_leading.rstrip("/"),
+        )
+
+        session: Session
+        with data_provider_session() as session:
+            models.Base.metadata.create_all(db_engine)
+
+            watcher: InotifyWatcher | PollingWatcher
+            if self.args.watch:
+                watcher = get_watcher(
+                    self.args.paths,
+                    recursive=self.args.r,
+                    extensions=self.args.e,
+                    poll=self.args.poll,
+                    interval=self.args.interval,
+                )
+
+            existing: List[str] = []
+            if self.args.scan or not self.args.watch:
+                scan: PollingWatcher = PollingWatcher(
+                    self.args.paths, recursive=self.args.r, extensions=self.args.e
+                )
+                existing = list(scan.mtimes)
+                if not self.args.watch:
+                    # only the existing labels are ingested
+                    watcher = scan
+
+            ingester: LabelIngester = LabelIngester(
+                session,
+                watcher,
+                debounce=self.args.debounce,
+                batch_size=self.args.batch_size,
+                max_delay=self.args.max_delay,
+                **kwargs,
+            )
+
+            if self.args.scan or not self.args.watch:
+                for path in existing:
+                    ingester.pending[path] = (0, 0)
+                while len(ingester.pending) > 0:
+                    n: int = len(ingester.pending)
+                    ingester.flush()
+                    if len(ingester.pending) == n:
+                        raise ServiceException("Labels could not be ingested.")
+                print_color(
+                    f"Ingested {len(existing)} labels:"
+                    f" {ingester.n_added} added, {ingester.n_updated} updated."
+                )
+
+            if self.args.watch:
+                print_color("Watching for new labels.  Press Ctrl-C to stop.")
+                ingester.run()
+
+    def statistics(self) -> None:
+        """Compute image display statistics."""
+
+        session: Session
+        with data_provider_session() as session:
+            models.Base.metadata.create_all(db_engine)
+            n: int = update_statistics(
+                session,
+                collection=self.args.collection,
+                recompute=self.args.recompute,
+                limit=self.args.limit,
+                n_rows=self.args.rows,
+            )
+
+        s: str = "" if n == 1 else "s"
+        print_color(f"Computed display statistics for {n} image{s}.")
+
+    def build_tiles(self) -> None:
+        """Build full-frame image tile pyramids."""
+
+        session: Session
+        with data_provider_session() as session:
+            n: int = build_pyramids(
+                session,
+                collection=self.args.collection,
+                obs_ids=self.args.obs_id,
+                format=self.args.format,
+                processes=self.args.processes,
+                overwrite=self.args.overwrite,
+            )
+
+        s: str = "" if n == 1 else "s"
+        print_color(f"Built {n} tile pyramid{s}.")
+
+    def benchmark(self) -> None:
+        """Benchmark remote read block sizes for a collection."""
+
+        session: Session
+        with data_provider_session() as session:
+            best, times = benchmark_collection(
+                session,
+                self.args.collection,
+                self.args.block_size or [2**16, 2**18, 2**20, 2**22],
+                n=self.args.n,
+                size=self.args.size,
+                save=self.args.save,
+            )
+
+        for block_size, t in times.items():
+            print(f"{block_size:12d} bytes  {t:8.3f} s")
+        print_color(f"Best block size: {best} bytes.")
+        if self.args.save:
+            print_color(f"Saved to {ENV.SBNSIS_COLLECTIONS}.")
+
     def argument_parser(self) -> ArgumentParser:
         parser: ArgumentParser = ArgumentParser(description="SBN Survey Image Service")
         subparsers = parser.add_subparsers(help="sub-command help")
@@ -332,6 +455,146 @@ class SBNSISService:
         )
         env_parser.set_defaults(func=self.env_file)
 
+        # ingest ##########
+        ingest_parser: ArgumentParser = subparsers.add_parser(
+            "ingest", help="add labels to the database, optionally watching for more"
+        )
+        ingest_parser.add_argument("paths", nargs="+", help="label directories")
+        ingest_parser.add_argument(
+            "--watch",
+            action="store_true",
+            help="watch for new or changed labels until interrupted",
+        )
+        ingest_parser.add_argument(
+            "--scan",
+            action="store_true",
+            help="with --watch, first ingest labels already present",
+        )
+        ingest_parser.add_argument(
+            "-r", action="store_true", help="recursively search directories"
+        )
+        ingest_parser.add_argument(
+            "-e",
+            action="append",
+            default=[".xml"],
+            help="additional file name extensions to consider",
+        )
+        ingest_parser.add_argument(
+            "--base-url", default="file://", help="prepend this string to form a URL"
+        )
+        ingest_parser.add_argument(
+            "--strip-leading",
+            default="",
+            help="strip this leading string before forming the URL",
+        )
+        ingest_parser.add_argument(
+            "--poll",
+            action="store_true",
+            help="poll the file system rather than using inotify (e.g., for NFS)",
+        )
+        ingest_parser.add_argument(
+            "--interval",
+            type=float,
+            default=10,
+            help="polling interval, seconds",
+        )
+        ingest_parser.add_argument(
+            "--debounce",
+            type=float,
+            default=2,
+            help="write a batch after this many seconds without new labels",
+        )
+        ingest_parser.add_argument(
+            "--max-delay",
+            type=float,
+            default=30,
+            help="maximum time a label waits to be written, seconds",
+        )
+        ingest_parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="maximum number of labels per database transaction",
+        )
+        ingest_parser.set_defaults(func=self.ingest)
+
+        # statistics ##########
+        statistics_parser: ArgumentParser = subparsers.add_parser(
+            "statistics", help="compute image display statistics"
+        )
+        statistics_parser.add_argument(
+            "--collection", help="only process images in this collection"
+        )
+        statistics_parser.add_argument(
+            "--recompute",
+            action="store_true",
+            help="recompute statistics for images that already have them",
+        )
+        statistics_parser.add_argument(
+            "--limit", type=int, help="process at most this many images"
+        )
+        statistics_parser.add_argument(
+            "--rows", type=int, default=64, help="number of image rows to sample"
+        )
+        statistics_parser.set_defaults(func=self.statistics)
+
+        # tiles ##########
+        tiles_parser: ArgumentParser = subparsers.add_parser(
+            "tiles", help="manage full-frame image tile pyramids"
+        )
+        tiles_subparsers = tiles_parser.add_subparsers(help="tiles sub-command help")
+        tiles_build_parser: ArgumentParser = tiles_subparsers.add_parser(
+            "build", help="build tile pyramids"
+        )
+        tiles_build_parser.add_argument(
+            "--collection", help="only process images in this collection"
+        )
+        tiles_build_parser.add_argument(
+            "--obs-id", action="append", help="only process this image"
+        )
+        tiles_build_parser.add_argument(
+            "--format",
+            default="jpeg",
+            choices=["jpeg", "png", "webp"],
+            help="tile format",
+        )
+        tiles_build_parser.add_argument(
+            "-j",
+            dest="processes",
+            type=int,
+            help="number of worker processes (default: number of CPUs)",
+        )
+        tiles_build_parser.add_argument(
+            "--overwrite", action="store_true", help="rebuild existing pyramids"
+        )
+        tiles_build_parser.set_defaults(func=self.build_tiles)
+
+        # benchmark ##########
+        benchmark_parser: ArgumentParser = subparsers.add_parser(
+            "benchmark", help="find the best remote read block size for a collection"
+        )
+        benchmark_parser.add_argument(
+            "collection", help="collection logical identifier"
+        )
+        benchmark_parser.add_argument(
+            "--block-size",
+            type=int,
+            action="append",
+            help="candidate block size in bytes (default: 64 kiB to 4 MiB)",
+        )
+        benchmark_parser.add_argument(
+            "-n", type=int, default=5, help="number of sample images"
+        )
+        benchmark_parser.add_argument(
+            "--size", type=int, default=512, help="cutout size in pixels"
+        )
+        benchmark_parser.add_argument(
+            "--save",
+            action="store_true",
+            help="save the best block size to the SBNSIS_COLLECTIONS profile file",
+        )
+        benchmark_parser.set_defaults(func=self.benchmark)
+
         # verify-tables ###############
         verify_tables_parser: ArgumentParser = subparsers.add_parser(
             "verify-tables", help="verify database tables"
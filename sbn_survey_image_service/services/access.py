@@ -0,0 +1,114 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Image access tracking.
+
+Image reads are counted in a small SQLite database shared by all workers on
+the host.  The counts identify hot images to keep in faster local storage.
+
+"""
+
+__all__ = ["AccessTracker", "access_tracker"]
+
+import os
+import time
+import sqlite3
+from contextlib import closing
+
+from ..config.env import ENV
+
+
+class AccessTracker:
+    """Count image reads within a sliding time window.
+
+    Counts are reset when the first counted access is older than the window.
+
+
+    Parameters
+    ----------
+    path : str
+        The SQLite database file name.
+
+    window : float, optional
+        Counting window in hours.  Default: SBNSIS_ACCESS_WINDOW.
+
+    """
+
+    def __init__(self, path: str, window: float | None = None) -> None:
+        self.path = path
+        self.window = ENV.SBNSIS_ACCESS_WINDOW if window is None else window
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute("""CREATE TABLE IF NOT EXISTS access (
+                    key TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    first REAL NOT NULL,
+                    last REAL NOT NULL
+                )""")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def record(self, key: str, nbytes: int = 0) -> tuple[int, int]:
+        """Record an access.
+
+
+        Parameters
+        ----------
+        key : str
+            The image, e.g., its URL.
+
+        nbytes : int, optional
+            Number of bytes transferred for this access.
+
+
+        Returns
+        -------
+        count : int
+            Number of accesses in the current window.
+
+        total : int
+            Total bytes transferred in the current window.
+
+        """
+
+        now: float = time.time()
+        expired: float = now - self.window * 3600
+        with closing(self._connect()) as db, db:
+            count, total = db.execute(
+                """INSERT INTO access (key, count, bytes, first, last)
+                VALUES (?, 1, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    count = CASE WHEN first < ? THEN 1 ELSE count + 1 END,
+                    bytes = CASE WHEN first < ?
+                        THEN excluded.bytes ELSE bytes + excluded.bytes END,
+                    first = CASE WHEN first < ? THEN excluded.first ELSE first END,
+                    last = excluded.last
+                RETURNING count, bytes""",
+                (key, nbytes, now, now, expired, expired, expired),
+            ).fetchone()
+
+        return count, total
+
+    def count(self, key: str) -> int:
+        """Number of accesses in the current window."""
+
+        expired: float = time.time() - self.window * 3600
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT count FROM access WHERE key = ? AND first >= ?",
+                (key, expired),
+            ).fetchone()
+
+        return 0 if row is None else row[0]
+
+    def forget(self, key: str) -> None:
+        """Remove an image's access counts."""
+
+        with closing(self._connect()) as db, db:
+            db.execute("DELETE FROM access WHERE key = ?", (key,))
+
+
+def access_tracker() -> AccessTracker:
+    """The access tracker for this host, saved in the cutout cache."""
+    return AccessTracker(os.path.join(ENV.SBNSIS_CUTOUT_CACHE, "access.db"))
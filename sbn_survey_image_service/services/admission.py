@@ -0,0 +1,171 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Cost-based admission control for renders.
+
+Each render job, i.e., a new cutout, browse image, or tile pyramid, has an
+estimated cost in pixels (see `~sbn_survey_image_service.services.image`).
+Before a job is queued for the render pool, it is charged to two token
+buckets, which refill at a constant rate:
+
+* the client's bucket: SBNSIS_CLIENT_RATE pixels per second, holding at most
+  SBNSIS_CLIENT_BURST pixels;
+
+* the worker's bucket: SBNSIS_GLOBAL_RATE pixels per second, by default the
+  render pool's capacity, holding at most ten seconds' worth.
+
+In addition, each client may have at most SBNSIS_CLIENT_RENDERS jobs
+rendering or waiting at once.  Jobs that are not admitted are rejected with
+HTTP status 429 and a Retry-After header.  Cached images are free.
+
+Clients are identified by their address, set by the API controllers with
+`CLIENT` (see `~sbn_survey_image_service.api.clients`).  Renders outside of the API, e.g., command-line tools, are not
+limited.  Limits apply to each worker.
+
+"""
+
+__all__ = ["CLIENT", "TokenBucket", "admit"]
+
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from ..config.env import ENV
+from ..config.exceptions import TooManyRequests
+
+# client address of the current API request
+CLIENT: ContextVar[str | None] = ContextVar("CLIENT", default=None)
+
+# number of idle client buckets to keep
+MAX_CLIENTS: int = 10000
+
+
+class TokenBucket:
+    """Limit a rate of work, allowing bursts.
+
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second.
+
+    capacity : float
+        Maximum number of tokens.  The bucket starts full.
+
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+
+    def refill(self) -> None:
+        now: float = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, tokens: float) -> float:
+        """Seconds until ``tokens`` are available, 0 if available now.
+
+        Requests larger than the capacity only need a full bucket.
+
+        """
+
+        self.refill()
+        deficit: float = min(tokens, self.capacity) - self.tokens
+        return max(0, deficit / self.rate)
+
+    def take(self, tokens: float) -> None:
+        self.refill()
+        self.tokens -= min(tokens, self.capacity)
+
+
+_clients: dict[str, TokenBucket] = {}
+_renders: dict[str, int] = {}
+_global: TokenBucket | None = None
+_lock = threading.Lock()
+
+
+def _client_bucket(client: str) -> TokenBucket:
+    if client not in _clients:
+        if len(_clients) >= MAX_CLIENTS:
+            # forget clients that are back to a full bucket
+            for key, bucket in list(_clients.items()):
+                bucket.refill()
+                if bucket.tokens >= bucket.capacity and key not in _renders:
+                    del _clients[key]
+        _clients[client] = TokenBucket(ENV.SBNSIS_CLIENT_RATE, ENV.SBNSIS_CLIENT_BURST)
+    return _clients[client]
+
+
+def _global_bucket() -> TokenBucket:
+    global _global
+
+    if _global is None:
+        rate: float = ENV.SBNSIS_GLOBAL_RATE
+        if rate < 0:
+            from .renderpool import PIXEL_RATE
+
+            rate = PIXEL_RATE * max(1, ENV.SBNSIS_RENDER_PROCESSES)
+        _global = TokenBucket(rate, rate * 10)
+    return _global
+
+
+@contextmanager
+def admit(cost: float) -> Iterator[None]:
+    """Admit a render job for the current client, or reject it.
+
+
+    Parameters
+    ----------
+    cost : float
+        Estimated cost, in pixels.
+
+
+    Raises
+    ------
+    TooManyRequests
+        If the client has too many jobs in progress, or if the client's or
+        the worker's budget is spent.
+
+    """
+
+    client: str | None = CLIENT.get()
+    if client is None:
+        yield
+        return
+
+    with _lock:
+        if _renders.get(client, 0) >= ENV.SBNSIS_CLIENT_RENDERS > 0:
+            raise TooManyRequests(
+                "Too many images are being rendered for this client, please"
+                " wait for them to finish.",
+                1,
+            )
+
+        buckets: list[TokenBucket] = []
+        if ENV.SBNSIS_CLIENT_RATE > 0:
+            buckets.append(_client_bucket(client))
+        if ENV.SBNSIS_GLOBAL_RATE != 0:
+            buckets.append(_global_bucket())
+
+        delay: float = max([bucket.wait(cost) for bucket in buckets], default=0)
+        if delay > 0:
+            raise TooManyRequests(
+                "Too many images have been rendered recently, please try again"
+                " later.",
+                delay,
+            )
+
+        for bucket in buckets:
+            bucket.take(cost)
+        _renders[client] = _renders.get(client, 0) + 1
+
+    try:
+        yield
+    finally:
+        with _lock:
+            _renders[client] -= 1
+            if _renders[client] == 0:
+                del _renders[client]
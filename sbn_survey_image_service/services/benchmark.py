@@ -0,0 +1,179 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Remote read benchmarks for collection profiles.
+
+Cutouts are read from sample images with each candidate block size, through
+an empty block cache, i.e., as for a first request.  The fastest block size
+may be saved to the collection profile file (SBNSIS_COLLECTIONS).
+
+"""
+
+__all__ = ["benchmark_block_sizes", "benchmark_collection"]
+
+import json
+import time
+import logging
+import tempfile
+from typing import List
+
+import numpy as np
+import fsspec
+from astropy.io import fits
+from sqlalchemy.orm.session import Session
+
+from .blockcache import DiskBlockCache
+from .readers import section
+from ..models.image import Image
+from ..config.env import ENV
+from ..config.logging import get_logger
+from ..config.collections import CollectionProfile, profile, save_profile
+
+
+def _read_cutout(url: str, options: dict, data_ext: int, size: int) -> None:
+    with fsspec.open(url, "rb", **options) as f:
+        with fits.open(f, cache=False, lazy_load_hdus=True) as hdul:
+            hdu = hdul[data_ext]
+            ny, nx = hdu.shape
+            y0: int = max(0, ny // 2 - size // 2)
+            x0: int = max(0, nx // 2 - size // 2)
+            section(hdu, f)[y0 : y0 + size, x0 : x0 + size]
+
+
+def benchmark_block_sizes(
+    urls: List[str],
+    block_sizes: List[int],
+    collection_profile: CollectionProfile,
+    size: int = 512,
+) -> dict[int, float]:
+    """Time cutouts from remote images for each block size.
+
+
+    Parameters
+    ----------
+    urls : list of str
+        Sample image URLs.
+
+    block_sizes : list of int
+        Candidate block sizes in bytes.
+
+    collection_profile : CollectionProfile
+        The images' profile, for the data extension and read ahead.
+
+    size : int, optional
+        Cutout size in pixels, taken from the image center.
+
+
+    Returns
+    -------
+    times : dict
+        Median time per cutout in seconds, keyed by block size.
+
+    """
+
+    times: dict[int, float] = {}
+    for block_size in block_sizes:
+        samples: List[float] = []
+        for url in urls:
+            # an empty cache for each read
+            with tempfile.TemporaryDirectory() as directory:
+                options: dict = {
+                    "block_size": block_size,
+                    "cache_type": DiskBlockCache.name,
+                    "cache_options": {
+                        "url": url,
+                        "directory": directory,
+                        "read_ahead": collection_profile.read_ahead,
+                    },
+                }
+                t0: float = time.perf_counter()
+                _read_cutout(url, options, collection_profile.data_ext, size)
+                samples.append(time.perf_counter() - t0)
+
+        times[block_size] = float(np.median(samples))
+
+    return times
+
+
+def benchmark_collection(
+    session: Session,
+    collection: str,
+    block_sizes: List[int],
+    n: int = 5,
+    size: int = 512,
+    save: bool = False,
+) -> tuple[int, dict[int, float]]:
+    """Find the fastest remote read block size for a collection.
+
+
+    Parameters
+    ----------
+    session : sqlalchemy Session
+        Database session.
+
+    collection : str
+        The collection logical identifier.
+
+    block_sizes : list of int
+        Candidate block sizes in bytes.
+
+    n : int, optional
+        Number of sample images.
+
+    size : int, optional
+        Cutout size in pixels.
+
+    save : bool, optional
+        Save the best block size to the collection profile file,
+        SBNSIS_COLLECTIONS.
+
+
+    Returns
+    -------
+    best : int
+        The fastest block size.
+
+    times : dict
+        Median time per cutout in seconds, keyed by block size.
+
+    """
+
+    logger: logging.Logger = get_logger()
+    p: CollectionProfile = profile(collection)
+    urls: List[str] = [
+        url
+        for (url,) in session.query(Image.image_url)
+        .filter(Image.collection == collection)
+        .limit(n)
+    ]
+    if len(urls) == 0:
+        raise ValueError(f"No images found in {collection}.")
+
+    times: dict[int, float] = benchmark_block_sizes(urls, block_sizes, p, size)
+    best: int = min(times, key=times.get)
+    logger.info(
+        json.dumps(
+            {
+                "job": "benchmark",
+                "collection": collection,
+                "profile": p.name,
+                "images": len(urls),
+                "times": times,
+                "best": best,
+            }
+        )
+    )
+
+    if save:
+        if not ENV.SBNSIS_COLLECTIONS:
+            raise ValueError("SBNSIS_COLLECTIONS is not set.")
+        if p.lid_prefix:
+            save_profile(ENV.SBNSIS_COLLECTIONS, p.name, block_size=best)
+        else:
+            # a new profile for this collection
+            save_profile(
+                ENV.SBNSIS_COLLECTIONS,
+                collection.split(":")[-1],
+                lid_prefix=collection,
+                block_size=best,
+            )
+
+    return best, times
@@ -0,0 +1,415 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Persistent byte-range block cache for remote images.
+
+Remote files are read with fsspec in fixed-size blocks.  Blocks are saved to
+a shared directory, keyed by URL, file size, version (e.g., ETag), block size,
+and block number, so that repeated cutouts from the same remote image, by any
+worker process, reuse previously downloaded headers and data tiles, but a
+replaced image is read again.
+
+Blocks are written atomically.  The least-recently used blocks are removed
+when the cache exceeds its size limit.
+
+"""
+
+__all__ = [
+    "DiskBlockCache",
+    "block_cache_directory",
+    "fsspec_options",
+    "prune_block_cache",
+    "remote_version",
+]
+
+import os
+import fcntl
+import hashlib
+import logging
+from typing import Callable, List
+from urllib.parse import urlparse
+
+from fsspec.caching import BaseCache, Fetcher, register_cache
+
+from ..data import atomic_write
+from ..config.env import ENV
+from ..config.logging import get_logger
+from ..config.collections import CollectionProfile, DEFAULT_PROFILE
+from .upstream import client_kwargs
+
+
+def block_cache_directory() -> str:
+    """The block cache directory, default: "blocks" in the cutout cache."""
+    if ENV.SBNSIS_BLOCK_CACHE:
+        return ENV.SBNSIS_BLOCK_CACHE
+    return os.path.join(ENV.SBNSIS_CUTOUT_CACHE, "blocks")
+
+
+def remote_version(info: dict) -> str:
+    """The version of a remote file, from its fsspec info.
+
+    The ETag is preferred, then the modification date.  Empty if neither is
+    available.
+
+    """
+
+    for key in ["ETag", "LastModified", "Last-Modified", "mtime"]:
+        if info.get(key):
+            return str(info[key])
+    return ""
+
+
+def prune_block_cache(directory: str, max_size: int) -> int:
+    """Remove least-recently used blocks until the cache fits its limit.
+
+    The cache is pruned to 90% of ``max_size``, to avoid pruning on every
+    write.  If another process is pruning the cache, returns immediately.
+
+
+    Parameters
+    ----------
+    directory : str
+        The block cache directory.
+
+    max_size : int
+        Maximum cache size in bytes.
+
+
+    Returns
+    -------
+    n : int
+        Number of blocks removed.
+
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+
+        blocks: List[os.DirEntry] = []
+        for subdirectory in os.scandir(directory):
+            if not subdirectory.is_dir():
+                continue
+            blocks.extend(
+                entry
+                for entry in os.scandir(subdirectory.path)
+                if not entry.name.endswith((".tmp", ".lock"))
+            )
+
+        # (last use, size, path)
+        stats: List[tuple[float, int, str]] = []
+        for entry in blocks:
+            try:
+                stat: os.stat_result = entry.stat()
+            except FileNotFoundError:
+                continue
+            stats.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total: int = sum(s[1] for s in stats)
+        n: int = 0
+        for mtime, size, path in sorted(stats):
+            if total <= 0.9 * max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            n += 1
+
+    return n
+
+
+class DiskBlockCache(BaseCache):
+    """fsspec cache that saves blocks to a shared directory.
+
+    Cache misses are fetched with as few requests as possible: consecutive
+    missing blocks are requested together, and up to ``read_ahead`` blocks
+    following the requested range are also fetched.
+
+
+    Parameters
+    ----------
+    blocksize : int
+        Block size in bytes.
+
+    fetcher : callable
+        Function of the form ``f(start, end)`` that gets the bytes from the
+        remote file.
+
+    size : int
+        The remote file size.
+
+    url : str
+        The remote file URL, used to name the blocks.
+
+    version : str, optional
+        The remote file version, used to name the blocks, see
+        `remote_version`.
+
+    directory : str, optional
+        The block cache directory.  Default: `block_cache_directory`.
+
+    max_size : int, optional
+        Maximum cache size in bytes.  Default: SBNSIS_BLOCK_CACHE_SIZE.
+
+    read_ahead : int, optional
+        Number of blocks to read ahead.  Default: SBNSIS_READ_AHEAD.
+
+    """
+
+    name = "sbnsis-disk"
+
+    # bytes written by this process since the last pruning
+    _written: int = 0
+
+    def __init__(
+        self,
+        blocksize: int,
+        fetcher: Fetcher,
+        size: int,
+        url: str = "",
+        version: str = "",
+        directory: str | None = None,
+        max_size: int | None = None,
+        read_ahead: int | None = None,
+    ) -> None:
+        super().__init__(blocksize, fetcher, size)
+        self.url = url
+        self.version = version
+        self.directory = block_cache_directory() if directory is None else directory
+        self.max_size = (
+            ENV.SBNSIS_BLOCK_CACHE_SIZE * 2**20 if max_size is None else max_size
+        )
+        self.read_ahead = ENV.SBNSIS_READ_AHEAD if read_ahead is None else read_ahead
+        self.logger: logging.Logger = get_logger()
+
+        self.key: str = hashlib.md5(
+            f"{url} {size} {version} {blocksize}".encode()
+        ).hexdigest()
+        if size is not None:
+            self.nblocks = (size + blocksize - 1) // blocksize
+
+    def block_path(self, i: int) -> str:
+        return os.path.join(self.directory, self.key[:2], f"{self.key}-{i}")
+
+    def _read_block(self, i: int) -> bytes | None:
+        path: str = self.block_path(i)
+        try:
+            with open(path, "rb") as inf:
+                data: bytes = inf.read()
+            # mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _write_block(self, i: int, data: bytes) -> None:
+        os.makedirs(os.path.dirname(self.block_path(i)), exist_ok=True)
+        with atomic_write(self.block_path(i)) as outf:
+            outf.write(data)
+
+        DiskBlockCache._written += len(data)
+        if DiskBlockCache._written > 0.1 * self.max_size:
+            DiskBlockCache._written = 0
+            n: int = prune_block_cache(self.directory, self.max_size)
+            if n > 0:
+                self.logger.info("Removed %d blocks from the block cache.", n)
+
+    def _fetch_blocks(self, first: int, last: int) -> List[bytes]:
+        """Fetch consecutive blocks from the remote file and cache them."""
+
+        start: int = first * self.blocksize
+        stop: int = min((last + 1) * self.blocksize, self.size)
+        data: bytes = self.fetcher(start, stop)
+        self.total_requested_bytes += stop - start
+
+        # never cache a truncated response
+        complete: bool = len(data) == stop - start
+
+        blocks: List[bytes] = []
+        for i in range(first, last + 1):
+            offset: int = (i - first) * self.blocksize
+            blocks.append(data[offset : offset + self.blocksize])
+            if complete:
+                self._write_block(i, blocks[-1])
+        return blocks
+
+    def missing_runs(self, ranges: List[tuple[int, int]]) -> List[tuple[int, int]]:
+        """Runs of consecutive uncached blocks needed to read byte ranges.
+
+
+        Parameters
+        ----------
+        ranges : list of tuple
+            (start, stop) byte ranges.
+
+
+        Returns
+        -------
+        runs : list of tuple
+            (first, last) block numbers, inclusive.
+
+        """
+
+        needed: set[int] = set()
+        for start, stop in ranges:
+            if stop <= start:
+                continue
+            needed.update(
+                range(start // self.blocksize, (stop - 1) // self.blocksize + 1)
+            )
+
+        runs: List[List[int]] = []
+        for i in sorted(needed):
+            if os.path.exists(self.block_path(i)):
+                continue
+            if len(runs) > 0 and runs[-1][1] == i - 1:
+                runs[-1][1] = i
+            else:
+                runs.append([i, i])
+
+        return [tuple(run) for run in runs]
+
+    def prefetch(
+        self,
+        ranges: List[tuple[int, int]],
+        fetch_ranges: Callable[[List[tuple[int, int]]], List[bytes]],
+    ) -> int:
+        """Fetch and cache all blocks needed to read byte ranges.
+
+        Uncached blocks are fetched together with ``fetch_ranges``, e.g.,
+        with concurrent requests.
+
+
+        Parameters
+        ----------
+        ranges : list of tuple
+            (start, stop) byte ranges.
+
+        fetch_ranges : callable
+            Function that fetches a list of (start, stop) byte ranges from
+            the remote file.
+
+
+        Returns
+        -------
+        n : int
+            Number of blocks fetched.
+
+        """
+
+        runs: List[tuple[int, int]] = self.missing_runs(ranges)
+        if len(runs) == 0:
+            return 0
+
+        byte_ranges: List[tuple[int, int]] = [
+            (first * self.blocksize, min((last + 1) * self.blocksize, self.size))
+            for first, last in runs
+        ]
+        n: int = 0
+        for (first, last), (start, stop), data in zip(
+            runs, byte_ranges, fetch_ranges(byte_ranges)
+        ):
+            self.total_requested_bytes += stop - start
+            if len(data) != stop - start:
+                continue
+
+            for i in range(first, last + 1):
+                offset: int = (i - first) * self.blocksize
+                self._write_block(i, data[offset : offset + self.blocksize])
+                n += 1
+
+        self.miss_count += n
+        return n
+
+    def _fetch(self, start: int | None, stop: int | None) -> bytes:
+        if start is None:
+            start = 0
+        if stop is None:
+            stop = self.size
+        if self.size is None:
+            # unknown size, e.g., no Content-Length from the server
+            return self.fetcher(start, stop)
+        stop = min(stop, self.size)
+        if start >= self.size or start >= stop:
+            return b""
+
+        first: int = start // self.blocksize
+        last: int = (stop - 1) // self.blocksize
+
+        blocks: dict[int, bytes] = {}
+        missing: List[int] = []
+        for i in range(first, last + 1):
+            data: bytes | None = self._read_block(i)
+            if data is None:
+                missing.append(i)
+            else:
+                blocks[i] = data
+                self.hit_count += 1
+
+        # group consecutive missing blocks into runs
+        runs: List[List[int]] = []
+        for i in missing:
+            if len(runs) > 0 and runs[-1][-1] == i - 1:
+                runs[-1].append(i)
+            else:
+                runs.append([i])
+
+        for run in runs:
+            end: int = run[-1]
+            if end == last:
+                # read ahead, up to the next cached block
+                while end < min(
+                    last + self.read_ahead, self.nblocks - 1
+                ) and not os.path.exists(self.block_path(end + 1)):
+                    end += 1
+
+            self.miss_count += len(run)
+            for i, data in zip(range(run[0], end + 1), self._fetch_blocks(run[0], end)):
+                blocks[i] = data
+
+        offset: int = start - first * self.blocksize
+        result: bytes = b"".join(blocks[i] for i in range(first, last + 1))
+        return result[offset : offset + stop - start]
+
+
+register_cache(DiskBlockCache, clobber=True)
+
+
+def fsspec_options(url: str, profile: CollectionProfile = DEFAULT_PROFILE) -> dict:
+    """fsspec file options for reading a FITS image.
+
+    Remote files (e.g., HTTP or S3) use the persistent block cache, unless
+    SBNSIS_BLOCK_CACHE_SIZE is 0.  Other files use an in-memory cache.  The
+    collection profile may set the block size, cache type, and read ahead.
+    HTTP requests time out after SBNSIS_CONNECT_TIMEOUT and
+    SBNSIS_READ_TIMEOUT seconds.
+
+    """
+
+    block_size: int = (
+        ENV.SBNSIS_BLOCK_SIZE if profile.block_size is None else profile.block_size
+    )
+    cache_type: str = (
+        DiskBlockCache.name if profile.cache_type is None else profile.cache_type
+    )
+
+    options: dict = {"block_size": block_size, "cache_type": cache_type}
+    scheme: str = urlparse(url).scheme
+    if scheme in ["http", "https"]:
+        options["client_kwargs"] = client_kwargs()
+
+    if (
+        scheme not in ["", "file"]
+        and ENV.SBNSIS_BLOCK_CACHE_SIZE > 0
+        and cache_type == DiskBlockCache.name
+    ):
+        options["cache_options"] = {"url": url}
+        if profile.read_ahead is not None:
+            options["cache_options"]["read_ahead"] = profile.read_ahead
+    elif cache_type == DiskBlockCache.name:
+        options["cache_type"] = "bytes"
+
+    return options
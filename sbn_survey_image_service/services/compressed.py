@@ -0,0 +1,401 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Read planning for tile-compressed FITS images.
+
+In a tile-compressed image, each tile is a row of a binary table, and the
+compressed bytes are stored in the table's heap.  For a cutout, the tiles that
+overlap the cutout are found from the tile table, their heap byte ranges are
+merged, and all missing data are fetched with concurrent range requests into
+the remote block cache.  Decompression then reads only from the cache, rather
+than fetching one block at a time.
+
+Tiles are decompressed in parallel, in strips of tile rows, on a thread pool
+(the decompression codecs release the GIL), directly into the output array.
+
+Both rely on private astropy functions and attributes.  If they are not
+available (see `private_api`), images are read with astropy's
+`~astropy.io.fits.CompImageSection` instead, without planning or
+parallelism.
+
+"""
+
+__all__ = [
+    "tile_ranges",
+    "coalesce_ranges",
+    "decompress",
+    "private_api",
+    "PlannedSection",
+]
+
+import os
+import json
+import logging
+import threading
+from typing import List
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy.io import fits
+from astropy.io.fits.hdu.base import BITPIX2DTYPE
+
+try:
+    from astropy.io.fits.hdu.compressed._tiled_compression import (
+        decompress_image_data_section,
+    )
+except ImportError:
+    decompress_image_data_section = None
+
+from .blockcache import DiskBlockCache
+from .hedge import hedged_request, cat_ranges
+from ..config.env import ENV
+from ..config.logging import get_logger
+
+# heap array element sizes for binary table formats
+_ITEMSIZE: dict[str, int] = {"B": 1, "I": 2, "J": 4, "K": 8, "E": 4, "D": 8}
+
+# columns that may hold tile data; the latter two are used when a tile could
+# not be compressed with the main algorithm
+_TILE_COLUMNS: List[str] = [
+    "COMPRESSED_DATA",
+    "GZIP_COMPRESSED_DATA",
+    "UNCOMPRESSED_DATA",
+]
+
+
+# private astropy attributes of the image HDU and its tile table
+_HDU_ATTRIBUTES: List[str] = ["_bintable", "_do_not_scale_image_data", "_scale_data"]
+_TABLE_ATTRIBUTES: List[str] = ["_data_offset", "_theap", "_get_raw_data"]
+
+_warned: bool = False
+
+
+def private_api(hdu: fits.CompImageHDU) -> bool:
+    """Test if astropy's private tile compression API is available.
+
+    The package requirements limit astropy to the tested versions.
+
+
+    Parameters
+    ----------
+    hdu : CompImageHDU
+        The image.
+
+
+    Returns
+    -------
+    available : bool
+        ``True`` if tiles may be planned and decompressed with this module.
+
+    """
+
+    global _warned
+
+    available: bool = (
+        decompress_image_data_section is not None
+        and all(hasattr(hdu, name) for name in _HDU_ATTRIBUTES)
+        and all(hasattr(hdu._bintable, name) for name in _TABLE_ATTRIBUTES)
+    )
+    if not available and not _warned:
+        get_logger().warning(
+            "Planned reads and parallel decompression are not supported with"
+            " this version of astropy."
+        )
+        _warned = True
+    return available
+
+
+def _tile_indices(hdu: fits.CompImageHDU, region: tuple[slice, slice]) -> List[int]:
+    """Table rows of the tiles that overlap a region of the image."""
+
+    ny, nx = hdu.shape
+    tile_ny, tile_nx = hdu.tile_shape
+    n_tiles_x: int = (nx + tile_nx - 1) // tile_nx
+
+    y: slice = slice(*region[0].indices(ny)[:2])
+    x: slice = slice(*region[1].indices(nx)[:2])
+    if y.stop <= y.start or x.stop <= x.start:
+        return []
+
+    # FITS tile order: first axis (x) varies fastest
+    return [
+        ty * n_tiles_x + tx
+        for ty in range(y.start // tile_ny, (y.stop - 1) // tile_ny + 1)
+        for tx in range(x.start // tile_nx, (x.stop - 1) // tile_nx + 1)
+    ]
+
+
+def tile_ranges(
+    hdu: fits.CompImageHDU, region: tuple[slice, slice]
+) -> List[tuple[int, int]]:
+    """File byte ranges of the compressed tiles that overlap a region.
+
+    Reads the tile table, but not the tiles.
+
+
+    Parameters
+    ----------
+    hdu : CompImageHDU
+        The image.
+
+    region : tuple of slice
+        The (y, x) region of the image.
+
+
+    Returns
+    -------
+    ranges : list of tuple
+        (start, stop) byte ranges, in table order.
+
+    """
+
+    # astropy does not expose the tile table or the heap location
+    bintable: fits.BinTableHDU = hdu._bintable
+    heap: int = bintable._data_offset + bintable._theap
+
+    rows: List[int] = _tile_indices(hdu, region)
+    ranges: List[tuple[int, int]] = []
+    for name in _TILE_COLUMNS:
+        if name not in bintable.columns.names:
+            continue
+
+        format: str = bintable.columns[name].format
+        itemsize: int = _ITEMSIZE[format.lstrip("01").lstrip("PQ")[0]]
+        descriptors: np.ndarray = np.array(bintable.data[name])
+        for row in rows:
+            size, offset = descriptors[row]
+            if size > 0:
+                start: int = heap + int(offset)
+                ranges.append((start, start + int(size) * itemsize))
+
+    return ranges
+
+
+def coalesce_ranges(
+    ranges: List[tuple[int, int]], max_gap: int = 0
+) -> List[tuple[int, int]]:
+    """Merge overlapping byte ranges, and those separated by small gaps.
+
+
+    Parameters
+    ----------
+    ranges : list of tuple
+        (start, stop) byte ranges.
+
+    max_gap : int, optional
+        Merge ranges separated by up to this many bytes.
+
+
+    Returns
+    -------
+    merged : list of tuple
+        Sorted (start, stop) byte ranges.
+
+    """
+
+    merged: List[List[int]] = []
+    for start, stop in sorted(ranges):
+        if len(merged) > 0 and start - merged[-1][1] <= max_gap:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+
+    return [tuple(r) for r in merged]
+
+
+class _Heap:
+    """Thread-safe reads of the tile table heap.
+
+    Stands in for the tile table in astropy's decompression function, which
+    uses it only to read the heap.
+
+
+    Parameters
+    ----------
+    bintable : BinTableHDU
+        The tile table.
+
+    preload : bool, optional
+        Read the whole heap at once.
+
+    """
+
+    def __init__(self, bintable: fits.BinTableHDU, preload: bool = False):
+        self.bintable = bintable
+        self._data_offset: int = bintable._data_offset
+        self._theap: int = bintable._theap
+        self.lock = threading.Lock()
+
+        self.heap: np.ndarray | None = None
+        if preload:
+            self.heap = bintable._get_raw_data(
+                bintable.header["PCOUNT"], np.uint8, self._data_offset + self._theap
+            )
+
+    def _get_raw_data(self, shape: int, code: str, offset: int) -> np.ndarray:
+        if self.heap is None:
+            with self.lock:
+                return self.bintable._get_raw_data(shape, code, offset)
+
+        dtype: np.dtype = np.dtype(code)
+        start: int = offset - self._data_offset - self._theap
+        return self.heap[start : start + shape * dtype.itemsize].view(dtype)
+
+
+def decompress(
+    hdu: fits.CompImageHDU,
+    region: tuple[slice, slice] | None = None,
+    threads: int | None = None,
+) -> np.ndarray:
+    """Decompress a region of a tile-compressed image in parallel.
+
+    The region is divided into strips of tile rows, which are decompressed on
+    a thread pool into a preallocated array.  Reads from the file are
+    serialized.  Image scaling (BSCALE, BZERO) is applied as for
+    ``hdu.section``, which is used instead if `private_api` is not available.
+
+
+    Parameters
+    ----------
+    hdu : CompImageHDU
+        The image.
+
+    region : tuple of slice, optional
+        The (y, x) region to decompress, with a step of 1.  Default: the full
+        image.
+
+    threads : int, optional
+        Number of threads.  Default: SBNSIS_DECOMPRESS_THREADS, up to the
+        number of CPUs.
+
+
+    Returns
+    -------
+    data : ndarray
+
+    """
+
+    ny, nx = hdu.shape
+    if region is None:
+        region = (slice(None), slice(None))
+    if not private_api(hdu):
+        return hdu.section[region]
+
+    y: slice = slice(*region[0].indices(ny)[:2])
+    x: slice = slice(*region[1].indices(nx)[:2])
+    shape: tuple[int, int] = (max(y.stop - y.start, 0), max(x.stop - x.start, 0))
+
+    data: np.ndarray = np.empty(shape, BITPIX2DTYPE[hdu._bintable.header["ZBITPIX"]])
+    if data.size > 0:
+        tile_ny, tile_nx = hdu.tile_shape
+        tx: np.ndarray = np.array([x.start // tile_nx, (x.stop - 1) // tile_nx])
+        x0: int = tx[0] * tile_nx
+        heap: _Heap = _Heap(hdu._bintable, preload=(shape == hdu.shape))
+        # read the tile table once, rather than in each thread
+        tbl: fits.FITS_rec = hdu._bintable.data
+
+        def decompress_strip(rows: np.ndarray, tbl: fits.FITS_rec) -> None:
+            strip: np.ndarray = decompress_image_data_section(
+                tbl,
+                hdu.compression_type,
+                hdu._bintable.header,
+                heap,
+                hdu.header,
+                np.array([rows[0], tx[0]]),
+                np.array([rows[-1], tx[1]]),
+            )
+            y0: int = rows[0] * tile_ny
+            i: int = max(y.start, y0)
+            j: int = min(y.stop, y0 + strip.shape[0])
+            data[i - y.start : j - y.start] = strip[
+                i - y0 : j - y0, x.start - x0 : x.stop - x0
+            ]
+
+        if threads is None:
+            threads = min(ENV.SBNSIS_DECOMPRESS_THREADS, os.cpu_count() or 1)
+        tile_rows: np.ndarray = np.arange(
+            y.start // tile_ny, (y.stop - 1) // tile_ny + 1
+        )
+        # several strips per thread to balance the load
+        strips: List[np.ndarray] = np.array_split(
+            tile_rows, min(len(tile_rows), max(threads, 1) * 4)
+        )
+        if threads > 1 and len(strips) > 1:
+            with ThreadPoolExecutor(min(threads, len(strips))) as executor:
+                list(executor.map(partial(decompress_strip, tbl=tbl), strips))
+        else:
+            for rows in strips:
+                decompress_strip(rows, tbl)
+
+    if hdu._do_not_scale_image_data:
+        return data
+    return hdu._scale_data(data)
+
+
+class PlannedSection(fits.CompImageSection):
+    """Compressed image section with planned reads and parallel decompression.
+
+    For 2D slices, the tiles are fetched before decompressing, if the file is
+    read through the remote block cache, and decompressed with `decompress`.
+    Other indices are handled by `CompImageSection`.
+
+
+    Parameters
+    ----------
+    hdu : CompImageHDU
+        The image.
+
+    file : fsspec file object, optional
+        The file containing the image.
+
+    """
+
+    def __init__(self, hdu: fits.CompImageHDU, file=None):
+        super().__init__(hdu)
+        self.file = file
+        self.logger: logging.Logger = get_logger()
+
+    def prefetch(self, region: tuple[slice, slice]) -> None:
+        cache = getattr(self.file, "cache", None)
+        if not isinstance(cache, DiskBlockCache) or not private_api(self.hdu):
+            return
+
+        ranges: List[tuple[int, int]] = coalesce_ranges(
+            tile_ranges(self.hdu, region), max_gap=cache.blocksize
+        )
+
+        def fetch_ranges(url: str, byte_ranges: List[tuple[int, int]]) -> List[bytes]:
+            starts: List[int] = [r[0] for r in byte_ranges]
+            ends: List[int] = [r[1] for r in byte_ranges]
+            if url != cache.url:
+                # a mirror
+                return cat_ranges(url, starts, ends)
+
+            return self.file.fs.cat_ranges(
+                [self.file.path] * len(byte_ranges), starts, ends, on_error="raise"
+            )
+
+        n_requests: int = len(cache.missing_runs(ranges))
+        n_blocks: int = cache.prefetch(
+            ranges, partial(hedged_request, cache.url, fetch_ranges)
+        )
+        self.logger.debug(
+            json.dumps(
+                {
+                    "job": "prefetch",
+                    "url": self.file.path,
+                    "ranges": len(ranges),
+                    "requests": n_requests,
+                    "blocks": n_blocks,
+                }
+            )
+        )
+
+    def __getitem__(self, index):
+        if (
+            isinstance(index, tuple)
+            and len(index) == 2
+            and all(isinstance(i, slice) and i.step in (None, 1) for i in index)
+        ):
+            self.prefetch(index)
+            return decompress(self.hdu, index)
+        return super().__getitem__(index)
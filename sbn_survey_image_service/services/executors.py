@@ -0,0 +1,53 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Executors for blocking work in the async API.
+
+API controllers are coroutines run by the worker's event loop.  Blocking
+work, e.g., database queries, label look ups, and cached images, is run on
+SBNSIS_IO_THREADS threads with `run_io`, so that one worker serves many
+requests while they wait on the database or remote archives.  Requests wait
+in a queue when all threads are busy.
+
+Cutouts, browse images, and tile pyramids are rendered by the render process
+pool (see `~sbn_survey_image_service.services.renderpool`), and awaited on
+the event loop, not by the I/O threads.
+
+"""
+
+__all__ = ["io_executor", "run_io"]
+
+import asyncio
+import threading
+import contextvars
+from functools import partial
+from typing import Any, Callable, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+
+from ..config.env import ENV
+
+T = TypeVar("T")
+
+_executor: ThreadPoolExecutor | None = None
+_lock = threading.Lock()
+
+
+def io_executor() -> ThreadPoolExecutor:
+    """Thread pool for I/O-bound work, created on first use."""
+
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=ENV.SBNSIS_IO_THREADS, thread_name_prefix="sbnsis-io"
+            )
+        return _executor
+
+
+async def run_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking, I/O-bound function on the I/O thread pool."""
+    loop = asyncio.get_running_loop()
+    # with the caller's context variables, e.g., admission.CLIENT
+    context: contextvars.Context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        io_executor(), partial(context.run, func, *args, **kwargs)
+    )
@@ -0,0 +1,249 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Hedged reads from collection mirrors.
+
+Some collections are served by more than one host, e.g., the primary
+archive and a node mirror (see the ``mirrors`` collection profile setting).
+Remote reads of these collections are hedged:
+
+1. The read is requested from the primary URL.
+
+2. If there is no response within the SBNSIS_HEDGE_PERCENTILE latency
+   percentile of recent reads from the same host, the same read is
+   requested from a mirror.  Whichever response arrives first is used.
+
+3. If a request fails, the read is requested from the next mirror.
+
+Extra requests are limited to a fraction of all requests,
+SBNSIS_HEDGE_BUDGET, with a token bucket in each worker.  Each request is
+made with `upstream.request`, i.e., with the same timeouts, limits, and
+circuit breakers as other remote requests.
+
+"""
+
+__all__ = [
+    "LatencyTracker",
+    "HedgeBudget",
+    "alternates",
+    "cat_ranges",
+    "hedged_request",
+]
+
+import json
+import time
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, List, TypeVar
+from urllib.parse import urlparse
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import numpy as np
+import fsspec
+
+from .upstream import client_kwargs, request
+from ..config.env import ENV
+from ..config.exceptions import UpstreamUnavailable
+from ..config.logging import get_logger
+from ..config.collections import PROFILES
+
+T = TypeVar("T")
+
+# recent reads needed to estimate the hedging delay
+MIN_SAMPLES: int = 20
+
+# maximum number of saved extra requests
+MAX_TOKENS: float = 10
+
+
+class LatencyTracker:
+    """Recent successful read times from a remote host.
+
+
+    Parameters
+    ----------
+    n : int, optional
+        Number of reads to remember.
+
+    """
+
+    def __init__(self, n: int = 1000) -> None:
+        self.samples: Deque[float] = deque(maxlen=n)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def delay(self, percentile: float | None = None) -> float | None:
+        """Hedging delay, or ``None`` if there are too few samples.
+
+
+        Parameters
+        ----------
+        percentile : float, optional
+            Latency percentile.  Default: SBNSIS_HEDGE_PERCENTILE.
+
+        """
+
+        if len(self.samples) < MIN_SAMPLES:
+            return None
+
+        if percentile is None:
+            percentile = ENV.SBNSIS_HEDGE_PERCENTILE
+        return float(np.percentile(self.samples, percentile))
+
+
+class HedgeBudget:
+    """Token bucket limiting extra requests to a fraction of all requests.
+
+
+    Parameters
+    ----------
+    ratio : float, optional
+        Extra requests per request.  Default: SBNSIS_HEDGE_BUDGET.
+
+    """
+
+    def __init__(self, ratio: float | None = None) -> None:
+        self.ratio = ENV.SBNSIS_HEDGE_BUDGET if ratio is None else ratio
+        self.tokens: float = 0
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        """Earn a fraction of an extra request for a request."""
+        with self._lock:
+            self.tokens = min(self.tokens + self.ratio, MAX_TOKENS)
+
+    def withdraw(self) -> bool:
+        """Spend an extra request, if the budget allows."""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_latencies: dict[str, LatencyTracker] = {}
+_budget: HedgeBudget | None = None
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+
+def _latency(host: str) -> LatencyTracker:
+    with _lock:
+        if host not in _latencies:
+            _latencies[host] = LatencyTracker()
+        return _latencies[host]
+
+
+def _hedge_budget() -> HedgeBudget:
+    global _budget
+    with _lock:
+        if _budget is None:
+            _budget = HedgeBudget()
+        return _budget
+
+
+def alternates(url: str) -> List[str]:
+    """Mirror URLs of a remote file, from the collection profiles."""
+
+    urls: List[str] = []
+    for profile in PROFILES.values():
+        for prefix, mirror in profile.mirrors:
+            if url.startswith(prefix):
+                urls.append(mirror + url[len(prefix) :])
+    return urls
+
+
+def cat_ranges(url: str, starts: List[int], ends: List[int]) -> List[bytes]:
+    """Read byte ranges from a remote file with fsspec."""
+
+    options: dict = {}
+    if urlparse(url).scheme in ["http", "https"]:
+        options["client_kwargs"] = client_kwargs()
+    fs, path = fsspec.core.url_to_fs(url, **options)
+    return fs.cat_ranges([path] * len(starts), starts, ends, on_error="raise")
+
+
+def hedged_request(url: str, func: Callable[..., T], *args: Any) -> T:
+    """Make a remote read, hedged with requests to mirrors.
+
+
+    Parameters
+    ----------
+    url : str
+        The primary URL.
+
+    func : callable
+        The read, called as ``func(url, *args)`` for the primary URL and each
+        mirror URL.  Must be idempotent.
+
+
+    Returns
+    -------
+    result
+        The first successful response.  Requests still waiting for a worker
+        are cancelled, and those in flight are abandoned.
+
+
+    Raises
+    ------
+    Exception
+        The primary request's error, if all requests fail.
+
+    """
+
+    mirrors: List[str] = alternates(url)
+    if len(mirrors) == 0:
+        return request(url, func, url, *args)
+
+    latency: LatencyTracker = _latency(urlparse(url).netloc)
+    budget: HedgeBudget = _hedge_budget()
+    budget.deposit()
+
+    t0: float = time.monotonic()
+
+    def record(future: Future) -> None:
+        if future.exception() is None:
+            latency.record(time.monotonic() - t0)
+
+    primary: Future = _executor.submit(request, url, func, url, *args)
+    primary.add_done_callback(record)
+
+    delay: float | None = latency.delay()
+    pending: set[Future] = {primary}
+    while True:
+        done, pending = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.cancel()
+                return future.result()
+
+        if len(done) == 0:
+            # too slow, hedge once
+            delay = None
+            if not budget.withdraw():
+                continue
+        elif len(pending) > 0:
+            # wait for the request in flight
+            continue
+
+        if len(mirrors) == 0:
+            if len(pending) == 0:
+                error: BaseException | None = primary.exception()
+                if error is None:
+                    raise UpstreamUnavailable(f"No mirror of {url} responded.")
+                raise error
+            continue
+
+        mirror: str = mirrors.pop(0)
+        get_logger().debug(
+            json.dumps(
+                {
+                    "job": "hedge",
+                    "url": url,
+                    "mirror": mirror,
+                    "reason": "error" if len(done) > 0 else "slow",
+                    "seconds": round(time.monotonic() - t0, 3),
+                }
+            )
+        )
+        pending.add(_executor.submit(request, mirror, func, mirror, *args))
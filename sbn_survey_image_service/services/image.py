@@ -1,14 +1,18 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 """Data product image service."""
 
-__all__ = ["image_query"]
+__all__ = ["image_query", "image_query_async", "image_extensions"]
 
 import os
+import json
 from copy import copy
 import warnings
 from enum import Enum
+from typing import Any, Callable, Generator
 
-from PIL import Image as PIL_Image
+from PIL import Image as PIL_Image, features
+from PIL.PngImagePlugin import PngInfo
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm.exc import NoResultFound
 
 import numpy as np
@@ -17,15 +21,33 @@ from astropy.io import fits
 from astropy.time import Time
 from astropy.nddata import Cutout2D
 from astropy.wcs import WCS, FITSFixedWarning
+from astropy.wcs.utils import proj_plane_pixel_scales
 from astropy.coordinates import SkyCoord, Angle
-from astropy.visualization import ZScaleInterval
-from reproject import reproject_interp
 from pyavm import AVM
 
 from .database_provider import data_provider_session
-from ..data import url_to_local_file, generate_cache_filename
+from ..data import generate_cache_filename, atomic_write
 from ..models.image import Image
-from ..config.exceptions import InvalidImageID, ParameterValueError
+from ..models.statistics import ImageStatistics
+from ..config.env import ENV
+from ..config.exceptions import (
+    InvalidImageID,
+    ParameterValueError,
+    ImageTooLarge,
+    JobRequired,
+)
+from ..config.logging import get_logger
+from ..config.collections import CollectionProfile, DEFAULT_PROFILE, profile
+from .readers import open_image, section, image_data
+from .storage import local_file
+from .renderpool import Render, run_renders, run_renders_async
+from .render import (
+    reproject_image,
+    block_average,
+    stretch,
+    render_memory,
+    MemoryTrace,
+)
 from . import network
 
 from .. import __version__ as sis_version
@@ -37,6 +59,8 @@ class ImageFormat(Enum):
     JPEG = ("jpeg", "jpeg", "jpeg")
     JPG = ("jpg", "jpeg", "jpeg")
     PNG = ("png", "png", "png")
+    WEBP = ("webp", "webp", "webp")
+    AVIF = ("avif", "avif", "avif")
     DEFAULT = (None, "fits", "fits")
 
     def __new__(cls, parameter, format, extension):
@@ -47,6 +71,166 @@ class ImageFormat(Enum):
         return self
 
 
+BROWSE_FORMATS: list[ImageFormat] = [
+    ImageFormat.JPEG,
+    ImageFormat.JPG,
+    ImageFormat.PNG,
+    ImageFormat.WEBP,
+    ImageFormat.AVIF,
+]
+
+# default encoder options for each browse format
+ENCODER_DEFAULTS: dict[ImageFormat, dict] = {
+    ImageFormat.JPEG: {"quality": 95},
+    ImageFormat.JPG: {"quality": 95},
+    ImageFormat.PNG: {"compress_level": 1},
+    ImageFormat.WEBP: {"quality": 80},
+    ImageFormat.AVIF: {"quality": 75, "subsampling": "4:0:0", "speed": 8},
+}
+
+# chroma subsampling allowed for each browse format
+SUBSAMPLING: dict[ImageFormat, list[str]] = {
+    ImageFormat.JPEG: ["4:4:4", "4:2:2", "4:2:0"],
+    ImageFormat.JPG: ["4:4:4", "4:2:2", "4:2:0"],
+    ImageFormat.AVIF: ["4:4:4", "4:2:2", "4:2:0", "4:0:0"],
+}
+
+
+def encoder_options(
+    format: ImageFormat,
+    quality: int | None = None,
+    compress_level: int | None = None,
+    subsampling: str | None = None,
+) -> dict:
+    """Pillow encoder options for a browse image format.
+
+
+    Parameters
+    ----------
+    format : ImageFormat
+        The browse image format.
+
+    quality : int, optional
+        JPEG, WebP, or AVIF quality, 0 to 100.
+
+    compress_level : int, optional
+        PNG compression level, 0 (none) to 9 (slowest).
+
+    subsampling : str, optional
+        JPEG or AVIF chroma subsampling, e.g., "4:2:0".  Browse images are
+        grayscale, which AVIF encodes with "4:0:0".
+
+
+    Returns
+    -------
+    options : dict
+        The encoder options, including defaults for the format.
+
+
+    Raises
+    ------
+    ParameterValueError
+        For options that do not apply to the format, or invalid values.
+
+    """
+
+    if format not in BROWSE_FORMATS:
+        raise ParameterValueError("Encoder options require a browse image format.")
+
+    if format == ImageFormat.AVIF and not features.check("avif"):
+        raise ParameterValueError("AVIF is not supported by this server.")
+
+    options: dict = ENCODER_DEFAULTS[format].copy()
+
+    if quality is not None:
+        if "quality" not in options:
+            raise ParameterValueError(f"quality is not used for {format.value}.")
+        if not 0 <= quality <= 100:
+            raise ParameterValueError("quality must be between 0 and 100.")
+        options["quality"] = quality
+
+    if compress_level is not None:
+        if "compress_level" not in options:
+            raise ParameterValueError(f"compress_level is not used for {format.value}.")
+        if not 0 <= compress_level <= 9:
+            raise ParameterValueError("compress_level must be between 0 and 9.")
+        options["compress_level"] = compress_level
+
+    if subsampling is not None:
+        if format not in SUBSAMPLING:
+            raise ParameterValueError(f"subsampling is not used for {format.value}.")
+        if subsampling not in SUBSAMPLING[format]:
+            raise ParameterValueError(
+                f"{format.value} subsampling must be one of"
+                f" {', '.join(SUBSAMPLING[format])}."
+            )
+        options["subsampling"] = subsampling
+
+    return options
+
+
+# FITS tile compression algorithms
+FITS_COMPRESSION: dict[str, str] = {"rice": "RICE_1", "gzip": "GZIP_2"}
+
+# default quantization for Rice-compressed floating-point data (as for fpack)
+RICE_QUANTIZE: float = 16
+
+
+# relative cost of rendering a pixel, by output format
+FORMAT_COST: dict[ImageFormat, float] = {
+    ImageFormat.FITS: 1,
+    ImageFormat.JPEG: 1,
+    ImageFormat.JPG: 1,
+    ImageFormat.PNG: 1.5,
+    ImageFormat.WEBP: 2,
+    ImageFormat.AVIF: 4,
+}
+
+# relative cost of aligning (reprojecting) a pixel
+ALIGN_COST: float = 4
+
+
+def render_cost(
+    pixels: float,
+    format: ImageFormat,
+    align: bool = False,
+    bin: int = 1,
+    compress: str | None = None,
+) -> float:
+    """Estimated cost of rendering an image, in pixels.
+
+    The cost of a FITS cutout is the number of pixels, doubled for
+    compression.  The cost of a browse image is the number of pixels read,
+    plus the number of pixels rendered weighted by `FORMAT_COST` and
+    `ALIGN_COST`.
+
+
+    Parameters
+    ----------
+    pixels : float
+        Number of pixels in the source image or cutout.
+
+    format : ImageFormat
+        Output format.
+
+    align : bool, optional
+        Set to ``True`` if the image is aligned with north up.
+
+    bin : int, optional
+        Binning factor.
+
+    compress : str, optional
+        FITS compression algorithm.
+
+    """
+
+    if format == ImageFormat.FITS:
+        return pixels * (1 if compress is None else 2)
+
+    weight: float = FORMAT_COST[format] * (ALIGN_COST if align else 1)
+    return pixels + pixels * weight / bin**2
+
+
 class CutoutSpec:
     """Cutout center and size.
 
@@ -102,11 +286,69 @@ class CutoutSpec:
             # Dec -90 to 90
             self.dec = min(max(self.dec, -90), 90)
 
+    def pixels(self, pixel_scale: float | None) -> float:
+        """Estimated number of pixels in the cutout.
+
+
+        Parameters
+        ----------
+        pixel_scale : float or None
+            Image pixel scale in degrees.  If ``None``, then assume the cutout
+            is MAXIMUM_CUTOUT_SIZE pixels wide.
+
+        """
+
+        if pixel_scale is None or pixel_scale <= 0:
+            return float(ENV.MAXIMUM_CUTOUT_SIZE**2)
+        return float((self.size.deg / pixel_scale) ** 2)
+
+    def check_size(self, pixel_scale: float) -> None:
+        """Raise `ImageTooLarge` if the cutout exceeds MAXIMUM_CUTOUT_SIZE.
+
+
+        Parameters
+        ----------
+        pixel_scale : float
+            Image pixel scale in degrees.
+
+        """
+
+        width: float = self.size.deg / pixel_scale
+        if width > ENV.MAXIMUM_CUTOUT_SIZE:
+            raise ImageTooLarge(
+                f"The requested cutout is about {width:.0f} pixels wide, but the"
+                f" maximum is {ENV.MAXIMUM_CUTOUT_SIZE} pixels.  Request a smaller"
+                " size."
+            )
+
+    def cache_path(
+        self, url: str, compress: str | None = None, quantize: float | None = None
+    ) -> tuple[str, int]:
+        """Cache file name and data extension of a cutout."""
+
+        key: list[str] = [url, str(self), "fits"]
+        ext: int = 0
+        if compress is not None:
+            key.extend([compress, str(quantize)])
+            ext = 1
+        return generate_cache_filename(*key), ext
+
     def cutout(
-        self, obs_id: str, url: str, wcs_ext: int, data_ext: int, meta: dict = {}
+        self,
+        obs_id: str,
+        url: str,
+        wcs_ext: int,
+        data_ext: int,
+        meta: dict = {},
+        compress: str | None = None,
+        quantize: float | None = None,
+        profile: CollectionProfile = DEFAULT_PROFILE,
     ) -> str:
         """Generate a cutout from URL.
 
+        Compressed cutouts are saved as a tile-compressed image in the first
+        extension.
+
 
         Parameters
         ----------
@@ -125,6 +367,19 @@ class CutoutSpec:
         meta : dict, optional
             Optional metadata to add to the FITS header.
 
+        compress : str, optional
+            Tile compress the cutout with this algorithm: rice or gzip.
+
+        quantize : float, optional
+            Quantize floating-point data for compression, with a step size of
+            the image noise divided by this value.  Default: no quantization
+            for gzip, and `RICE_QUANTIZE` for rice.  Integer data are not
+            quantized.
+
+        profile : CollectionProfile, optional
+            The image's collection profile, for header fixes and read
+            settings.
+
 
         Returns
         -------
@@ -141,57 +396,40 @@ class CutoutSpec:
         """
 
         if self.full_size:
-            return url_to_local_file(url), wcs_ext, data_ext
+            return local_file(url), wcs_ext, data_ext
 
-        fits_image_path = generate_cache_filename(url, str(self), "fits")
+        fits_image_path, ext = self.cache_path(url, compress, quantize)
 
         # file exists?  done!
         if os.path.exists(fits_image_path):
-            return fits_image_path, 0, 0
+            return fits_image_path, ext, ext
 
         # output data object
         result = fits.HDUList()
 
-        # use fsspec so that we only read (and decompress) the portions of the
-        # file that are needed for the cutout
-        options = {
-            "cache": False,
-            "use_fsspec": True,
-            "lazy_load_hdus": True,
-            "fsspec_kwargs": {"block_size": 1024 * 512, "cache_type": "bytes"},
-        }
+        # only read (and decompress) the portions of the file that are needed
+        # for the cutout: local files are memory mapped, remote files use a
+        # persistent block cache, and the tiles of compressed images are
+        # fetched together and decompressed in parallel
         with network.set_astropy_useragent():
-            with fits.open(url, **options) as data:
-                wcs_header: fits.Header = copy(data[wcs_ext].header)
+            with open_image(url, profile) as (data, f):
+                wcs_header: fits.Header = profile.fix_header(copy(data[wcs_ext].header))
 
                 with warnings.catch_warnings():
                     warnings.simplefilter(
                         "ignore", (fits.verify.VerifyWarning, FITSFixedWarning)
                     )
 
-                    # XPIXELSZ and YPIXELSZ cause wcslib to look for DSS distortion
-                    # keywords.  This causes failures for NEAT data.
-                    try:
-                        wcs = WCS(wcs_header)
-                    except ValueError:
-                        # try to fix the header
-                        retry = False
-
-                        if "XPIXELSZ" in wcs_header:
-                            retry = True
-                            del wcs_header["XPIXELSZ"]
-
-                        if "YPIXELSZ" in wcs_header:
-                            retry = True
-                            del wcs_header["YPIXELSZ"]
+                    # problematic keywords were removed by the profile's
+                    # header fixes, e.g., XPIXELSZ and YPIXELSZ in NEAT data
+                    wcs = WCS(wcs_header)
 
-                        if retry:
-                            wcs = WCS(wcs_header)
-                        else:
-                            raise
+                # the size limit, for images without a known pixel scale,
+                # before any data are read
+                self.check_size(float(np.min(proj_plane_pixel_scales(wcs))))
 
                 cutout = Cutout2D(
-                    data[data_ext].section, self.coords, self.size, wcs=wcs
+                    section(data[data_ext], f), self.coords, self.size, wcs=wcs
                 )
 
             header: fits.Header = copy(data[data_ext].header)
@@ -207,15 +445,30 @@ class CutoutSpec:
             for k, v in meta.items():
                 header[k] = v
 
-            result.append(fits.PrimaryHDU(cutout.data, header))
-            result.writeto(fits_image_path, output_verify="silentfix")
+            if compress is None:
+                result.append(fits.PrimaryHDU(cutout.data, header))
+            else:
+                if quantize is None:
+                    quantize = RICE_QUANTIZE if compress == "rice" else 0
+                result.append(fits.PrimaryHDU())
+                result.append(
+                    fits.CompImageHDU(
+                        cutout.data,
+                        header,
+                        compression_type=FITS_COMPRESSION[compress],
+                        quantize_level=quantize,
+                    )
+                )
 
-        os.chmod(fits_image_path, 33204)
+            with atomic_write(fits_image_path) as outf:
+                result.writeto(outf, output_verify="silentfix")
 
-        return fits_image_path, 0, 0
+        return fits_image_path, ext, ext
 
 
-def filename_suffix(cutout_spec: CutoutSpec, format: ImageFormat) -> str:
+def filename_suffix(
+    cutout_spec: CutoutSpec, format: ImageFormat, compress: str | None = None
+) -> str:
     """Generate the file name suffix based on query parameters.
 
 
@@ -227,7 +480,10 @@ def filename_suffix(cutout_spec: CutoutSpec, format: ImageFormat) -> str:
         The center and size of the cutout.
 
     format : ImageFormat
-        Returned image format: fits, png, jpeg
+        Returned image format: fits, png, jpeg, webp, avif
+
+    compress : str, optional
+        FITS compression algorithm, if any.
 
 
     Returns
@@ -241,6 +497,10 @@ def filename_suffix(cutout_spec: CutoutSpec, format: ImageFormat) -> str:
         # attachment file name is based on coordinates and size
         suffix = f"_{cutout_spec.ra:.5f}{cutout_spec.dec:+.5f}_{cutout_spec.size}"
 
+    # fpack convention
+    if compress is not None:
+        return f"{suffix}.{format.extension}.fz"
+
     return f"{suffix}.{format.extension}"
 
 
@@ -251,8 +511,12 @@ def create_browse_image(
     align: bool,
     wcs_ext: int,
     data_ext: int,
+    limits: tuple[float, float] | None = None,
+    bin: int = 1,
+    options: dict | None = None,
+    profile: CollectionProfile = DEFAULT_PROFILE,
 ) -> None:
-    """Create the browse (JPEG, PNG) image.
+    """Create the browse (JPEG, PNG, WebP, AVIF) image.
 
 
     Parameters
@@ -264,7 +528,7 @@ def create_browse_image(
         The file name of the output.
 
     format : ImageFormat
-        The format of the output (must be JPEG, JPG, or PNG).
+        The format of the output, one of `BROWSE_FORMATS`.
 
     align : bool
         Align the image with north up.
@@ -275,73 +539,399 @@ def create_browse_image(
     data_ext : int
         The FITS HDU extension with the data to cutout.
 
+    limits : tuple of float, optional
+        Display limits, e.g., precomputed for the full image.  If ``None``,
+        the limits are computed from the data with the zscale algorithm.
+
+    bin : int, optional
+        Downsample the image by averaging ``bin`` × ``bin`` pixel blocks
+        before reprojection.
+
+    options : dict, optional
+        Encoder options, see `encoder_options`.
+
+    profile : CollectionProfile, optional
+        The image's collection profile, for header fixes.
+
     """
 
     format = ImageFormat(format)
 
-    hdul = fits.open(input_image, "readonly")
-    data = hdul[data_ext].data
-
-    h = hdul[wcs_ext].header.copy()
-
-    # These keywords (e.g., in NEAT data) trigger DSS mode in wcslib... avoid
-    # that:
-    if "XPIXELSZ" in h:
-        del h["XPIXELSZ"]
-    if "YPIXELSZ" in h:
-        del h["YPIXELSZ"]
-
-    # current wcs
-    wcs0 = WCS(h)
-
-    # new wcs based on image center
-    # Given that CRPIX is a 1-based index:
-    crpix = np.array(data.shape) / 2 + 0.5
-    crval = wcs0.pixel_to_world_values(*(crpix - 1))
-    wcs = WCS()
-    wcs.pixel_shape = data.shape
-    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
-    wcs.wcs.crpix = crpix
-    wcs.wcs.crval = crval
-    wcs.wcs.pc = wcs0.wcs.get_pc()
-    wcs.wcs.cdelt = wcs0.wcs.get_cdelt()
-
-    if align:
-        # align with north up, east left
-        wcs.wcs.pc = np.array([[-1, 0], [0, 1]])
-        wcs.wcs.cdelt = [np.abs(x.value) for x in wcs0.proj_plane_pixel_scales()]
-
-    # reproject to the new WCS
-    data = reproject_interp(
-        (data, wcs0),
-        wcs,
-        shape_out=data.shape,
-        return_footprint=False,
-        order="nearest-neighbor",
-        parallel=True,
+    trace: MemoryTrace
+    with (
+        open_image(input_image) as (hdul, _),
+        MemoryTrace(ENV.SBNSIS_TRACE_MEMORY.upper() == "TRUE") as trace,
+    ):
+        check_render_memory(hdul[data_ext], bin)
+
+        if bin > 1:
+            data = block_average(hdul[data_ext], bin)
+        else:
+            data = image_data(hdul[data_ext])
+
+        # remove problematic keywords, e.g., XPIXELSZ and YPIXELSZ in NEAT
+        # data trigger DSS mode in wcslib
+        h = profile.fix_header(hdul[wcs_ext].header.copy())
+
+        # current wcs
+        wcs0 = WCS(h)
+        if bin > 1:
+            # WCS slicing accounts for the binned pixel centers
+            wcs0 = wcs0[::bin, ::bin]
+
+        # new wcs based on image center
+        # Given that CRPIX is a 1-based index:
+        crpix = np.array(data.shape) / 2 + 0.5
+        crval = wcs0.pixel_to_world_values(*(crpix - 1))
+        wcs = WCS()
+        wcs.pixel_shape = data.shape
+        wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+        wcs.wcs.crpix = crpix
+        wcs.wcs.crval = crval
+        wcs.wcs.pc = wcs0.wcs.get_pc()
+        wcs.wcs.cdelt = wcs0.wcs.get_cdelt()
+
+        if align:
+            # align with north up, east left
+            wcs.wcs.pc = np.array([[-1, 0], [0, 1]])
+            wcs.wcs.cdelt = [np.abs(x.value) for x in wcs0.proj_plane_pixel_scales()]
+
+        # reproject to the new WCS, avoiding full reprojection when possible
+        data = reproject_image(data, wcs0, wcs, data.shape)
+
+        # stretch to 0 to 255 as unsigned int, save with XMP-formatted WCS
+        image = PIL_Image.fromarray(stretch(data, limits)[::-1])
+        del data
+        save_browse_image(image, output_image, format, AVM.from_wcs(wcs), options)
+        del image
+
+    get_logger().info(
+        json.dumps(
+            {
+                "job": "render",
+                "output": output_image,
+                "bin": bin,
+                "peak_alloc_mb": (
+                    None
+                    if trace.peak_alloc is None
+                    else round(trace.peak_alloc / 2**20, 1)
+                ),
+                "max_rss_mb": round(trace.max_rss / 2**20, 1),
+                "rss_growth_mb": round(trace.rss_growth / 2**20, 1),
+            }
+        )
     )
 
-    # zscale, stretch to 0 to 255, and convert to unsigned int, save
-    interval = ZScaleInterval()
-    data = interval(data, clip=True) * 255
-    image = PIL_Image.fromarray(data.astype(np.uint8)[::-1])
-    image.save(output_image, format=format.format, quality=95)
 
-    hdul.close()
+def save_browse_image(
+    image: PIL_Image.Image,
+    path: str,
+    format: ImageFormat,
+    avm: AVM,
+    options: dict | None = None,
+) -> None:
+    """Encode and save a browse image with embedded AVM metadata.
+
+    The XMP packet is added by the encoder, so that the image is written
+    once, and atomically.
+
+
+    Parameters
+    ----------
+    image : PIL.Image.Image
+        The image.
+
+    path : str
+        The output file name.
+
+    format : ImageFormat
+        The output format, one of `BROWSE_FORMATS`.
+
+    avm : AVM
+        The metadata.
+
+    options : dict, optional
+        Encoder options, see `encoder_options`.  Default: the format's
+        defaults.
+
+    """
+
+    options = encoder_options(format) if options is None else options.copy()
+
+    xmp: bytes = avm.to_xmp()
+    if format == ImageFormat.PNG:
+        info: PngInfo = PngInfo()
+        info.add_itxt("XML:com.adobe.xmp", xmp.decode())
+        options["pnginfo"] = info
+    else:
+        options["xmp"] = xmp
+
+    with atomic_write(path) as outf:
+        image.save(outf, format=format.format, **options)
 
-    # annotate with XMP-formatted WCS
-    avm = AVM.from_wcs(wcs)
-    avm.embed(output_image, output_image)
 
+def check_render_memory(hdu: fits.ImageHDU | fits.CompImageHDU, bin: int) -> None:
+    """Verify that rendering an image fits in the memory budget.
 
-def image_query(
+    The image data are not read.
+
+
+    Raises
+    ------
+    ImageTooLarge
+        If the estimated memory exceeds SBNSIS_RENDER_MEMORY_LIMIT.
+
+    """
+
+    if ENV.SBNSIS_RENDER_MEMORY_LIMIT <= 0:
+        return
+
+    header: fits.Header = hdu.header
+    itemsize: int = abs(header["BITPIX"]) // 8
+    if header.get("BSCALE", 1) != 1 or header.get("BZERO", 0) != 0:
+        # scaled integers are read as floats
+        itemsize = max(itemsize, 4)
+
+    required: int = render_memory(hdu.shape, itemsize, bin)
+    limit: int = ENV.SBNSIS_RENDER_MEMORY_LIMIT * 2**20
+    if required > limit:
+        raise ImageTooLarge(
+            f"Rendering this image requires about {required / 2**20:.0f} MiB, but"
+            f" the limit is {ENV.SBNSIS_RENDER_MEMORY_LIMIT} MiB.  Request a"
+            " cutout, or a downsampled image with max_size or bin."
+        )
+
+
+def image_extensions(collection: str) -> tuple[int, int]:
+    """FITS HDU extensions with the WCS and the data for a collection.
+
+    See `~sbn_survey_image_service.config.collections`.
+
+
+    Returns
+    -------
+    wcs_ext, data_ext : int
+
+    """
+
+    p: CollectionProfile = profile(collection)
+    return p.wcs_ext, p.data_ext
+
+
+def display_limits(image_id: int) -> tuple[float, float] | None:
+    """Precomputed display limits for an image, if available."""
+
+    try:
+        with data_provider_session() as session:
+            limits: tuple[float, float] | None = (
+                session.query(ImageStatistics.zscale_min, ImageStatistics.zscale_max)
+                .filter(ImageStatistics.image_id == image_id)
+                .one_or_none()
+            )
+    except SQLAlchemyError:
+        # e.g., the statistics table has not yet been created
+        get_logger().warning("Image statistics are unavailable.", exc_info=True)
+        return None
+
+    if limits is None or None in limits:
+        return None
+
+    return tuple(limits)
+
+
+def binning_factor(
+    path: str, data_ext: int, max_size: int | None, bin: int | None
+) -> int:
+    """Binning factor for requested maximum image size and binning."""
+
+    factor: int = 1 if bin is None else bin
+    if max_size is not None:
+        # for compressed images, this is the image header
+        header: fits.Header = fits.getheader(path, data_ext)
+        size: int = max(header["NAXIS1"], header["NAXIS2"])
+        factor = max(factor, int(np.ceil(size / max_size)))
+
+    return factor
+
+
+def _image_query(
     obs_id: str,
     ra: float | None = None,
     dec: float | None = None,
     size: str | None = None,
     align: bool = False,
     format: str | ImageFormat | None = None,
-) -> tuple[str, str]:
+    stretch: str = "image",
+    max_size: int | None = None,
+    bin: int | None = None,
+    quality: int | None = None,
+    compress_level: int | None = None,
+    subsampling: str | None = None,
+    compress: str | None = None,
+    quantize: float | None = None,
+    max_cost: float | None = None,
+    progress: Callable[[float], None] | None = None,
+) -> Generator[Render, Any, tuple[str, str]]:
+    """`image_query`, yielding its render jobs, see `renderpool.run_renders`."""
+
+    cutout_spec = CutoutSpec(ra, dec, size)
+
+    try:
+        format = ImageFormat(format)
+    except ValueError:
+        raise ParameterValueError(
+            "image_query format must be fits, png, jpeg, webp, or avif."
+        )
+
+    if stretch not in ["image", "local"]:
+        raise ParameterValueError("image_query stretch must be image or local.")
+
+    browse: bool = format in BROWSE_FORMATS
+    if (max_size is not None or bin is not None) and not browse:
+        raise ParameterValueError("max_size and bin require a browse image format.")
+
+    options: dict | None = None
+    if browse:
+        options = encoder_options(format, quality, compress_level, subsampling)
+    elif not all(x is None for x in (quality, compress_level, subsampling)):
+        raise ParameterValueError("Encoder options require a browse image format.")
+
+    if (max_size is not None and max_size < 1) or (bin is not None and bin < 1):
+        raise ParameterValueError("max_size and bin must be positive integers.")
+
+    if compress is not None:
+        if browse:
+            raise ParameterValueError("compress requires format=fits.")
+        if cutout_spec.full_size:
+            raise ParameterValueError("compress is only allowed for cutouts.")
+        if compress not in FITS_COMPRESSION:
+            raise ParameterValueError("compress must be rice or gzip.")
+
+    if quantize is not None:
+        if compress is None:
+            raise ParameterValueError("quantize requires compress.")
+        if quantize <= 0:
+            raise ParameterValueError("quantize must be positive.")
+
+    with data_provider_session() as session:
+        try:
+            im = session.query(Image).filter(Image.obs_id == obs_id).one()
+        except NoResultFound as exc:  # noqa: F841
+            raise InvalidImageID("Image ID not found in database.") from exc
+
+        session.expunge(im)
+
+    # create attachment file name
+    download_filename = os.path.splitext(os.path.basename(im.image_url))[0]
+    download_filename += filename_suffix(cutout_spec, format, compress)
+
+    p: CollectionProfile = profile(im.collection)
+
+    pixel_scale: float | None = p.pixel_scale(obs_id) or im.pixel_scale
+    if not cutout_spec.full_size and pixel_scale:
+        # otherwise, checked with the image WCS when the cutout is made
+        cutout_spec.check_size(pixel_scale)
+
+    # generate the cutout, as needed; potentially update wcs and data extension
+    # indices; new cutouts are made by the render pool
+    cutout_args: tuple = (obs_id, im.image_url, p.wcs_ext, p.data_ext)
+    cutout_kwargs: dict = dict(compress=compress, quantize=quantize, profile=p)
+    if cutout_spec.full_size or os.path.exists(
+        cutout_spec.cache_path(im.image_url, compress, quantize)[0]
+    ):
+        fits_image_path, wcs_ext, data_ext = cutout_spec.cutout(
+            *cutout_args, **cutout_kwargs
+        )
+    else:
+        pixels: float = cutout_spec.pixels(pixel_scale)
+        cost: float = render_cost(pixels, ImageFormat.FITS, compress=compress)
+        if max_cost is not None:
+            estimate: float = cost
+            if browse:
+                estimate += render_cost(pixels, format, align, bin or 1)
+            if estimate > max_cost:
+                raise JobRequired("This cutout is too costly to render now.", estimate)
+
+        fits_image_path, wcs_ext, data_ext = yield Render(
+            cost, cutout_spec.cutout, cutout_args, cutout_kwargs
+        )
+
+    if progress is not None:
+        progress(0.5)
+
+    # FITS format?  done!
+    if format == ImageFormat.FITS:
+        return fits_image_path, download_filename
+
+    limits: tuple[float, float] | None = None
+    if stretch == "image":
+        limits = display_limits(im.id)
+
+    factor: int = binning_factor(fits_image_path, data_ext, max_size, bin)
+
+    def browse_path(factor: int) -> str:
+        # formulate the final image file name
+        key: list[str] = [
+            im.image_url,
+            str(cutout_spec),
+            format.extension,
+            str(not cutout_spec.full_size and align and format in BROWSE_FORMATS),
+        ]
+        if limits is not None:
+            key.append("limits{}:{}".format(*limits))
+        if factor > 1:
+            key.append(f"bin{factor}")
+        if options != ENCODER_DEFAULTS[format]:
+            key.append(json.dumps(options, sort_keys=True))
+        return generate_cache_filename(*key)
+
+    image_path = browse_path(factor)
+
+    # was this file already generated?  serve it!
+    if os.path.exists(image_path):
+        return image_path, download_filename
+
+    # downsample images that are too costly to render
+    header: fits.Header = fits.getheader(fits_image_path, data_ext)
+    pixels = header.get("NAXIS1", 0) * header.get("NAXIS2", 0)
+    cost = render_cost(pixels, format, align, factor)
+    limit: float = ENV.SBNSIS_RENDER_COST_LIMIT
+    if limit > 0 and cost > limit:
+        if pixels >= limit:
+            raise ImageTooLarge(
+                "This image is too large to render.  Request a cutout instead."
+            )
+
+        # solve render_cost(pixels, format, align, bin) = limit for bin
+        weight: float = render_cost(1, format, align) - 1
+        factor = int(np.ceil(np.sqrt(pixels * weight / (limit - pixels))))
+        cost = render_cost(pixels, format, align, factor)
+        get_logger().info(
+            json.dumps({"job": "images", "id": obs_id, "downsampled": factor})
+        )
+
+        image_path = browse_path(factor)
+        if os.path.exists(image_path):
+            return image_path, download_filename
+
+    if max_cost is not None and cost > max_cost:
+        raise JobRequired("This image is too costly to render now.", cost)
+
+    # create the browse image with the render pool
+    yield Render(
+        cost,
+        create_browse_image,
+        (fits_image_path, image_path, format, align, wcs_ext, data_ext),
+        dict(limits=limits, bin=factor, options=options, profile=p),
+    )
+
+    if progress is not None:
+        progress(1.0)
+
+    return image_path, download_filename
+
+
+def image_query(*args: Any, **kwargs: Any) -> tuple[str, str]:
     """Query database for image file or cutout thereof.
 
 
@@ -363,11 +953,44 @@ def image_query(
         `astropy.units.Quantity`.
 
     align : bool, option
-        Set to `True` to align JPEG or PNG images with north up.  Ignored
+        Set to `True` to align browse images with north up.  Ignored
         for other formats.
 
     format : str or ImageFormat, optional
-        Returned image format: fits, png, jpeg
+        Returned image format: fits, png, jpeg, webp, avif
+
+    stretch : str, optional
+        Browse image display limits: "image" to use limits precomputed for
+        the full image (if available), or "local" to compute them from the
+        returned pixels.
+
+    max_size : int, optional
+        Downsample JPEG or PNG images by an integer factor so that neither
+        dimension exceeds this many pixels.
+
+    bin : int, optional
+        Downsample JPEG or PNG images by averaging ``bin`` × ``bin`` pixel
+        blocks.  If ``max_size`` requires a larger factor, then that is used
+        instead.
+
+    quality, compress_level, subsampling : optional
+        Browse image encoder options, see `encoder_options`.
+
+    compress : str, optional
+        Tile compress FITS cutouts: rice or gzip.
+
+    quantize : float, optional
+        Quantize floating-point data in compressed FITS cutouts, with a step
+        size of the image noise divided by this value, e.g., 16.  Rice
+        compression of floating-point data is always quantized.
+
+    max_cost : float, optional
+        Raise `JobRequired` instead of rendering, if the estimated cost of
+        the request exceeds this many pixels.
+
+    progress : callable, optional
+        Called with the fraction of the request completed, after the cutout
+        and the browse image.
 
 
     Returns
@@ -380,67 +1003,15 @@ def image_query(
 
     """
 
-    cutout_spec = CutoutSpec(ra, dec, size)
-
-    try:
-        format = ImageFormat(format)
-    except ValueError:
-        raise ParameterValueError("image_query format must be fits, png, or jpeg.")
-
-    with data_provider_session() as session:
-        try:
-            im = session.query(Image).filter(Image.obs_id == obs_id).one()
-        except NoResultFound as exc:  # noqa: F841
-            raise InvalidImageID("Image ID not found in database.") from exc
-
-        session.expunge(im)
-
-    # create attachment file name
-    download_filename = os.path.splitext(os.path.basename(im.image_url))[0]
-    download_filename += filename_suffix(cutout_spec, format)
-
-    # NEAT, ATLAS: data and WCS are found in the first extension
-    wcs_ext = 0
-    data_ext = 0
-    collections_with_wcs_ext_1 = [":gbo.ast.atlas.survey", ":gbo.ast.neat.survey"]
-    if any(c in im.collection for c in collections_with_wcs_ext_1):
-        wcs_ext = 1
-        data_ext = 1
-
-    # generate the cutout, as needed; potentially update wcs and data extension indices
-    fits_image_path, wcs_ext, data_ext = cutout_spec.cutout(
-        obs_id,
-        im.image_url,
-        wcs_ext,
-        data_ext,
-    )
+    return run_renders(_image_query(*args, **kwargs))
 
-    # FITS format?  done!
-    if format == ImageFormat.FITS:
-        return fits_image_path, download_filename
 
-    # formulate the final image file name
-    image_path = generate_cache_filename(
-        im.image_url,
-        str(cutout_spec),
-        format.extension,
-        str(
-            not cutout_spec.full_size
-            and align
-            and format in (ImageFormat.JPEG, ImageFormat.JPG, ImageFormat.PNG)
-        ),
-    )
+async def image_query_async(*args: Any, **kwargs: Any) -> tuple[str, str]:
+    """Coroutine version of `image_query`, awaiting its renders.
 
-    # was this file already generated?  serve it!
-    if os.path.exists(image_path):
-        return image_path, download_filename
+    The database and cache are read on the I/O threads, see
+    `renderpool.run_renders_async`.
 
-    # create the jpeg or png
-    create_browse_image(fits_image_path, image_path, format, align, wcs_ext, data_ext)
-
-    # rw-rw-r--
-    # In [16]: (stat.S_IFREG | stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)
-    # Out[16]: 33204
-    os.chmod(image_path, 33204)
+    """
 
-    return image_path, download_filename
+    return await run_renders_async(_image_query(*args, **kwargs))
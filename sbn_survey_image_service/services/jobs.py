@@ -0,0 +1,378 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Asynchronous image jobs.
+
+Costly cutouts and browse images may be requested as jobs, in the spirit of
+the IVOA Universal Worker Service (UWS).  A job moves through the phases
+QUEUED, EXECUTING, and then COMPLETED or ERROR.  When it is completed, its
+result is the image, served from the cache by the images endpoint.
+
+Jobs are saved in a small SQLite database in the cutout cache, shared by all
+workers on the host:
+
+* The job ID is derived from the request parameters, so that identical
+  requests share a job.
+
+* A job is executed by the worker that submitted it, with the render pool.
+  Jobs are subject to the submitting client's render limits, but wait for
+  their turn instead of failing.
+  Jobs of a worker that stopped are resumed by the next worker that starts,
+  or by the next identical request.
+
+* Finished jobs are removed after SBNSIS_JOB_EXPIRY hours.
+
+"""
+
+__all__ = [
+    "job_id_for",
+    "result_url",
+    "JobQueue",
+    "job_queue",
+    "execute",
+    "submit",
+    "resume",
+]
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+from functools import partial
+from contextlib import closing
+from datetime import datetime, timezone
+from urllib.parse import quote, urlencode
+
+from .image import image_query_async
+from .executors import run_io
+from ..config.env import ENV
+from ..config.exceptions import (
+    InvalidJob,
+    RenderQueueFull,
+    SBNSISException,
+    TooManyRequests,
+)
+from ..config.logging import get_logger
+
+
+def _alive(pid: int | None) -> bool:
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _isotime(t: float | None) -> str | None:
+    if t is None:
+        return None
+    return datetime.fromtimestamp(t, timezone.utc).isoformat(timespec="seconds")
+
+
+def job_id_for(parameters: dict) -> str:
+    """Job ID for the request parameters."""
+
+    m = hashlib.sha256()
+    m.update(json.dumps(parameters, sort_keys=True).encode())
+    return m.hexdigest()[:32]
+
+
+def result_url(parameters: dict) -> str:
+    """URL of the images endpoint for a job's request parameters."""
+
+    query: dict = {}
+    for k, v in parameters.items():
+        if k == "obs_id" or v is None:
+            continue
+        query[k] = str(v).lower() if isinstance(v, bool) else v
+
+    url: str = ENV.BASE_HREF.rstrip("/") + "/images/" + quote(parameters["obs_id"])
+    if len(query) > 0:
+        url += "?" + urlencode(query)
+    return url
+
+
+class JobQueue:
+    """Persistent queue of image jobs.
+
+
+    Parameters
+    ----------
+    path : str
+        The SQLite database file name.
+
+    expiry : float, optional
+        Hours to keep finished jobs.  Default: SBNSIS_JOB_EXPIRY.
+
+    """
+
+    def __init__(self, path: str, expiry: float | None = None) -> None:
+        self.path = path
+        self.expiry = ENV.SBNSIS_JOB_EXPIRY if expiry is None else expiry
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    parameters TEXT NOT NULL,
+                    phase TEXT NOT NULL,
+                    progress REAL NOT NULL,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    error TEXT,
+                    code INTEGER,
+                    owner INTEGER
+                )""")
+
+    def _connect(self) -> sqlite3.Connection:
+        # transactions are explicit
+        db: sqlite3.Connection = sqlite3.connect(
+            self.path, timeout=10, isolation_level=None
+        )
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _expire(self, db: sqlite3.Connection) -> None:
+        db.execute(
+            "DELETE FROM jobs WHERE finished < ?",
+            (time.time() - self.expiry * 3600,),
+        )
+
+    def _row(self, db: sqlite3.Connection, job_id: str) -> dict | None:
+        row = db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job: dict = dict(row)
+        job["parameters"] = json.loads(job["parameters"])
+        return job
+
+    def _written(self, db: sqlite3.Connection, job_id: str) -> dict:
+        """A job written in the current transaction."""
+
+        job: dict | None = self._row(db, job_id)
+        if job is None:
+            raise InvalidJob(f"Job {job_id} was not saved.")
+        return job
+
+    @staticmethod
+    def _stalled(job: dict) -> bool:
+        # queued or executing, but not by a running worker
+        return job["phase"] in ["QUEUED", "EXECUTING"] and not _alive(job["owner"])
+
+    def submit(self, parameters: dict) -> tuple[dict, bool]:
+        """Submit a job, or find the identical job.
+
+
+        Parameters
+        ----------
+        parameters : dict
+            `image_query` parameters.
+
+
+        Returns
+        -------
+        job : dict
+            The job.
+
+        start : bool
+            ``True`` if the caller should execute the job: it is new, its
+            previous attempt failed, or its worker stopped.
+
+        """
+
+        key: str = job_id_for(parameters)
+        with closing(self._connect()) as db, db:
+            db.execute("BEGIN IMMEDIATE")
+            self._expire(db)
+            job: dict | None = self._row(db, key)
+            if job is not None and job["phase"] != "ERROR":
+                if not self._stalled(job):
+                    return job, False
+                db.execute(
+                    "UPDATE jobs SET owner = ? WHERE job_id = ?", (os.getpid(), key)
+                )
+                return self._written(db, key), True
+
+            db.execute(
+                """INSERT OR REPLACE INTO jobs
+                (job_id, parameters, phase, progress, created, owner)
+                VALUES (?, ?, 'QUEUED', 0, ?, ?)""",
+                (key, json.dumps(parameters), time.time(), os.getpid()),
+            )
+            return self._written(db, key), True
+
+    def claim(self, job_id: str) -> dict | None:
+        """Start executing a job in this process, if it is not already."""
+
+        with closing(self._connect()) as db, db:
+            db.execute("BEGIN IMMEDIATE")
+            job: dict | None = self._row(db, job_id)
+            if job is None or job["phase"] not in ["QUEUED", "EXECUTING"]:
+                return None
+            if _alive(job["owner"]) and (
+                job["phase"] == "EXECUTING" or job["owner"] != os.getpid()
+            ):
+                # another worker's job, or already executing
+                return None
+
+            db.execute(
+                """UPDATE jobs SET phase = 'EXECUTING', started = ?, owner = ?
+                WHERE job_id = ?""",
+                (time.time(), os.getpid(), job_id),
+            )
+            return self._row(db, job_id)
+
+    def progress(self, job_id: str, fraction: float) -> None:
+        """Update a job's progress, from 0 to 1."""
+
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "UPDATE jobs SET progress = ? WHERE job_id = ?", (fraction, job_id)
+            )
+
+    def finish(
+        self, job_id: str, error: str | None = None, code: int | None = None
+    ) -> None:
+        """Mark a job completed, or failed with an error message."""
+
+        with closing(self._connect()) as db, db:
+            db.execute(
+                """UPDATE jobs SET phase = ?, progress = ?, finished = ?, error = ?,
+                code = ? WHERE job_id = ?""",
+                (
+                    "COMPLETED" if error is None else "ERROR",
+                    1 if error is None else 0,
+                    time.time(),
+                    error,
+                    code,
+                    job_id,
+                ),
+            )
+
+    def get(self, job_id: str) -> dict | None:
+        """A job, or ``None`` if it is unknown or expired."""
+
+        with closing(self._connect()) as db, db:
+            self._expire(db)
+            return self._row(db, job_id)
+
+    def stalled(self) -> list[str]:
+        """IDs of queued or executing jobs without a running worker."""
+
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT * FROM jobs WHERE phase IN ('QUEUED', 'EXECUTING')"
+            ).fetchall()
+        return [row["job_id"] for row in rows if self._stalled(dict(row))]
+
+    def describe(self, job: dict) -> dict:
+        """Job description for the API."""
+
+        url: str = ENV.BASE_HREF.rstrip("/") + "/jobs/" + job["job_id"]
+        expires: float | None = None
+        if job["finished"] is not None:
+            expires = job["finished"] + self.expiry * 3600
+
+        return {
+            "job_id": job["job_id"],
+            "url": url,
+            "phase": job["phase"],
+            "progress": job["progress"],
+            "created": _isotime(job["created"]),
+            "started": _isotime(job["started"]),
+            "finished": _isotime(job["finished"]),
+            "expires": _isotime(expires),
+            "parameters": job["parameters"],
+            "result": url + "/result" if job["phase"] == "COMPLETED" else None,
+            "error": job["error"],
+        }
+
+
+def job_queue() -> JobQueue:
+    """The job queue for this host, saved in the cutout cache."""
+    return JobQueue(os.path.join(ENV.SBNSIS_CUTOUT_CACHE, "jobs.db"))
+
+
+async def execute(job_id: str) -> None:
+    """Execute a job, unless another worker is executing it."""
+
+    queue: JobQueue = job_queue()
+    job: dict | None = await run_io(queue.claim, job_id)
+    if job is None:
+        return
+
+    logger = get_logger()
+    logger.info(json.dumps({"job_id": job_id, "job": "jobs", "phase": "EXECUTING"}))
+    parameters: dict = dict(job["parameters"])
+    parameters.pop("download", None)
+    try:
+        while True:
+            try:
+                await image_query_async(
+                    **parameters, progress=partial(queue.progress, job_id)
+                )
+                break
+            except (TooManyRequests, RenderQueueFull) as exc:
+                # jobs wait for their turn rather than fail
+                await asyncio.sleep(exc.retry_after)
+    except SBNSISException as exc:
+        logger.exception("Job %s failed.", job_id)
+        await run_io(queue.finish, job_id, str(exc), getattr(exc, "code", 500))
+    except Exception:
+        logger.exception("Job %s failed.", job_id)
+        await run_io(
+            queue.finish,
+            job_id,
+            "Unexpected error.  Please report if the problem persists.",
+            500,
+        )
+    else:
+        await run_io(queue.finish, job_id)
+        logger.info(json.dumps({"job_id": job_id, "job": "jobs", "phase": "COMPLETED"}))
+
+
+# running job tasks, referenced until done
+_tasks: set[asyncio.Task] = set()
+
+
+def _start(job_id: str) -> None:
+    task: asyncio.Task = asyncio.get_running_loop().create_task(execute(job_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def submit(parameters: dict) -> dict:
+    """Submit a job and start it in the background, as needed.
+
+
+    Parameters
+    ----------
+    parameters : dict
+        `image_query` parameters, and ``download``.
+
+
+    Returns
+    -------
+    job : dict
+        The job description.
+
+    """
+
+    queue: JobQueue = job_queue()
+    job, start = await run_io(queue.submit, parameters)
+    if start:
+        _start(job["job_id"])
+    return queue.describe(job)
+
+
+async def resume() -> None:
+    """Resume the jobs of stopped workers."""
+
+    job_id: str
+    for job_id in await run_io(job_queue().stalled):
+        _start(job_id)
@@ -11,7 +11,7 @@ from sqlalchemy.orm.exc import NoResultFound
 from .database_provider import data_provider_session, Session
 from ..models.image import Image
 from ..config.exceptions import InvalidImageID
-from ..data import url_to_local_file
+from .storage import local_file
 
 
 def label_query(obs_id: str) -> Tuple[str, str]:
@@ -26,4 +26,4 @@ def label_query(obs_id: str) -> Tuple[str, str]:
         except NoResultFound as exc:
             raise InvalidImageID("Image ID not found in database.") from exc
 
-    return url_to_local_file(label_url), os.path.basename(label_url)
+    return local_file(label_url), os.path.basename(label_url)
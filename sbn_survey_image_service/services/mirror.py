@@ -0,0 +1,221 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Local mirror of frequently used remote images.
+
+Reads of remote images are counted (see `access`).  When an image has been
+read SBNSIS_MIRROR_THRESHOLD times within the access window, its size is
+checked with a HEAD request, and, if a full download is expected to be
+cheaper than continued range reads, the whole file is downloaded in the
+background.  Later reads use the local copy.  The least-recently used copies
+are removed when the mirror exceeds SBNSIS_MIRROR_SIZE.
+
+"""
+
+__all__ = [
+    "mirror_directory",
+    "mirror_path",
+    "mirrored",
+    "remote_size",
+    "should_mirror",
+    "promote",
+    "record_access",
+]
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from . import network
+from .access import access_tracker
+from .upstream import request, timeouts
+from .blockcache import prune_block_cache
+from ..data import atomic_write, try_lock
+from ..config.env import ENV
+from ..config.logging import get_logger
+
+
+def mirror_directory() -> str:
+    """The mirror directory, default: "mirror" in the cutout cache."""
+    if ENV.SBNSIS_MIRROR:
+        return ENV.SBNSIS_MIRROR
+    return os.path.join(ENV.SBNSIS_CUTOUT_CACHE, "mirror")
+
+
+def mirror_path(url: str) -> str:
+    """The local file name for a mirrored URL."""
+    key: str = hashlib.md5(url.encode()).hexdigest()
+    return os.path.join(mirror_directory(), key[:2], key)
+
+
+def mirrored(url: str) -> str | None:
+    """The local copy of a remote image, or ``None`` if not mirrored."""
+
+    if ENV.SBNSIS_MIRROR_SIZE <= 0:
+        return None
+
+    path: str = mirror_path(url)
+    try:
+        # mark as recently used
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def remote_size(url: str) -> int | None:
+    """Remote file size from a HEAD request, or ``None`` if unknown."""
+
+    with network.session() as s:
+        response = request(url, s.head, url, allow_redirects=True, timeout=timeouts())
+
+    if response.status_code != 200:
+        return None
+
+    try:
+        return int(response.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def should_mirror(size: int | None, count: int, range_bytes: int) -> bool:
+    """Decide if downloading the whole file is cheaper than range reads.
+
+    The whole file is downloaded if it is no larger than the data range reads
+    would transfer over another SBNSIS_MIRROR_THRESHOLD accesses, at the rate
+    observed so far, and if it is no larger than 10% of the mirror.
+
+
+    Parameters
+    ----------
+    size : int or None
+        The remote file size.
+
+    count : int
+        Number of accesses in the current window.
+
+    range_bytes : int
+        Bytes transferred by range reads in the current window.
+
+    """
+
+    if size is None or count == 0:
+        return False
+
+    if size > 0.1 * ENV.SBNSIS_MIRROR_SIZE * 2**20:
+        return False
+
+    return size <= range_bytes / count * ENV.SBNSIS_MIRROR_THRESHOLD
+
+
+def promote(url: str, count: int, range_bytes: int) -> str | None:
+    """Download a remote image to the mirror, if worth the cost.
+
+    Returns immediately if another thread or process is downloading the
+    file.
+
+
+    Parameters
+    ----------
+    url : str
+        The remote image URL.
+
+    count : int
+        Number of accesses in the current window.
+
+    range_bytes : int
+        Bytes transferred by range reads in the current window.
+
+
+    Returns
+    -------
+    path : str or None
+        The local copy, or ``None`` if the file was not mirrored.
+
+    """
+
+    logger: logging.Logger = get_logger()
+    path: str = mirror_path(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    locked: bool
+    with try_lock(path + ".lock") as locked:
+        if not locked:
+            return None
+
+        if os.path.exists(path):
+            return path
+
+        size: int | None = remote_size(url)
+        if not should_mirror(size, count, range_bytes):
+            return None
+
+        t0: float = time.monotonic()
+        request(url, _download, url, path)
+
+    logger.info(
+        json.dumps(
+            {
+                "job": "mirror",
+                "url": url,
+                "size": size,
+                "seconds": round(time.monotonic() - t0, 1),
+            }
+        )
+    )
+
+    n: int = prune_block_cache(mirror_directory(), ENV.SBNSIS_MIRROR_SIZE * 2**20)
+    if n > 0:
+        logger.info("Removed %d images from the mirror.", n)
+
+    return path
+
+
+def _download(url: str, path: str) -> None:
+    with network.session() as s:
+        response = s.get(url, stream=True, timeout=timeouts())
+        response.raise_for_status()
+        with atomic_write(path) as outf:
+            for chunk in response.iter_content(2**20):
+                outf.write(chunk)
+
+
+def _promote(url: str, count: int, range_bytes: int) -> None:
+    try:
+        promote(url, count, range_bytes)
+    except Exception:
+        get_logger().exception("Failed to mirror %s", url)
+
+
+def record_access(url: str, range_bytes: int) -> threading.Thread | None:
+    """Count a range-read access to a remote image, and promote if hot.
+
+
+    Parameters
+    ----------
+    url : str
+        The remote image URL.
+
+    range_bytes : int
+        Bytes transferred by range reads for this access.
+
+
+    Returns
+    -------
+    thread : threading.Thread or None
+        The background download, if started.
+
+    """
+
+    if ENV.SBNSIS_MIRROR_SIZE <= 0:
+        return None
+
+    count: int
+    total: int
+    count, total = access_tracker().record(url, range_bytes)
+    if count < ENV.SBNSIS_MIRROR_THRESHOLD or os.path.exists(mirror_path(url)):
+        return None
+
+    thread = threading.Thread(target=_promote, args=(url, count, total), daemon=True)
+    thread.start()
+    return thread
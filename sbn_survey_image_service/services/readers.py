@@ -0,0 +1,186 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""FITS image readers, chosen by URL scheme and image type.
+
+* Local files (file:// URLs or paths) are memory mapped.  Slices of
+  uncompressed, unscaled images are views of the file, i.e., they are read
+  from the page cache without copying.
+
+* Remote files are read with fsspec, through the persistent block cache (see
+  `blockcache`), unless a faster copy is available (see `storage` and
+  `mirror`).
+
+* Frequently read tile-compressed images are read from uncompressed copies,
+  when available (see `transcode`).
+
+* Tile-compressed images, local or remote, are read with planned reads and
+  parallel decompression (see `compressed`).
+
+"""
+
+__all__ = ["local_path", "open_image", "section", "image_data"]
+
+from functools import partial
+from contextlib import contextmanager
+from typing import Callable, Iterator
+from urllib.parse import urlparse
+
+import fsspec
+import numpy as np
+from astropy.io import fits
+
+from .blockcache import fsspec_options, remote_version
+from ..config.collections import CollectionProfile, DEFAULT_PROFILE
+from .compressed import decompress, PlannedSection
+from .mirror import record_access
+from .storage import locate
+from .upstream import request
+from .hedge import hedged_request, cat_ranges
+from .transcode import transcoded, record_access as record_transcode_access
+
+
+def local_path(url: str) -> str | None:
+    """The local file name of a URL, or ``None`` for remote URLs."""
+
+    p = urlparse(url)
+    if p.scheme == "file":
+        return p.path
+    if p.scheme == "":
+        return url
+    return None
+
+
+@contextmanager
+def open_image(
+    url: str, profile: CollectionProfile = DEFAULT_PROFILE
+) -> Iterator[tuple[fits.HDUList, object]]:
+    """Open a FITS image for lazy reading.
+
+
+    Parameters
+    ----------
+    url : str
+        The URL or local file name, as stored in the database.  The file is
+        read from the first available storage location.
+
+    profile : CollectionProfile, optional
+        The image's collection profile, for the preferred reader and remote
+        read settings.
+
+
+    Returns
+    -------
+    hdul : HDUList
+        The FITS file.
+
+    file : fsspec file object or None
+        The remote file, or ``None`` for local files, including local copies
+        of remote files.
+
+    """
+
+    located, storage_options, local = locate(url)
+    path: str | None = None
+    if profile.reader == "auto" and local:
+        path = local_path(located)
+
+    raw: str | None = None if path is None else transcoded(path)
+    if raw is not None:
+        with fits.open(raw, memmap=None, lazy_load_hdus=True) as hdul:
+            yield hdul, None
+    elif path is not None:
+        # memmap=None (the default) maps the file, but, unlike memmap=True,
+        # allows reading scaled data (BSCALE, BZERO)
+        with fits.open(path, memmap=None, lazy_load_hdus=True) as hdul:
+            yield hdul, None
+
+            compressed: bool = any(isinstance(h, fits.CompImageHDU) for h in hdul)
+
+        if compressed:
+            record_transcode_access(path)
+    else:
+        options: dict = {**storage_options, **fsspec_options(located, profile)}
+        fs, remote_path = fsspec.core.url_to_fs(located, **options)
+        file_options: dict = {}
+        if "cache_options" in options:
+            # blocks are cached by version, so that those of a replaced file
+            # are not reused; the size is also needed to open the file
+            info: dict = request(located, fs.info, remote_path)
+            file_options["size"] = info.get("size")
+            file_options["cache_options"] = {
+                **options["cache_options"],
+                "version": remote_version(info),
+            }
+
+        # without a size, opening requests it
+        f = request(located, fs.open, remote_path, "rb", **file_options)
+        cache = getattr(f, "cache", None)
+        if cache is not None:
+            # every read from the remote file
+            cache.fetcher = partial(
+                hedged_request, located, partial(_fetch_range, located, cache.fetcher)
+            )
+
+        with f:
+            with fits.open(f, cache=False, lazy_load_hdus=True) as hdul:
+                yield hdul, f
+
+                # before the file, and its cache, are closed
+                nbytes: int = getattr(cache, "total_requested_bytes", 0)
+
+        if not local:
+            record_access(url, nbytes)
+
+
+def _fetch_range(
+    primary: str, fetcher: Callable[[int, int], bytes], url: str, start: int, end: int
+) -> bytes:
+    """Read a byte range from the open remote file, or from a mirror."""
+
+    if url == primary:
+        return fetcher(start, end)
+    return cat_ranges(url, [start], [end])[0]
+
+
+def _is_mapped(hdu: fits.ImageHDU) -> bool:
+    """True if the image data are a memory map of the file, without scaling."""
+
+    return (
+        getattr(hdu._file, "memmap", False)
+        and hdu.header.get("BSCALE", 1) == 1
+        and hdu.header.get("BZERO", 0) == 0
+    )
+
+
+def section(hdu: fits.ImageHDU | fits.CompImageHDU, file=None) -> fits.Section:
+    """Lazily loaded image data, sliceable like an array.
+
+
+    Parameters
+    ----------
+    hdu : ImageHDU or CompImageHDU
+        The image.
+
+    file : fsspec file object, optional
+        The remote file containing the image, used to prefetch tiles of
+        compressed images.
+
+
+    Returns
+    -------
+    section : Section, PlannedSection, or memmap
+
+    """
+
+    if isinstance(hdu, fits.CompImageHDU):
+        return PlannedSection(hdu, file)
+    if file is None and _is_mapped(hdu):
+        return hdu.data
+    return hdu.section
+
+
+def image_data(hdu: fits.ImageHDU | fits.CompImageHDU) -> np.ndarray:
+    """All image data, decompressed in parallel for compressed images."""
+
+    if isinstance(hdu, fits.CompImageHDU):
+        return decompress(hdu)
+    return hdu.data
@@ -0,0 +1,509 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Browse image rendering: reprojection, downsampling, and scaling.
+
+Browse images are nearest-neighbor reprojections onto a gnomonic projection
+centered on the image.  For small, undistorted images, the transformation
+between the original and new pixel grids is often the identity, an axis flip,
+a 90° rotation, or otherwise well approximated by an affine transformation.
+These cases are handled with NumPy indexing, and `reproject` is only used
+when the distortions matter.
+
+Downsampled previews are block-averaged before reprojection.
+
+To bound memory use, images are processed as 32-bit floats (unless the data
+are 64-bit) and large temporary arrays are computed in strips.
+
+"""
+
+__all__ = [
+    "PixelTransform",
+    "pixel_transform",
+    "reproject_image",
+    "block_average",
+    "zscale_limits",
+    "stretch",
+    "render_memory",
+    "MemoryTrace",
+]
+
+import resource
+import tracemalloc
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.visualization import ZScaleInterval
+from reproject import reproject_interp
+
+from .readers import section
+
+# use reproject's parallel mode; disabled in render processes (see renderpool)
+REPROJECT_PARALLEL: bool = True
+
+
+class PixelTransform:
+    """Affine transformation from output to input pixel coordinates.
+
+    ``input = matrix @ output + offset``, with pixel coordinates in (x, y)
+    order.
+
+
+    Parameters
+    ----------
+    matrix : ndarray
+        2x2 linear transformation.
+
+    offset : ndarray
+        Translation.
+
+    """
+
+    # tolerance for treating matrix elements as exactly 0 or ±1
+    EXACT_TOLERANCE: float = 1e-6
+
+    def __init__(self, matrix: np.ndarray, offset: np.ndarray):
+        self.matrix = np.asarray(matrix, float)
+        self.offset = np.asarray(offset, float)
+
+    def __repr__(self) -> str:
+        return (
+            f"PixelTransform(matrix={self.matrix.tolist()},"
+            f" offset={self.offset.tolist()})"
+        )
+
+    @property
+    def is_permutation(self) -> bool:
+        """Identity, axis flips, and 90° rotations with integer offsets."""
+
+        m: np.ndarray = np.round(self.matrix)
+        return bool(
+            np.allclose(self.matrix, m, rtol=0, atol=self.EXACT_TOLERANCE)
+            and np.all(np.abs(m).sum(0) == 1)
+            and np.all(np.abs(m).sum(1) == 1)
+            and np.allclose(
+                self.offset, np.round(self.offset), rtol=0, atol=self.EXACT_TOLERANCE
+            )
+        )
+
+    @property
+    def is_identity(self) -> bool:
+        return bool(
+            np.allclose(self.matrix, np.eye(2), rtol=0, atol=self.EXACT_TOLERANCE)
+            and np.allclose(self.offset, 0, rtol=0, atol=self.EXACT_TOLERANCE)
+        )
+
+
+def pixel_transform(
+    wcs_in: WCS,
+    wcs_out: WCS,
+    shape_out: tuple[int, int],
+    tolerance: float = 0.05,
+    n: int = 9,
+) -> PixelTransform | None:
+    """Fit an affine transformation between two pixel grids.
+
+    The transformation is tested on an ``n`` × ``n`` grid of points spanning
+    the output image.
+
+
+    Parameters
+    ----------
+    wcs_in, wcs_out : WCS
+        The input and output world coordinate systems.
+
+    shape_out : tuple of int
+        The shape of the output array.
+
+    tolerance : float, optional
+        Maximum allowed deviation from the affine model in input pixels.
+
+    n : int, optional
+        Number of grid points along each axis.
+
+
+    Returns
+    -------
+    transform : PixelTransform or None
+        The transformation, or ``None`` if the distortions exceed
+        ``tolerance``.
+
+    """
+
+    y, x = np.meshgrid(
+        np.linspace(-0.5, shape_out[0] - 0.5, n),
+        np.linspace(-0.5, shape_out[1] - 0.5, n),
+        indexing="ij",
+    )
+    x = x.ravel()
+    y = y.ravel()
+    world = wcs_out.pixel_to_world_values(x, y)
+    x_in, y_in = wcs_in.world_to_pixel_values(*world)
+    target: np.ndarray = np.column_stack((x_in, y_in))
+    if not np.all(np.isfinite(target)):
+        return None
+
+    design: np.ndarray = np.column_stack((x, y, np.ones_like(x)))
+    coeffs: np.ndarray = np.linalg.lstsq(design, target, rcond=None)[0]
+    residual: float = np.abs(design @ coeffs - target).max()
+    if residual > tolerance:
+        return None
+
+    return PixelTransform(coeffs[:2].T, coeffs[2])
+
+
+def _float_dtype(data: np.ndarray) -> np.dtype:
+    """Floating-point type for resampled data: at least 32 bits."""
+    return np.result_type(data.dtype, np.float32)
+
+
+def _nearest_index(coords: np.ndarray, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Nearest-neighbor indices and validity, following `reproject`."""
+    valid: np.ndarray = (coords >= -0.5) & (coords <= n - 0.5)
+    index: np.ndarray = np.clip(np.floor(coords + 0.5), 0, n - 1).astype(np.intp)
+    return index, valid
+
+
+def _apply_permutation(
+    data: np.ndarray, transform: PixelTransform, shape_out: tuple[int, int]
+) -> np.ndarray:
+    """Flips and 90° rotations with vectorized indexing."""
+
+    m: np.ndarray = np.round(transform.matrix).astype(int)
+    c: np.ndarray = np.round(transform.offset).astype(int)
+    ny, nx = shape_out
+
+    if m[0, 1] == 0:
+        # x_in depends on x_out, y_in on y_out
+        source: np.ndarray = data
+        rows: np.ndarray = m[1, 1] * np.arange(ny) + c[1]
+        cols: np.ndarray = m[0, 0] * np.arange(nx) + c[0]
+    else:
+        # transposed: x_in depends on y_out, y_in on x_out
+        source = data.T
+        rows = m[0, 1] * np.arange(ny) + c[0]
+        cols = m[1, 0] * np.arange(nx) + c[1]
+
+    valid_rows: np.ndarray = (rows >= 0) & (rows < source.shape[0])
+    valid_cols: np.ndarray = (cols >= 0) & (cols < source.shape[1])
+    if valid_rows.all() and valid_cols.all():
+        return source[np.ix_(rows, cols)]
+
+    result: np.ndarray = np.full(shape_out, np.nan, _float_dtype(data))
+    result[np.ix_(valid_rows, valid_cols)] = source[
+        np.ix_(rows[valid_rows], cols[valid_cols])
+    ]
+    return result
+
+
+def _apply_affine(
+    data: np.ndarray,
+    transform: PixelTransform,
+    shape_out: tuple[int, int],
+    max_rows: int = 1024,
+) -> np.ndarray:
+    """Nearest-neighbor affine resampling.
+
+    The output is computed in strips of ``max_rows`` rows to limit the size
+    of the temporary coordinate and index arrays.
+
+    """
+
+    m: np.ndarray = transform.matrix
+    c: np.ndarray = transform.offset
+    result: np.ndarray = np.empty(shape_out, _float_dtype(data))
+    x: np.ndarray = np.arange(shape_out[1], dtype=float)
+    for start in range(0, shape_out[0], max_rows):
+        y: np.ndarray = np.arange(
+            start, min(start + max_rows, shape_out[0]), dtype=float
+        )[:, np.newaxis]
+        x_in: np.ndarray = m[0, 0] * x + m[0, 1] * y + c[0]
+        y_in: np.ndarray = m[1, 0] * x + m[1, 1] * y + c[1]
+
+        i, valid_i = _nearest_index(y_in, data.shape[0])
+        j, valid_j = _nearest_index(x_in, data.shape[1])
+        del x_in, y_in
+
+        strip: np.ndarray = result[start : start + len(y)]
+        strip[:] = data[i, j]
+        strip[~(valid_i & valid_j)] = np.nan
+
+    return result
+
+
+def reproject_image(
+    data: np.ndarray,
+    wcs_in: WCS,
+    wcs_out: WCS,
+    shape_out: tuple[int, int],
+    tolerance: float = 0.05,
+) -> np.ndarray:
+    """Nearest-neighbor reprojection of an image to a new WCS.
+
+    Pixels outside of the input image are set to NaN.  Integer data are
+    converted to 32-bit floats when needed, but floating-point data keep
+    their precision.
+
+
+    Parameters
+    ----------
+    data : ndarray
+        The image.
+
+    wcs_in, wcs_out : WCS
+        The input and output world coordinate systems.
+
+    shape_out : tuple of int
+        The shape of the output array.
+
+    tolerance : float, optional
+        Use the affine fast path when the transformation deviates from an
+        affine model by less than this many input pixels.
+
+
+    Returns
+    -------
+    result : ndarray
+        The reprojected image.  For the identity transformation this may be
+        ``data`` itself.
+
+    """
+
+    transform: PixelTransform | None = pixel_transform(
+        wcs_in, wcs_out, shape_out, tolerance=tolerance
+    )
+
+    if transform is None:
+        # avoid reproject's default float64 output
+        return reproject_interp(
+            (data, wcs_in),
+            wcs_out,
+            shape_out=shape_out,
+            output_array=np.empty(shape_out, _float_dtype(data)),
+            return_footprint=False,
+            order="nearest-neighbor",
+            parallel=REPROJECT_PARALLEL,
+        )
+
+    if transform.is_identity and data.shape == tuple(shape_out):
+        return data
+
+    if transform.is_permutation:
+        return _apply_permutation(data, transform, shape_out)
+
+    return _apply_affine(data, transform, shape_out)
+
+
+def block_average(
+    hdu: fits.ImageHDU | fits.CompImageHDU,
+    factor: int,
+    max_rows: int = 1024,
+) -> np.ndarray:
+    """Downsample an image by averaging ``factor`` × ``factor`` blocks.
+
+    The image is read in strips via ``hdu.section``, which limits memory use
+    and, for tile-compressed data, decompresses only one strip of tiles at a
+    time, in parallel (see `compressed.decompress`).  Uncompressed images
+    opened with `readers.open_image` are sliced directly from the memory map.
+    Partial blocks at the upper and right edges are discarded.
+
+
+    Parameters
+    ----------
+    hdu : ImageHDU or CompImageHDU
+        The image.
+
+    factor : int
+        Binning factor.
+
+    max_rows : int, optional
+        Approximate number of image rows to read at a time.
+
+
+    Returns
+    -------
+    binned : ndarray
+        The downsampled image, as 32-bit floats.
+
+    """
+
+    ny: int
+    nx: int
+    ny, nx = hdu.shape
+    ny_out: int = ny // factor
+    nx_out: int = nx // factor
+    if ny_out == 0 or nx_out == 0:
+        raise ValueError(f"Binning factor {factor} exceeds the image size.")
+
+    binned: np.ndarray = np.empty((ny_out, nx_out), np.float32)
+    strip: int = max(1, max_rows // factor)
+    for i in range(0, ny_out, strip):
+        n: int = min(strip, ny_out - i)
+        rows: np.ndarray = section(hdu)[
+            i * factor : (i + n) * factor, : nx_out * factor
+        ]
+        binned[i : i + n] = rows.reshape(n, factor, nx_out, factor).mean(
+            axis=(1, 3), dtype=np.float32
+        )
+
+    return binned
+
+
+def zscale_limits(data: np.ndarray, n_samples: int = 1000) -> tuple[float, float]:
+    """Display limits with the zscale algorithm.
+
+    Equivalent to `astropy.visualization.ZScaleInterval`, but the image is
+    subsampled before removing non-finite values, rather than copying all
+    finite pixels first.
+
+    """
+
+    values: np.ndarray = data.ravel()
+    stride: int = max(1, values.size // (n_samples * 10))
+    sample: np.ndarray = values[::stride]
+    sample = sample[np.isfinite(sample)]
+    if sample.size == 0:
+        return 0.0, 1.0
+
+    vmin, vmax = ZScaleInterval(n_samples=n_samples).get_limits(sample)
+    return float(vmin), float(vmax)
+
+
+def stretch(
+    data: np.ndarray,
+    limits: tuple[float, float] | None = None,
+    max_rows: int = 1024,
+) -> np.ndarray:
+    """Linearly scale an image to 8-bit integers.
+
+    Strips of ``max_rows`` rows are scaled with in-place, 32-bit
+    floating-point operations, so that only the 8-bit output array is the
+    size of the full image.  ``data`` is not modified.  Non-finite values
+    are set to 0.
+
+
+    Parameters
+    ----------
+    data : ndarray
+        The image.
+
+    limits : tuple of float, optional
+        Display limits mapped to 0 and 255.  If ``None``, the limits are
+        computed with the zscale algorithm.
+
+    max_rows : int, optional
+        Number of image rows to scale at a time.
+
+
+    Returns
+    -------
+    scaled : ndarray
+        The scaled image.
+
+    """
+
+    vmin, vmax = zscale_limits(data) if limits is None else limits
+    scale: float = 255 / (vmax - vmin) if vmax != vmin else 255
+
+    scaled: np.ndarray = np.empty(data.shape, np.uint8)
+    for start in range(0, data.shape[0], max_rows):
+        strip: np.ndarray = np.subtract(
+            data[start : start + max_rows], vmin, dtype=np.float32
+        )
+        np.multiply(strip, scale, out=strip)
+        np.clip(strip, 0, 255, out=strip)
+        np.nan_to_num(strip, copy=False, nan=0)
+        scaled[start : start + max_rows] = strip
+
+    return scaled
+
+
+def render_memory(shape: tuple[int, int], itemsize: int, bin: int = 1) -> int:
+    """Approximate memory needed to render a browse image.
+
+    Counts the input data (or the binned image), the 32-bit reprojected
+    image, and the 8-bit output and its copy in the encoder.  Temporary
+    arrays for processing in strips are not included.
+
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the input image.
+
+    itemsize : int
+        Size of each input pixel in bytes, after any FITS scaling.
+
+    bin : int, optional
+        Binning factor.
+
+
+    Returns
+    -------
+    n : int
+        Memory in bytes.
+
+    """
+
+    n_in: int = shape[0] * shape[1]
+    n_out: int = (shape[0] // bin) * (shape[1] // bin)
+    data: int = n_in * itemsize if bin == 1 else n_out * 4
+    return data + n_out * (max(itemsize, 4) + 2)
+
+
+class MemoryTrace:
+    """Peak memory use of a block of code.
+
+    Always reports the high-water mark of the process's resident set size,
+    ``max_rss``, which includes all previous work in the process, and how much
+    the block raised it, ``rss_growth``.  The growth is zero unless the block
+    set a new high-water mark.  With ``trace=True``, also reports the peak of
+    memory allocated within the block, as measured with `tracemalloc`.  NumPy
+    arrays are included, but tracing slows down Python code.
+
+
+    Parameters
+    ----------
+    trace : bool, optional
+        Set to ``True`` to trace memory allocations.
+
+
+    Examples
+    --------
+    >>> with MemoryTrace() as trace:
+    ...     data = np.zeros((1000, 1000))
+    >>> trace.max_rss > 0
+    True
+
+    """
+
+    def __init__(self, trace: bool = False):
+        self.trace = trace
+        self.peak_alloc: int | None = None
+        self.max_rss: int = 0
+        self.rss_growth: int = 0
+        self._started: bool = False
+
+    @staticmethod
+    def _max_rss() -> int:
+        # Linux reports kibibytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def __enter__(self) -> "MemoryTrace":
+        self.max_rss = self._max_rss()
+        if self.trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+            tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *args) -> None:
+        if self.trace:
+            self.peak_alloc = tracemalloc.get_traced_memory()[1]
+            if self._started:
+                tracemalloc.stop()
+                self._started = False
+
+        max_rss: int = self._max_rss()
+        self.rss_growth = max_rss - self.max_rss
+        self.max_rss = max_rss
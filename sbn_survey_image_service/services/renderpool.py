@@ -0,0 +1,359 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Render process pool.
+
+Cutouts, browse images, and tile pyramids are rendered by a fixed pool of
+SBNSIS_RENDER_PROCESSES processes per worker, started and warmed up with the
+app.  Other requests, e.g., labels, cached images, and metadata queries, are
+handled by the worker's threads and never wait behind a render.
+
+Render jobs wait in a priority queue, ordered by their arrival time plus their
+estimated cost (pixels) divided by `PIXEL_RATE`: cheap jobs go first, but
+expensive jobs are not postponed forever.  At most SBNSIS_RENDER_QUEUE jobs
+may wait; more are rejected with HTTP status 503 and a Retry-After header.
+
+Each render process is single threaded, i.e., the pool is the only source of
+parallelism, so that renders do not oversubscribe the CPUs.
+
+Without a started pool, e.g., in command-line tools and tests, jobs are
+rendered in the calling thread.
+
+Services that render, e.g., `image.image_query`, are written as generators
+that yield a `Render` for each job and receive its result.  `run_renders`
+runs them in the calling thread, and `run_renders_async` runs them on the
+event loop: the I/O threads run the steps between renders, but do not wait
+for the renders themselves, so that queued renders do not hold up cached
+images and metadata queries.
+
+"""
+
+__all__ = [
+    "RenderPool",
+    "Render",
+    "start",
+    "shutdown",
+    "render",
+    "render_async",
+    "run_renders",
+    "run_renders_async",
+]
+
+import json
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import multiprocessing
+from functools import partial
+from typing import Any, Callable, Generator, List, NamedTuple, TypeVar
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+
+from .admission import admit
+from .executors import run_io
+from ..config.env import ENV
+from ..config.exceptions import RenderQueueFull
+from ..config.logging import get_logger
+
+T = TypeVar("T")
+
+# approximate render rate, in pixels per second, for ordering jobs
+PIXEL_RATE: float = 2e7
+
+
+class Render(NamedTuple):
+    """A render job, yielded by rendering generators."""
+
+    cost: float
+    func: Callable
+    args: tuple = ()
+    kwargs: dict = {}
+
+
+def _initialize() -> None:
+    # import the renderers, and keep each process single threaded
+    from . import image, tiles  # noqa: F401
+    from . import render as renderers
+
+    renderers.REPROJECT_PARALLEL = False
+
+
+def _ready() -> bool:
+    return True
+
+
+class RenderPool:
+    """A fixed-size process pool with a bounded priority queue.
+
+
+    Parameters
+    ----------
+    processes : int
+        Number of render processes.
+
+    queue_size : int, optional
+        Maximum number of waiting jobs.  Default: SBNSIS_RENDER_QUEUE.
+
+    """
+
+    def __init__(self, processes: int, queue_size: int | None = None) -> None:
+        self.processes = processes
+        self.queue_size = ENV.SBNSIS_RENDER_QUEUE if queue_size is None else queue_size
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            # do not copy the server's threads and connections
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initialize,
+        )
+        self.running: int = 0
+        # mean render time, for Retry-After
+        self.seconds: float = 1.0
+        self._queue: List[tuple] = []
+        self._order = itertools.count()
+        self._lock = threading.RLock()
+
+    @property
+    def waiting(self) -> int:
+        """Number of jobs in the queue."""
+        return len(self._queue)
+
+    def warm(self) -> None:
+        """Start all processes and wait for them to import the renderers."""
+        wait([self.executor.submit(_ready) for i in range(self.processes)])
+
+    def submit(
+        self, cost: float, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> "Future[T]":
+        """Queue a render job.
+
+
+        Parameters
+        ----------
+        cost : float
+            Estimated cost, in pixels.
+
+        func : callable
+            The job, called as ``func(*args, **kwargs)`` in a render process.
+            The function and arguments must be picklable.
+
+
+        Returns
+        -------
+        future : Future
+            The job's result.
+
+
+        Raises
+        ------
+        RenderQueueFull
+            If SBNSIS_RENDER_QUEUE jobs are already waiting.
+
+        """
+
+        future: Future = Future()
+        with self._lock:
+            if self.running >= self.processes and self.waiting >= self.queue_size:
+                raise RenderQueueFull(
+                    "Too many images are being rendered, please try again later.",
+                    max(1, self.seconds * self.waiting / self.processes),
+                )
+
+            priority: float = time.monotonic() + cost / PIXEL_RATE
+            heapq.heappush(
+                self._queue,
+                (priority, next(self._order), cost, future, func, args, kwargs),
+            )
+            self._dispatch()
+
+        return future
+
+    def _dispatch(self) -> None:
+        with self._lock:
+            while self.running < self.processes and self.waiting > 0:
+                priority, order, cost, future, func, args, kwargs = heapq.heappop(
+                    self._queue
+                )
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                self.running += 1
+                job: Future = self.executor.submit(func, *args, **kwargs)
+                job.add_done_callback(
+                    partial(
+                        self._done,
+                        future=future,
+                        func=func,
+                        cost=cost,
+                        t0=time.monotonic(),
+                    )
+                )
+
+    def _done(
+        self, job: Future, future: Future, func: Callable, cost: float, t0: float
+    ) -> None:
+        seconds: float = time.monotonic() - t0
+        with self._lock:
+            self.running -= 1
+            self.seconds = 0.9 * self.seconds + 0.1 * seconds
+            self._dispatch()
+
+        get_logger().debug(
+            json.dumps(
+                {
+                    "job": "render",
+                    "function": getattr(func, "__qualname__", str(func)),
+                    "cost": cost,
+                    "seconds": round(seconds, 3),
+                }
+            )
+        )
+
+        exc: BaseException | None = job.exception()
+        if exc is None:
+            future.set_result(job.result())
+        else:
+            future.set_exception(exc)
+
+    def shutdown(self) -> None:
+        """Cancel waiting jobs and stop the processes."""
+        with self._lock:
+            for item in self._queue:
+                item[3].cancel()
+            self._queue.clear()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool: RenderPool | None = None
+
+
+def start(processes: int | None = None) -> RenderPool | None:
+    """Start and warm up this worker's render pool.
+
+
+    Parameters
+    ----------
+    processes : int, optional
+        Number of render processes, or 0 to render in the calling thread.
+        Default: SBNSIS_RENDER_PROCESSES.
+
+    """
+
+    global _pool
+
+    if processes is None:
+        processes = ENV.SBNSIS_RENDER_PROCESSES
+
+    shutdown()
+    if processes > 0:
+        _pool = RenderPool(processes)
+        _pool.warm()
+        get_logger().info("Started %d render processes.", processes)
+    return _pool
+
+
+def shutdown() -> None:
+    """Stop this worker's render pool, if any."""
+
+    global _pool
+
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def render(cost: float, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Render with the pool, and wait for the result.
+
+    The job is first admitted by `admission.admit`.  Without a started pool,
+    ``func`` is called in this thread.
+
+
+    Parameters
+    ----------
+    cost : float
+        Estimated cost, in pixels.
+
+    func : callable
+        The job, called as ``func(*args, **kwargs)``.
+
+    """
+
+    with admit(cost):
+        if _pool is None:
+            return func(*args, **kwargs)
+        return _pool.submit(cost, func, *args, **kwargs).result()
+
+
+async def render_async(
+    cost: float, func: Callable[..., T], *args: Any, **kwargs: Any
+) -> T:
+    """Render with the pool, and await the result.
+
+    Same as `render`, but the result is awaited on the event loop.  Without a
+    started pool, ``func`` is called on the I/O threads.
+
+    """
+
+    with admit(cost):
+        if _pool is None:
+            return await run_io(func, *args, **kwargs)
+        return await asyncio.wrap_future(_pool.submit(cost, func, *args, **kwargs))
+
+
+def _step(send: Callable[[], Render]) -> tuple[bool, Any]:
+    # StopIteration cannot be set on a future
+    try:
+        return False, send()
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def run_renders(steps: Generator[Render, Any, T]) -> T:
+    """Run a rendering generator, waiting for its renders in this thread.
+
+
+    Parameters
+    ----------
+    steps : generator
+        Yields a `Render` for each job, and is sent its result, or thrown its
+        exception.  Returns the final result.
+
+    """
+
+    send: Callable[[], Render] = partial(steps.send, None)
+    while True:
+        done, value = _step(send)
+        if done:
+            return value
+
+        job: Render = value
+        try:
+            result: Any = render(job.cost, job.func, *job.args, **job.kwargs)
+        except Exception as exc:
+            send = partial(steps.throw, exc)
+        else:
+            send = partial(steps.send, result)
+
+
+async def run_renders_async(steps: Generator[Render, Any, T]) -> T:
+    """Run a rendering generator on the event loop.
+
+    The steps between renders are run on the I/O threads, and renders are
+    awaited with `render_async`.  See `run_renders`.
+
+    """
+
+    send: Callable[[], Render] = partial(steps.send, None)
+    while True:
+        done, value = await run_io(_step, send)
+        if done:
+            return value
+
+        job: Render = value
+        try:
+            result: Any = await render_async(
+                job.cost, job.func, *job.args, **job.kwargs
+            )
+        except Exception as exc:
+            send = partial(steps.throw, exc)
+        else:
+            send = partial(steps.send, result)
@@ -0,0 +1,185 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Image display statistics service."""
+
+__all__ = ["display_statistics", "compute_statistics", "update_statistics"]
+
+import logging
+import warnings
+from typing import List
+
+import numpy as np
+from astropy.io import fits
+from astropy.visualization import ZScaleInterval
+from sqlalchemy.orm.session import Session
+
+from .readers import open_image
+from ..models.image import Image
+from ..models.statistics import ImageStatistics
+from ..config.logging import get_logger
+from ..config.collections import CollectionProfile, profile
+from . import network
+
+# header keywords that may contain the saturation level
+SATURATION_KEYWORDS: List[str] = ["SATURATE", "SATLEVEL", "SATURATN"]
+
+
+def display_statistics(
+    hdu: fits.ImageHDU | fits.CompImageHDU, n_rows: int = 64
+) -> dict:
+    """Compute robust display statistics from a sample of image rows.
+
+    Only the sampled rows are read (and decompressed), via ``hdu.section``.
+
+
+    Parameters
+    ----------
+    hdu : ImageHDU or CompImageHDU
+        The image.
+
+    n_rows : int, optional
+        Number of rows to sample, evenly spaced through the image.
+
+
+    Returns
+    -------
+    stats : dict
+        zscale_min, zscale_max, median, mad, saturation.  ``mad`` is the
+        unscaled median absolute deviation.  ``saturation`` is taken from the
+        header, or is ``None``.
+
+    """
+
+    shape: tuple[int, ...] = hdu.shape
+    rows: np.ndarray = np.unique(
+        np.linspace(0, shape[0] - 1, min(n_rows, shape[0])).astype(int)
+    )
+    sample: np.ndarray = np.concatenate(
+        [np.asarray(hdu.section[row], dtype=np.float32).ravel() for row in rows]
+    )
+    sample = sample[np.isfinite(sample)]
+
+    saturation: float | None = None
+    for keyword in SATURATION_KEYWORDS:
+        if keyword in hdu.header:
+            saturation = float(hdu.header[keyword])
+            break
+
+    if len(sample) == 0:
+        return dict(
+            zscale_min=None,
+            zscale_max=None,
+            median=None,
+            mad=None,
+            saturation=saturation,
+        )
+
+    zscale_min, zscale_max = ZScaleInterval().get_limits(sample)
+    median: float = float(np.median(sample))
+    mad: float = float(np.median(np.abs(sample - median)))
+
+    return dict(
+        zscale_min=float(zscale_min),
+        zscale_max=float(zscale_max),
+        median=median,
+        mad=mad,
+        saturation=saturation,
+    )
+
+
+def compute_statistics(im: Image, n_rows: int = 64) -> ImageStatistics:
+    """Compute display statistics for an image in the database.
+
+
+    Parameters
+    ----------
+    im : Image
+        The image.
+
+    n_rows : int, optional
+        Number of rows to sample.
+
+
+    Returns
+    -------
+    stats : ImageStatistics
+
+    """
+
+    p: CollectionProfile = profile(im.collection)
+    with network.set_astropy_useragent():
+        with open_image(im.image_url, p) as (hdul, _):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", fits.verify.VerifyWarning)
+                stats: dict = display_statistics(hdul[p.data_ext], n_rows=n_rows)
+
+    return ImageStatistics(image_id=im.id, **stats)
+
+
+def update_statistics(
+    session: Session,
+    collection: str | None = None,
+    recompute: bool = False,
+    limit: int | None = None,
+    n_rows: int = 64,
+) -> int:
+    """Compute display statistics for images in the database.
+
+
+    Parameters
+    ----------
+    session : sqlalchemy Session
+        Database session object.
+
+    collection : str, optional
+        Only update images in this collection.
+
+    recompute : bool, optional
+        Recompute statistics for images that already have them.
+
+    limit : int, optional
+        Update at most this many images.
+
+    n_rows : int, optional
+        Number of rows to sample from each image.
+
+
+    Returns
+    -------
+    n : int
+        Number of images updated.
+
+    """
+
+    logger: logging.Logger = get_logger()
+
+    query = session.query(Image, ImageStatistics).outerjoin(
+        ImageStatistics, ImageStatistics.image_id == Image.id
+    )
+    if not recompute:
+        query = query.filter(ImageStatistics.id.is_(None))
+    if collection is not None:
+        query = query.filter(Image.collection == collection)
+    if limit is not None:
+        query = query.limit(limit)
+
+    n: int = 0
+    im: Image
+    old: ImageStatistics | None
+    for im, old in query.all():
+        try:
+            new: ImageStatistics = compute_statistics(im, n_rows=n_rows)
+        except Exception as exc:
+            logger.error("Error computing statistics for %s: %s", im.obs_id, exc)
+            continue
+
+        if old is not None:
+            session.delete(old)
+            session.flush()
+        session.add(new)
+        session.commit()
+        n += 1
+
+        if n % 100 == 0:
+            logger.info("Computed statistics for %d images", n)
+
+    return n
@@ -0,0 +1,282 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Archive storage locations.
+
+Image and label URLs are fixed when data are added to the database.  At run
+time, each URL may be read from a faster copy of the archive, e.g., a local
+NFS mount or an S3-compatible object store.  Locations are checked in order,
+and the first with a copy of the file is used.  The URL in the database is
+the last resort.
+
+Locations are defined with a JSON file named by SBNSIS_STORAGE, e.g.,
+
+.. code:: json
+
+    [
+      {"name": "nfs", "prefix": "https://sbnarchive.psi.edu/pds4/surveys/",
+       "root": "/mnt/archive/surveys/"},
+      {"name": "mirror"},
+      {"name": "s3", "prefix": "https://sbnarchive.psi.edu/pds4/surveys/",
+       "root": "s3://surveys/",
+       "storage_options": {"endpoint_url": "https://s3.example.org"}}
+    ]
+
+URLs starting with ``prefix`` are translated to URLs starting with ``root``.
+The location named "mirror" is the automatic local mirror of frequently read
+remote images (see `mirror`).  If not listed, it is checked first.
+
+Each location is read with the storage backend registered for the protocol
+of its root: local files, or any fsspec file system, e.g., HTTP, S3 (requires
+s3fs), or memory (for testing).
+
+"""
+
+__all__ = [
+    "StorageBackend",
+    "LocalBackend",
+    "FsspecBackend",
+    "register_backend",
+    "backend",
+    "Location",
+    "load_locations",
+    "locate",
+    "local_file",
+]
+
+import os
+import abc
+import json
+import time
+import dataclasses
+from dataclasses import dataclass
+from typing import List
+from urllib.parse import urlparse
+
+import fsspec
+
+from .mirror import mirrored
+from .upstream import request
+from ..data import url_to_local_file
+from ..config.env import ENV
+from ..config.exceptions import UpstreamUnavailable
+
+MIRROR: str = "mirror"
+
+# seconds to remember whether a file exists in a remote location
+EXISTS_TTL: float = 600
+
+
+class StorageBackend(abc.ABC):
+    """Base class for storage backends.
+
+
+    Parameters
+    ----------
+    storage_options : dict, optional
+        Backend-specific options, e.g., credentials.
+
+    """
+
+    # URL protocols handled by this backend
+    protocols: tuple[str, ...] = ()
+
+    # True if files are local, i.e., may be memory mapped
+    local: bool = False
+
+    def __init__(self, storage_options: dict | None = None) -> None:
+        self.storage_options: dict = {} if storage_options is None else storage_options
+
+    @abc.abstractmethod
+    def exists(self, url: str) -> bool:
+        """True if the file exists."""
+
+
+BACKENDS: dict[str, type[StorageBackend]] = {}
+
+
+def register_backend(cls: type[StorageBackend]) -> type[StorageBackend]:
+    """Class decorator registering a storage backend for its protocols."""
+
+    for protocol in cls.protocols:
+        BACKENDS[protocol] = cls
+    return cls
+
+
+@register_backend
+class LocalBackend(StorageBackend):
+    """Files on a local or network file system."""
+
+    protocols = ("", "file")
+    local = True
+
+    def exists(self, url: str) -> bool:
+        return os.path.isfile(urlparse(url).path)
+
+
+class FsspecBackend(StorageBackend):
+    """Files read with fsspec, e.g., HTTP, S3, or memory file systems.
+
+    Existence checks are remembered for `EXISTS_TTL` seconds.
+
+    """
+
+    def __init__(self, storage_options: dict | None = None) -> None:
+        super().__init__(storage_options)
+        self._exists: dict[str, tuple[bool, float]] = {}
+
+    def exists(self, url: str) -> bool:
+        now: float = time.monotonic()
+        if url in self._exists:
+            found, checked = self._exists[url]
+            if now - checked < EXISTS_TTL:
+                return found
+
+        fs, path = fsspec.core.url_to_fs(url, **self.storage_options)
+        try:
+            found = request(url, fs.isfile, path)
+        except UpstreamUnavailable:
+            # try again next time
+            return False
+        except (OSError, ValueError):
+            # e.g., invalid S3 bucket names
+            found = False
+
+        self._exists[url] = (found, now)
+        return found
+
+
+def backend(url: str, storage_options: dict | None = None) -> StorageBackend:
+    """The storage backend for a URL.
+
+    fsspec is used for protocols without a registered backend.
+
+    """
+
+    protocol: str = urlparse(url).scheme
+    return BACKENDS.get(protocol, FsspecBackend)(storage_options)
+
+
+@dataclass(frozen=True)
+class Location:
+    """A copy of the archive, or part of it.
+
+
+    Parameters
+    ----------
+    name : str
+        Location name.  "mirror" is the automatic local mirror.
+
+    prefix : str, optional
+        URL prefix of the archive files at this location.
+
+    root : str, optional
+        Replaces ``prefix`` to form the URL at this location.
+
+    storage_options : dict, optional
+        Options for the storage backend, e.g., an S3 endpoint URL.
+
+    """
+
+    name: str
+    prefix: str = ""
+    root: str = ""
+    storage_options: dict = dataclasses.field(default_factory=dict)
+    backend: StorageBackend = dataclasses.field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if self.name != MIRROR and not (self.prefix and self.root):
+            raise ValueError(f"Storage location {self.name} requires prefix and root.")
+
+        object.__setattr__(self, "backend", backend(self.root, self.storage_options))
+        if isinstance(self.backend, FsspecBackend):
+            # fail early for protocols without their dependencies, e.g., s3fs
+            fsspec.get_filesystem_class(urlparse(self.root).scheme)
+
+    def translate(self, url: str) -> str | None:
+        """The URL at this location, or ``None`` if the URL is elsewhere."""
+
+        if not url.startswith(self.prefix):
+            return None
+        return self.root + url[len(self.prefix) :]
+
+
+def load_locations(path: str = "") -> List[Location]:
+    """Storage locations, in lookup order.
+
+
+    Parameters
+    ----------
+    path : str, optional
+        The JSON location file name.  If empty, only the mirror is used.
+
+
+    Returns
+    -------
+    locations : list of Location
+
+    """
+
+    if not path:
+        return [Location(MIRROR)]
+
+    with open(path) as inf:
+        locations: List[Location] = [Location(**entry) for entry in json.load(inf)]
+
+    if all(location.name != MIRROR for location in locations):
+        locations.insert(0, Location(MIRROR))
+
+    return locations
+
+
+LOCATIONS: List[Location] = load_locations(ENV.SBNSIS_STORAGE)
+
+
+def locate(url: str, locations: List[Location] | None = None) -> tuple[str, dict, bool]:
+    """Find the first available location of an archive file.
+
+
+    Parameters
+    ----------
+    url : str
+        The URL in the database.
+
+    locations : list of Location, optional
+        Locations to check, in order.  Default: those defined by
+        SBNSIS_STORAGE.
+
+
+    Returns
+    -------
+    url : str
+        The URL or file name to read.
+
+    storage_options : dict
+        fsspec storage options for the URL.
+
+    local : bool
+        True if the file is local.
+
+    """
+
+    for location in LOCATIONS if locations is None else locations:
+        if location.name == MIRROR:
+            path: str | None = mirrored(url)
+            if path is not None:
+                return path, {}, True
+            continue
+
+        translated: str | None = location.translate(url)
+        if translated is not None and location.backend.exists(translated):
+            return translated, location.storage_options, location.backend.local
+
+    return url, {}, BACKENDS.get(urlparse(url).scheme, FsspecBackend).local
+
+
+def local_file(url: str) -> str:
+    """Local file name of an archive file, from the first available location.
+
+    Remote files are downloaded to the cutout cache.
+
+    """
+
+    located, storage_options, _ = locate(url)
+    return url_to_local_file(located, storage_options)
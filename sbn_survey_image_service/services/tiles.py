@@ -0,0 +1,452 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Multi-resolution tile pyramids for full-frame image previews.
+
+Pyramids follow the Deep Zoom layout: level 0 is a single tile containing the
+whole image, and each following level doubles the resolution until the native
+resolution is reached.  Tile (x, y) = (0, 0) is the upper-left corner of the
+image as displayed, i.e., the same orientation as full-frame browse images.
+Tiles at the right and bottom edges may be smaller than the tile size.
+
+Pyramids are saved to the cache directory, with the pyramid metadata written
+last to mark completion.
+
+"""
+
+__all__ = [
+    "TILE_SIZE",
+    "build_pyramid",
+    "build_pyramids",
+    "pyramid_query",
+    "pyramid_query_async",
+    "tile_query",
+    "tile_query_async",
+]
+
+import os
+import json
+import fcntl
+import logging
+import multiprocessing
+import warnings
+from contextlib import contextmanager
+from typing import Any, Generator, Iterator, List
+
+import numpy as np
+from PIL import Image as PIL_Image
+from astropy.io import fits
+from sqlalchemy.orm.session import Session
+from sqlalchemy.orm.exc import NoResultFound
+
+from .database_provider import data_provider_session
+from .image import (
+    ImageFormat,
+    check_render_memory,
+    encoder_options,
+    image_extensions,
+    display_limits,
+    render_cost,
+)
+from .readers import open_image, image_data
+from .render import stretch, zscale_limits
+from .renderpool import Render, run_renders, run_renders_async
+from .storage import local_file
+from ..data import generate_cache_filename, atomic_write
+from ..models.image import Image
+from ..models.statistics import ImageStatistics
+from ..config.exceptions import InvalidImageID, InvalidTile, ParameterValueError
+from ..config.logging import get_logger
+
+TILE_SIZE: int = 256
+TILE_FORMATS: List[ImageFormat] = [
+    ImageFormat.JPEG,
+    ImageFormat.JPG,
+    ImageFormat.PNG,
+    ImageFormat.WEBP,
+]
+
+
+def pyramid_directory(
+    image_url: str, format: ImageFormat, limits: tuple[float, float] | None = None
+) -> str:
+    """Cache directory for an image's tile pyramid.
+
+    Pyramids stretched with different display limits, e.g., after the image
+    statistics are recomputed, are saved separately.
+
+    """
+
+    key: List[str] = [image_url, "tiles", format.extension]
+    if limits is not None:
+        key.append("limits{}:{}".format(*limits))
+    return generate_cache_filename(*key)
+
+
+def tile_path(directory: str, z: int, x: int, y: int, format: ImageFormat) -> str:
+    return os.path.join(directory, str(z), f"{x}_{y}.{format.extension}")
+
+
+def level_shapes(shape: tuple[int, int], tile_size: int = TILE_SIZE) -> List[tuple]:
+    """Image shape at each pyramid level, from level 0 to native resolution."""
+
+    shapes: List[tuple[int, int]] = [tuple(shape)]
+    while max(shapes[0]) > tile_size:
+        ny, nx = shapes[0]
+        shapes.insert(0, ((ny + 1) // 2, (nx + 1) // 2))
+    return shapes
+
+
+def _downsample(image: np.ndarray) -> np.ndarray:
+    """2×2 block-average an 8-bit image, replicating odd edges."""
+
+    ny, nx = image.shape
+    padded: np.ndarray = np.pad(image, ((0, ny % 2), (0, nx % 2)), mode="edge")
+    blocks: np.ndarray = padded.reshape(padded.shape[0] // 2, 2, -1, 2)
+    return ((blocks.sum(axis=(1, 3), dtype=np.uint16) + 2) // 4).astype(np.uint8)
+
+
+def _save_atomic(image: PIL_Image.Image, path: str, format: ImageFormat) -> None:
+    with atomic_write(path) as outf:
+        image.save(outf, format=format.format, **encoder_options(format))
+
+
+@contextmanager
+def _build_lock(directory: str) -> Iterator[None]:
+    """Only one process at a time may build a pyramid."""
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def build_pyramid(
+    image_url: str,
+    data_ext: int,
+    format: str | ImageFormat = ImageFormat.JPEG,
+    limits: tuple[float, float] | None = None,
+    tile_size: int = TILE_SIZE,
+    overwrite: bool = False,
+) -> dict:
+    """Generate and save the tile pyramid for an image.
+
+
+    Parameters
+    ----------
+    image_url : str
+        The URL to the full-size image.
+
+    data_ext : int
+        The FITS HDU extension with the data.
+
+    format : str or ImageFormat, optional
+        Tile format: jpeg, png, or webp.
+
+    limits : tuple of float, optional
+        Display limits.  If ``None``, then the zscale algorithm is applied to
+        the lowest resolution level.
+
+    tile_size : int, optional
+        Tile width and height.
+
+    overwrite : bool, optional
+        Rebuild the pyramid, even if it already exists.
+
+
+    Returns
+    -------
+    pyramid : dict
+        Pyramid metadata: width, height, tile_size, levels, format.
+
+    """
+
+    format = ImageFormat(format)
+    if format not in TILE_FORMATS:
+        raise ParameterValueError("Tile format must be jpeg, png, or webp.")
+
+    logger: logging.Logger = get_logger()
+    directory: str = pyramid_directory(image_url, format, limits)
+    metadata_file: str = os.path.join(directory, "pyramid.json")
+
+    with _build_lock(directory):
+        if os.path.exists(metadata_file) and not overwrite:
+            with open(metadata_file) as inf:
+                return json.load(inf)
+
+        logger.info("Building %s tile pyramid for %s", format.extension, image_url)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", fits.verify.VerifyWarning)
+            with open_image(local_file(image_url)) as (hdul, _):
+                check_render_memory(hdul[data_ext], 1)
+
+                # display orientation: origin at the upper-left
+                data: np.ndarray = image_data(hdul[data_ext])[::-1]
+                shapes: List[tuple[int, int]] = level_shapes(data.shape, tile_size)
+
+                if limits is None:
+                    # zscale on the lowest resolution level
+                    step: int = 2 ** (len(shapes) - 1)
+                    limits = zscale_limits(data[::step, ::step])
+
+                # stretch to 8 bits at full resolution, then downsample
+                image: np.ndarray = stretch(data, limits)
+                del data
+
+        for z in range(len(shapes) - 1, -1, -1):
+            os.makedirs(os.path.join(directory, str(z)), exist_ok=True)
+            ny, nx = image.shape
+            for y in range(0, (ny + tile_size - 1) // tile_size):
+                for x in range(0, (nx + tile_size - 1) // tile_size):
+                    tile: np.ndarray = image[
+                        y * tile_size : (y + 1) * tile_size,
+                        x * tile_size : (x + 1) * tile_size,
+                    ]
+                    _save_atomic(
+                        PIL_Image.fromarray(tile),
+                        tile_path(directory, z, x, y, format),
+                        format,
+                    )
+
+            if z > 0:
+                image = _downsample(image)
+
+        pyramid: dict = {
+            "width": shapes[-1][1],
+            "height": shapes[-1][0],
+            "tile_size": tile_size,
+            "levels": len(shapes),
+            "format": format.extension,
+        }
+        with atomic_write(metadata_file, "w") as outf:
+            json.dump(pyramid, outf)
+
+    return pyramid
+
+
+def _build_pyramid_job(args: tuple) -> bool:
+    """Multiprocessing wrapper for ``build_pyramid``."""
+
+    try:
+        build_pyramid(*args[:3], limits=args[3], overwrite=args[4])
+    except Exception:
+        get_logger().exception("Error building tile pyramid for %s", args[0])
+        return False
+
+    return True
+
+
+def build_pyramids(
+    session: Session,
+    collection: str | None = None,
+    obs_ids: List[str] | None = None,
+    format: str | ImageFormat = ImageFormat.JPEG,
+    processes: int | None = None,
+    overwrite: bool = False,
+) -> int:
+    """Build tile pyramids for images in the database, in parallel.
+
+
+    Parameters
+    ----------
+    session : sqlalchemy Session
+        Database session object.
+
+    collection : str, optional
+        Only process images in this collection.
+
+    obs_ids : list of str, optional
+        Only process these images.
+
+    format : str or ImageFormat, optional
+        Tile format: jpeg, png, or webp.
+
+    processes : int, optional
+        Number of worker processes.  Default is the number of CPUs.
+
+    overwrite : bool, optional
+        Rebuild existing pyramids.
+
+
+    Returns
+    -------
+    n : int
+        Number of pyramids successfully built.
+
+    """
+
+    format = ImageFormat(format)
+
+    query = session.query(
+        Image.image_url,
+        Image.collection,
+        ImageStatistics.zscale_min,
+        ImageStatistics.zscale_max,
+    ).outerjoin(ImageStatistics, ImageStatistics.image_id == Image.id)
+    if collection is not None:
+        query = query.filter(Image.collection == collection)
+    if obs_ids is not None:
+        query = query.filter(Image.obs_id.in_(obs_ids))
+
+    jobs: List[tuple] = []
+    for image_url, image_collection, zscale_min, zscale_max in query.all():
+        limits: tuple[float, float] | None = None
+        if zscale_min is not None and zscale_max is not None:
+            limits = (zscale_min, zscale_max)
+
+        jobs.append(
+            (
+                image_url,
+                image_extensions(image_collection)[1],
+                format,
+                limits,
+                overwrite,
+            )
+        )
+
+    with multiprocessing.Pool(processes) as pool:
+        return sum(pool.imap_unordered(_build_pyramid_job, jobs))
+
+
+def _get_image(obs_id: str) -> Image:
+    with data_provider_session() as session:
+        try:
+            im = session.query(Image).filter(Image.obs_id == obs_id).one()
+        except NoResultFound as exc:  # noqa: F841
+            raise InvalidImageID("Image ID not found in database.") from exc
+
+        session.expunge(im)
+
+    return im
+
+
+def _pyramid(
+    im: Image, format: ImageFormat, limits: tuple[float, float] | None
+) -> Generator[Render, Any, dict]:
+    """Pyramid metadata, building the pyramid with the render pool as needed."""
+
+    if format not in TILE_FORMATS:
+        raise ParameterValueError("Tile format must be jpeg, png, or webp.")
+
+    data_ext: int = image_extensions(im.collection)[1]
+    metadata_file: str = os.path.join(
+        pyramid_directory(im.image_url, format, limits), "pyramid.json"
+    )
+    if os.path.exists(metadata_file):
+        return build_pyramid(im.image_url, data_ext, format, limits=limits)
+
+    # the cost is set by the full-resolution level
+    header: fits.Header = fits.getheader(local_file(im.image_url), data_ext)
+    pixels: float = header.get("NAXIS1", 0) * header.get("NAXIS2", 0)
+    pyramid: dict = yield Render(
+        render_cost(pixels, format),
+        build_pyramid,
+        (im.image_url, data_ext, format),
+        dict(limits=limits),
+    )
+    return pyramid
+
+
+def _pyramid_query(
+    obs_id: str, format: str | ImageFormat = "jpeg"
+) -> Generator[Render, Any, dict]:
+    """`pyramid_query`, yielding its render jobs."""
+
+    try:
+        format = ImageFormat(format)
+    except ValueError:
+        raise ParameterValueError("Tile format must be jpeg, png, or webp.")
+
+    im: Image = _get_image(obs_id)
+    pyramid: dict = yield from _pyramid(im, format, display_limits(im.id))
+    return pyramid
+
+
+def pyramid_query(obs_id: str, format: str | ImageFormat = "jpeg") -> dict:
+    """Return tile pyramid metadata, building the pyramid as needed."""
+    return run_renders(_pyramid_query(obs_id, format))
+
+
+async def pyramid_query_async(obs_id: str, format: str | ImageFormat = "jpeg") -> dict:
+    """Coroutine version of `pyramid_query`, awaiting its renders."""
+    return await run_renders_async(_pyramid_query(obs_id, format))
+
+
+def tile_query(
+    obs_id: str, z: int, x: int, y: int, format: str | ImageFormat = "jpeg"
+) -> tuple[str, str]:
+    """Query database for an image, and return a tile from its pyramid.
+
+    The pyramid is built on the first request and cached.
+
+
+    Parameters
+    ----------
+    obs_id : str
+        Database observation ID, i.e., PDS4 logical identifier (LID).
+
+    z : int
+        Pyramid level, 0 for the lowest resolution.
+
+    x, y : int
+        Tile column and row, starting from the upper-left corner.
+
+    format : str or ImageFormat, optional
+        Tile format: jpeg, png, or webp.
+
+
+    Returns
+    -------
+    tile_path : str
+        Path to the requested tile.
+
+    download_filename : str
+        Suggested filename for downloads.
+
+    """
+
+    return run_renders(_tile_query(obs_id, z, x, y, format))
+
+
+async def tile_query_async(
+    obs_id: str, z: int, x: int, y: int, format: str | ImageFormat = "jpeg"
+) -> tuple[str, str]:
+    """Coroutine version of `tile_query`, awaiting its renders."""
+    return await run_renders_async(_tile_query(obs_id, z, x, y, format))
+
+
+def _tile_query(
+    obs_id: str, z: int, x: int, y: int, format: ImageFormat | str
+) -> Generator[Render, Any, tuple[str, str]]:
+    """`tile_query`, yielding its render jobs."""
+
+    try:
+        format = ImageFormat(format)
+    except ValueError:
+        raise ParameterValueError("Tile format must be jpeg, png, or webp.")
+
+    im: Image = _get_image(obs_id)
+    limits: tuple[float, float] | None = display_limits(im.id)
+    directory: str = pyramid_directory(im.image_url, format, limits)
+    path: str = tile_path(directory, z, x, y, format)
+    download_filename: str = (
+        os.path.splitext(os.path.basename(im.image_url))[0]
+        + f"_{z}_{x}_{y}.{format.extension}"
+    )
+
+    # served from the cache?
+    if os.path.exists(path):
+        return path, download_filename
+
+    pyramid: dict = yield from _pyramid(im, format, limits)
+
+    if not os.path.exists(path):
+        raise InvalidTile(
+            f"Tile {z}/{x}/{y} is not in the pyramid"
+            f" ({pyramid['levels']} levels, {pyramid['width']}x{pyramid['height']}"
+            " pixels)."
+        )
+
+    return path, download_filename
@@ -0,0 +1,176 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Uncompressed copies of frequently read tile-compressed images.
+
+Reads of local (or mirrored) tile-compressed images are counted (see
+`access`).  When an image has been read SBNSIS_TRANSCODE_THRESHOLD times
+within the access window, it is decompressed once, in the background, to an
+uncompressed FITS file with the same extensions.  Later reads memory map the
+uncompressed copy, rather than decompressing tiles again.  The
+least-recently used copies are removed when the cache exceeds
+SBNSIS_TRANSCODE_SIZE.
+
+"""
+
+__all__ = [
+    "transcode_directory",
+    "transcoded_path",
+    "transcoded",
+    "transcode",
+    "record_access",
+]
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from astropy.io import fits
+
+from .access import access_tracker
+from .blockcache import prune_block_cache
+from .compressed import decompress
+from ..data import atomic_write, try_lock
+from ..config.env import ENV
+from ..config.logging import get_logger
+
+
+def transcode_directory() -> str:
+    """The transcoded image directory, default: "raw" in the cutout cache."""
+    if ENV.SBNSIS_TRANSCODE:
+        return ENV.SBNSIS_TRANSCODE
+    return os.path.join(ENV.SBNSIS_CUTOUT_CACHE, "raw")
+
+
+def transcoded_path(path: str) -> str:
+    """The file name of the uncompressed copy of a local image.
+
+    The name depends on the image's file name and size, so that replaced
+    images are transcoded again.
+
+    """
+
+    size: int = os.path.getsize(path)
+    key: str = hashlib.md5(f"{path} {size}".encode()).hexdigest()
+    return os.path.join(transcode_directory(), key[:2], key + ".fits")
+
+
+def transcoded(path: str) -> str | None:
+    """The uncompressed copy of a local image, or ``None`` if there is none."""
+
+    if ENV.SBNSIS_TRANSCODE_SIZE <= 0:
+        return None
+
+    raw: str = transcoded_path(path)
+    try:
+        # mark as recently used
+        os.utime(raw)
+    except FileNotFoundError:
+        return None
+    return raw
+
+
+def transcode(path: str) -> str | None:
+    """Write an uncompressed copy of a tile-compressed image.
+
+    Compressed image extensions are replaced with uncompressed image
+    extensions, with the BSCALE and BZERO scaling applied.  Other extensions
+    are copied.  Returns immediately if another thread or process is
+    transcoding the file.
+
+
+    Parameters
+    ----------
+    path : str
+        The local image file name.
+
+
+    Returns
+    -------
+    raw : str or None
+        The uncompressed copy, or ``None`` if the file was not transcoded.
+
+    """
+
+    logger: logging.Logger = get_logger()
+    raw: str = transcoded_path(path)
+    os.makedirs(os.path.dirname(raw), exist_ok=True)
+    locked: bool
+    with try_lock(raw + ".lock") as locked:
+        if not locked:
+            return None
+
+        if os.path.exists(raw):
+            return raw
+
+        t0: float = time.monotonic()
+        with fits.open(path, lazy_load_hdus=True) as hdul:
+            result: fits.HDUList = fits.HDUList()
+            for hdu in hdul:
+                if isinstance(hdu, fits.CompImageHDU):
+                    header: fits.Header = hdu.header.copy()
+                    if "BSCALE" in header or "BZERO" in header:
+                        # scaled data are decompressed to physical values
+                        for k in ["BSCALE", "BZERO", "BLANK"]:
+                            header.remove(k, ignore_missing=True)
+                    result.append(fits.ImageHDU(decompress(hdu), header))
+                else:
+                    result.append(hdu)
+
+            with atomic_write(raw) as outf:
+                result.writeto(outf, output_verify="silentfix")
+
+    logger.info(
+        json.dumps(
+            {
+                "job": "transcode",
+                "path": path,
+                "output": raw,
+                "size": os.path.getsize(raw),
+                "seconds": round(time.monotonic() - t0, 1),
+            }
+        )
+    )
+
+    n: int = prune_block_cache(transcode_directory(), ENV.SBNSIS_TRANSCODE_SIZE * 2**20)
+    if n > 0:
+        logger.info("Removed %d images from the transcoded image cache.", n)
+
+    return raw
+
+
+def _transcode(path: str) -> None:
+    try:
+        transcode(path)
+    except Exception:
+        get_logger().exception("Failed to transcode %s", path)
+
+
+def record_access(path: str) -> threading.Thread | None:
+    """Count a read of a compressed image, and transcode if hot.
+
+
+    Parameters
+    ----------
+    path : str
+        The local image file name.
+
+
+    Returns
+    -------
+    thread : threading.Thread or None
+        The background transcoding, if started.
+
+    """
+
+    if ENV.SBNSIS_TRANSCODE_SIZE <= 0:
+        return None
+
+    count: int = access_tracker().record(path)[0]
+    if count < ENV.SBNSIS_TRANSCODE_THRESHOLD or os.path.exists(transcoded_path(path)):
+        return None
+
+    thread = threading.Thread(target=_transcode, args=(path,), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,307 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Resilient requests to remote archives.
+
+Every request to a remote archive, e.g., a block cache miss, a HEAD request,
+or a full download, is made through `request`:
+
+* Requests to each archive host are limited to SBNSIS_HOST_CONCURRENCY at a
+  time, shared by all workers on this machine with lock files.  Requests that
+  cannot get a slot within the connect timeout fail.
+
+* Timeouts and server errors are retried up to SBNSIS_RETRIES times, after a
+  random (jittered) exponential backoff.  Reads are idempotent.
+
+* After SBNSIS_BREAKER_THRESHOLD consecutive failed requests, the host's
+  circuit breaker opens: requests fail immediately for SBNSIS_BREAKER_RESET
+  seconds.  Then, one trial request is allowed, which closes the breaker on
+  success, or opens it again on failure.
+
+Failures are raised as `UpstreamUnavailable`, i.e., HTTP status 503, so that
+a slow or unavailable archive does not tie up the service's workers.
+
+"""
+
+__all__ = [
+    "timeouts",
+    "client_kwargs",
+    "CircuitBreaker",
+    "breaker",
+    "host_slot",
+    "is_transient",
+    "request",
+]
+
+import os
+import time
+import fcntl
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, TypeVar
+from urllib.parse import urlparse
+
+import aiohttp
+import requests
+
+from ..config.env import ENV
+from ..config.exceptions import UpstreamUnavailable
+from ..config.logging import get_logger
+
+T = TypeVar("T")
+
+# first retry delay, in seconds, doubled for each retry
+BACKOFF: float = 0.25
+
+
+def timeouts() -> tuple[float, float]:
+    """Connect and read timeouts in seconds, for `requests`."""
+    return ENV.SBNSIS_CONNECT_TIMEOUT, ENV.SBNSIS_READ_TIMEOUT
+
+
+def client_kwargs() -> dict:
+    """aiohttp client options with timeouts, for fsspec HTTP file systems."""
+    return {
+        "timeout": aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=ENV.SBNSIS_CONNECT_TIMEOUT,
+            sock_read=ENV.SBNSIS_READ_TIMEOUT,
+        )
+    }
+
+
+class CircuitBreaker:
+    """Fail fast while a remote host is unhealthy.
+
+
+    Parameters
+    ----------
+    host : str
+        The remote host name.
+
+    threshold : int, optional
+        Consecutive failures that open the breaker.  Default:
+        SBNSIS_BREAKER_THRESHOLD.
+
+    reset : float, optional
+        Seconds to wait before a trial request.  Default: SBNSIS_BREAKER_RESET.
+
+    """
+
+    def __init__(
+        self, host: str, threshold: int | None = None, reset: float | None = None
+    ) -> None:
+        self.host = host
+        self.threshold = (
+            ENV.SBNSIS_BREAKER_THRESHOLD if threshold is None else threshold
+        )
+        self.reset = ENV.SBNSIS_BREAKER_RESET if reset is None else reset
+        self.failures: int = 0
+        self.opened: float | None = None
+        self._trial: bool = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Breaker state: closed, open, or half-open."""
+        if self.opened is None:
+            return "closed"
+        if self._trial or time.monotonic() - self.opened >= self.reset:
+            return "half-open"
+        return "open"
+
+    def before(self) -> None:
+        """Check the breaker before a request.
+
+        Raises `UpstreamUnavailable` if open, or if half-open and another
+        request is the trial.
+
+        """
+
+        with self._lock:
+            if self.opened is None:
+                return
+
+            remaining: float = self.opened + self.reset - time.monotonic()
+            if remaining <= 0 and not self._trial:
+                self._trial = True
+                return
+
+        raise UpstreamUnavailable(
+            f"{self.host} is temporarily unavailable.", max(remaining, 1)
+        )
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+            self._trial = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                if self.opened is None or self._trial:
+                    get_logger().warning(
+                        "Circuit breaker opened for %s after %d failures.",
+                        self.host,
+                        self.failures,
+                    )
+                self.opened = time.monotonic()
+                self._trial = False
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(host: str) -> CircuitBreaker:
+    """The circuit breaker for a remote host, in this process."""
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+
+@contextmanager
+def host_slot(host: str, wait: float | None = None) -> Iterator[None]:
+    """Hold one of the host's SBNSIS_HOST_CONCURRENCY request slots.
+
+    Slots are lock files in the cutout cache, shared by all processes.
+
+
+    Parameters
+    ----------
+    host : str
+        The remote host name.
+
+    wait : float, optional
+        Seconds to wait for a slot.  Default: SBNSIS_CONNECT_TIMEOUT.
+
+
+    Raises
+    ------
+    UpstreamUnavailable
+        If no slot is available within ``wait`` seconds.
+
+    """
+
+    if ENV.SBNSIS_HOST_CONCURRENCY <= 0:
+        yield
+        return
+
+    directory: str = os.path.join(ENV.SBNSIS_CUTOUT_CACHE, "hosts")
+    os.makedirs(directory, exist_ok=True)
+    deadline: float = time.monotonic() + (
+        ENV.SBNSIS_CONNECT_TIMEOUT if wait is None else wait
+    )
+    # start at a random slot to spread the load
+    first: int = random.randrange(ENV.SBNSIS_HOST_CONCURRENCY)
+    while True:
+        for i in range(ENV.SBNSIS_HOST_CONCURRENCY):
+            slot: int = (first + i) % ENV.SBNSIS_HOST_CONCURRENCY
+            lock = open(os.path.join(directory, f"{host}.{slot}.lock"), "w")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                continue
+
+            try:
+                yield
+            finally:
+                lock.close()
+            return
+
+        if time.monotonic() > deadline:
+            raise UpstreamUnavailable(f"Too many requests to {host}.", 1)
+        time.sleep(random.uniform(0.01, 0.05))
+
+
+def is_transient(exc: BaseException) -> bool:
+    """True for errors worth retrying: timeouts, connection and server errors."""
+
+    if isinstance(exc, (FileNotFoundError, PermissionError)):
+        # fsspec reports HTTP connection errors as missing files
+        if exc.__cause__ is not None:
+            return is_transient(exc.__cause__)
+        return False
+
+    status: int | None = getattr(exc, "status", None)
+    response = getattr(exc, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+
+    return isinstance(
+        exc, (OSError, TimeoutError, aiohttp.ClientError, requests.RequestException)
+    )
+
+
+def request(url: str, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Make a request to a remote archive, with retries and limits.
+
+
+    Parameters
+    ----------
+    url : str
+        The remote URL, for the host name.  Local URLs are not limited.
+
+    func : callable
+        The request, called as ``func(*args, **kwargs)``.  Must be
+        idempotent.
+
+
+    Returns
+    -------
+    result
+        The value returned by ``func``.
+
+
+    Raises
+    ------
+    UpstreamUnavailable
+        If the host is unavailable, or the request failed after all
+        retries.
+
+    """
+
+    p = urlparse(url)
+    # without any user name and password
+    host: str = p.netloc.rpartition("@")[2]
+    if p.scheme in ["", "file"] or host == "":
+        return func(*args, **kwargs)
+
+    logger: logging.Logger = get_logger()
+    host_breaker: CircuitBreaker = breaker(host)
+    attempt: int = 0
+    while True:
+        host_breaker.before()
+        try:
+            with host_slot(host):
+                result: T = func(*args, **kwargs)
+        except UpstreamUnavailable:
+            raise
+        except Exception as exc:
+            if not is_transient(exc):
+                # e.g., file not found, the host is healthy
+                host_breaker.success()
+                raise
+
+            host_breaker.failure()
+            if attempt >= ENV.SBNSIS_RETRIES:
+                raise UpstreamUnavailable(
+                    f"{host} is not responding.", ENV.SBNSIS_BREAKER_RESET
+                ) from exc
+
+            delay: float = random.uniform(0, BACKOFF * 2**attempt)
+            logger.warning(
+                "Request to %s failed (%s), retrying in %.2f s.", url, exc, delay
+            )
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        host_breaker.success()
+        return result
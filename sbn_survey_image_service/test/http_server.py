@@ -0,0 +1,109 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Local stand-in HTTP server for testing remote data access."""
+
+__all__ = ["serve_directory"]
+
+import os
+import re
+import time
+import threading
+from functools import partial
+from contextlib import contextmanager
+from typing import Iterator, List
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serve files and directory listings without logging to stderr.
+
+    Single byte-range requests are supported.  Requests are recorded as
+    (path, range) tuples in ``requests``, if defined.  GET requests are
+    delayed by ``delay`` seconds.
+
+    """
+
+    def __init__(
+        self,
+        *args,
+        requests: List[tuple] | None = None,
+        delay: float = 0,
+        **kwargs,
+    ):
+        # set before the base class handles the request
+        self.requests = requests
+        self.delay = delay
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        byte_range: str | None = self.headers.get("Range")
+        if self.requests is not None:
+            self.requests.append((self.path, byte_range))
+        time.sleep(self.delay)
+
+        path: str = self.translate_path(self.path)
+        match = re.match(r"bytes=(\d+)-(\d*)$", byte_range or "")
+        if match is None or not os.path.isfile(path):
+            return super().do_GET()
+
+        size: int = os.path.getsize(path)
+        start: int = int(match.group(1))
+        end: int = min(int(match.group(2) or size - 1), size - 1)
+        if start >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return
+
+        with open(path, "rb") as inf:
+            inf.seek(start)
+            data: bytes = inf.read(end - start + 1)
+
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@contextmanager
+def serve_directory(
+    path: str, requests: List[tuple] | None = None, delay: float = 0
+) -> Iterator[str]:
+    """Serve a local directory over HTTP in a background thread.
+
+
+    Parameters
+    ----------
+    path : str
+        The directory to serve.
+
+    requests : list, optional
+        Record GET requests in this list.
+
+    delay : float, optional
+        Delay GET responses by this many seconds, e.g., to simulate a slow
+        server.
+
+
+    Returns
+    -------
+    url : str
+        The base URL of the server, ending with "/".
+
+    """
+
+    handler = partial(QuietHandler, directory=path, requests=requests, delay=delay)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,119 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test admission control for renders."""
+
+import time
+
+import pytest
+
+from ..api.clients import client_address
+from ..config.env import ENV
+from ..config.exceptions import TooManyRequests
+from ..services import admission
+from ..services.admission import CLIENT, TokenBucket, admit
+from ..services.image import ImageFormat, render_cost
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_CLIENT_RATE", 100)
+    monkeypatch.setattr(ENV, "SBNSIS_CLIENT_BURST", 1000)
+    monkeypatch.setattr(ENV, "SBNSIS_CLIENT_RENDERS", 2)
+    monkeypatch.setattr(ENV, "SBNSIS_GLOBAL_RATE", 0)
+    monkeypatch.setattr(admission, "_clients", {})
+    monkeypatch.setattr(admission, "_renders", {})
+    monkeypatch.setattr(admission, "_global", None)
+
+
+def test_render_cost():
+    assert render_cost(100, ImageFormat.FITS) == 100
+    assert render_cost(100, ImageFormat.FITS, compress="rice") == 200
+    assert render_cost(100, ImageFormat.JPEG) == 200
+    assert render_cost(100, ImageFormat.JPEG, bin=2) == 125
+    assert render_cost(100, ImageFormat.JPEG, align=True) == 500
+    assert render_cost(100, ImageFormat.AVIF) > render_cost(100, ImageFormat.JPEG)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(10, 20)
+    assert bucket.wait(20) == 0
+    bucket.take(20)
+    assert bucket.wait(10) == pytest.approx(1, abs=0.01)
+
+    # larger than the capacity: needs a full bucket
+    assert bucket.wait(100) == pytest.approx(2, abs=0.01)
+
+    time.sleep(0.2)
+    assert bucket.wait(10) == pytest.approx(0.8, abs=0.05)
+
+
+def test_admit_unlimited():
+    # outside of the API
+    for i in range(10):
+        with admit(1e9):
+            pass
+
+
+def test_admit_client_rate():
+    CLIENT.set("192.0.2.1")
+    with admit(600):
+        pass
+
+    with pytest.raises(TooManyRequests) as exc_info:
+        with admit(600):
+            pass
+    assert exc_info.value.code == 429
+    assert exc_info.value.retry_after == pytest.approx(2, abs=0.1)
+
+    # other clients have their own budget
+    CLIENT.set("192.0.2.2")
+    with admit(600):
+        pass
+
+
+def test_admit_client_renders():
+    CLIENT.set("192.0.2.1")
+    with admit(1):
+        with admit(1):
+            with pytest.raises(TooManyRequests):
+                with admit(1):
+                    pass
+
+        with admit(1):
+            pass
+
+    assert admission._renders == {}
+
+
+def test_admit_global_rate(monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_GLOBAL_RATE", 10)
+
+    CLIENT.set("192.0.2.1")
+    with admit(100):
+        pass
+
+    CLIENT.set("192.0.2.2")
+    with pytest.raises(TooManyRequests):
+        with admit(100):
+            pass
+
+
+def test_client_address():
+    proxies = "127.0.0.1,10.0.0.0/8"
+
+    # direct connection: the header is ignored
+    assert client_address("192.0.2.1", "198.51.100.1", proxies) == "192.0.2.1"
+
+    # through trusted proxies
+    assert client_address("127.0.0.1", "192.0.2.1", proxies) == "192.0.2.1"
+    assert (
+        client_address("127.0.0.1", "198.51.100.1, 192.0.2.1, 10.1.2.3", proxies)
+        == "192.0.2.1"
+    )
+
+    # only proxies, or no header
+    assert client_address("127.0.0.1", "10.1.2.3", proxies) == "10.1.2.3"
+    assert client_address("127.0.0.1", None, proxies) == "127.0.0.1"
+
+    # invalid addresses are not trusted
+    assert client_address("127.0.0.1", "unknown", proxies) == "unknown"
+    assert client_address(None, "192.0.2.1", proxies) is None
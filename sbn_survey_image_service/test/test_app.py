@@ -0,0 +1,166 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test the async API application."""
+
+import os
+import asyncio
+
+import pytest
+from sqlalchemy.orm.session import Session
+
+from ..app import app
+from ..data.test import generate
+from ..services.database_provider import data_provider_session
+from ..services import renderpool
+from ..services.executors import run_io
+from ..services.image import image_query
+from ..config.env import ENV
+
+ID = "urn:nasa:pds:survey:test-collection:test-000023"
+
+
+@pytest.fixture(autouse=True)
+def dummy_data():
+    session: Session
+    with data_provider_session() as session:
+        if not generate.exists(session):
+            generate.create_tables()
+            generate.create_data(session, ENV.TEST_DATA_PATH)
+
+
+@pytest.fixture(scope="module")
+def client():
+    with app.test_client() as client:
+        yield client
+
+
+def test_render_pool(client):
+    # started with the app
+    assert renderpool._pool.processes == ENV.SBNSIS_RENDER_PROCESSES
+
+
+def test_summary(client):
+    response = client.get("/summary")
+    assert response.status_code == 200
+    assert response.json()[0]["collection"] == "urn:nasa:pds:survey:test-collection"
+
+
+def test_query(client):
+    response = client.get("/query", params={"maxrec": 2})
+    assert response.status_code == 200
+    assert response.json()["count"] == 2
+
+
+def test_get_image(client):
+    response = client.get("/images/" + ID, params={"format": "label"})
+    assert response.status_code == 200
+    assert response.headers["content-disposition"].startswith("inline")
+
+    response = client.get("/images/" + ID, params={"format": "jpeg", "download": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["content-disposition"].startswith("attachment")
+    assert response.content[:2] == b"\xff\xd8"
+
+
+def test_errors(client):
+    # SBNSISException: invalid ID
+    response = client.get("/images/not-a-real-id")
+    assert response.status_code == 404
+
+    # SBNSISException: parameter value error
+    response = client.get("/images/" + ID, params={"ra": 0})
+    assert response.status_code == 400
+
+
+def test_run_io():
+    async def queries():
+        return await asyncio.gather(*[run_io(sum, [i, 1]) for i in range(10)])
+
+    assert asyncio.run(queries()) == list(range(1, 11))
+
+
+def test_image_validators(client):
+    response = client.get("/images/" + ID, params={"format": "label"})
+    etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+    assert etag.startswith('"')
+    assert response.headers["cache-control"] == ENV.SBNSIS_CACHE_CONTROL_IMAGES
+
+    response = client.get(
+        "/images/" + ID, params={"format": "label"}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    # weak comparison, and lists of tags
+    response = client.get(
+        "/images/" + ID,
+        params={"format": "label"},
+        headers={"If-None-Match": '"other", W/' + etag},
+    )
+    assert response.status_code == 304
+
+    response = client.get(
+        "/images/" + ID,
+        params={"format": "label"},
+        headers={"If-Modified-Since": last_modified},
+    )
+    assert response.status_code == 304
+
+    response = client.get(
+        "/images/" + ID,
+        params={"format": "label"},
+        headers={"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"},
+    )
+    assert response.status_code == 200
+
+    # If-None-Match takes precedence
+    response = client.get(
+        "/images/" + ID,
+        params={"format": "label"},
+        headers={"If-None-Match": '"other"', "If-Modified-Since": last_modified},
+    )
+    assert response.status_code == 200
+
+    # each image has its own tag
+    response = client.get("/images/" + ID, params={"format": "jpeg"})
+    assert response.headers["etag"] != etag
+
+
+def test_image_etag_rendered_again(client):
+    response = client.get("/images/" + ID, params={"format": "jpeg"})
+    etag = response.headers["etag"]
+
+    # the tag depends on the cached file name, not when it was written
+    filename, _ = image_query(ID, format="jpeg")
+    os.utime(filename, (0, 0))
+    response = client.get("/images/" + ID, params={"format": "jpeg"})
+    assert response.headers["etag"] == etag
+
+
+def test_json_validators(client):
+    response = client.get("/summary")
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == ENV.SBNSIS_CACHE_CONTROL_SUMMARY
+    assert "last-modified" not in response.headers
+
+    response = client.get("/summary", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.get("/query", params={"maxrec": 2})
+    assert response.headers["cache-control"] == ENV.SBNSIS_CACHE_CONTROL_QUERY
+    assert response.headers["etag"] != etag
+    response = client.get(
+        "/query",
+        params={"maxrec": 2},
+        headers={"If-None-Match": response.headers["etag"]},
+    )
+    assert response.status_code == 304
+
+    response = client.get(
+        "/query",
+        params={"maxrec": 3},
+        headers={"If-None-Match": response.headers["etag"]},
+    )
+    assert response.status_code == 200
@@ -4,15 +4,29 @@
 import os
 import tempfile
 
+import pytest
 import numpy as np
 from astropy.wcs import WCS
 from astropy.io import fits
+from PIL import Image, features
 from pyavm import AVM
 
 from ..services.image import create_browse_image
 
 
-def test_avm_xmp():
+def read_avm(filename, format):
+    if format in ["jpeg", "png"]:
+        return AVM.from_image(filename)
+
+    # pyavm does not read WebP or AVIF
+    return AVM.from_xml(Image.open(filename).info["xmp"])
+
+
+@pytest.mark.parametrize("format", ["jpeg", "png", "webp", "avif"])
+def test_avm_xmp(format):
+    if format == "avif" and not features.check("avif"):
+        pytest.skip("Pillow was built without AVIF support")
+
     im = np.zeros((10, 10))
     im[0, :] = 1  # first row is 1111111
 
@@ -29,12 +43,12 @@ def test_avm_xmp():
         fits.writeto(dataf, im, wcs.to_header())
         dataf.close()
 
-        # convert the FITS to JPEG and verify the XMP metadata
+        # convert the FITS to JPEG or PNG and verify the XMP metadata
         with tempfile.NamedTemporaryFile("w+b", delete=False) as imf:
             imf.close()
-            create_browse_image(dataf.name, imf.name, "jpeg", False, 0, 0)
+            create_browse_image(dataf.name, imf.name, format, False, 0, 0)
 
-            avm = AVM.from_image(imf.name)
+            avm = read_avm(imf.name, format)
 
     expected_reference_value = wcs.pixel_to_world_values(4.5, 4.5)  # 0-based
     assert avm.Spatial.CoordinateFrame == "ICRS"
@@ -0,0 +1,130 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test the remote image block cache."""
+
+import os
+
+import pytest
+import fsspec
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from .http_server import serve_directory
+from ..config.env import ENV
+from ..services.blockcache import DiskBlockCache, fsspec_options, prune_block_cache
+from ..services.image import CutoutSpec
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    """Serve a FITS image over HTTP, with caches in a temporary directory."""
+
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path / "cache"))
+    monkeypatch.setattr(ENV, "SBNSIS_BLOCK_SIZE", 8192)
+    os.makedirs(tmp_path / "cache")
+    os.makedirs(tmp_path / "www")
+
+    rng = np.random.default_rng(36)
+    data = rng.normal(size=(200, 200)).astype(np.float32)
+    wcs = WCS()
+    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+    wcs.wcs.crpix = (100.5, 100.5)
+    wcs.wcs.crval = (10, 20)
+    wcs.wcs.cdelt = -0.001, 0.001
+    fits.writeto(tmp_path / "www" / "test.fits", data, wcs.to_header())
+
+    requests = []
+    with serve_directory(str(tmp_path / "www"), requests) as url:
+        yield url + "test.fits", tmp_path / "www" / "test.fits", requests
+
+
+def ranges(requests):
+    return [r for r in requests if r[1] is not None]
+
+
+def test_disk_block_cache(remote):
+    url, path, requests = remote
+    with open(path, "rb") as inf:
+        expected = inf.read()
+
+    options = fsspec_options(url)
+    assert options["cache_type"] == DiskBlockCache.name
+    options["cache_options"]["read_ahead"] = 0
+
+    with fsspec.open(url, **options) as f:
+        f.seek(10000)
+        assert f.read(10000) == expected[10000:20000]
+        # blocks 1 and 2 are requested together
+        assert len(ranges(requests)) == 1
+
+    requests.clear()
+    with fsspec.open(url, **options) as f:
+        f.seek(9000)
+        assert f.read(20000) == expected[9000:29000]
+        # block 1 and 2 are cached, block 3 is fetched
+        assert ranges(requests) == [("/test.fits", "bytes=24576-32767")]
+
+    # a new file object, but all blocks are cached
+    requests.clear()
+    with fsspec.open(url, **options) as f:
+        f.seek(8192)
+        assert f.read(8192 * 3) == expected[8192 : 8192 * 4]
+    assert len(ranges(requests)) == 0
+
+
+def test_disk_block_cache_read_ahead(remote):
+    url, path, requests = remote
+    options = fsspec_options(url)
+    options["cache_options"]["read_ahead"] = 2
+
+    with fsspec.open(url, **options) as f:
+        f.read(100)
+
+    requests.clear()
+    with fsspec.open(url, **options) as f:
+        f.seek(8192 * 2)
+        f.read(100)
+
+    assert len(ranges(requests)) == 0
+
+
+def test_prune_block_cache(tmp_path):
+    for i in range(10):
+        os.makedirs(tmp_path / "ab", exist_ok=True)
+        fn = tmp_path / "ab" / f"block-{i}"
+        fn.write_bytes(b"x" * 100)
+        os.utime(fn, (i, i))
+
+    # prunes to 90% of the limit, oldest first
+    assert prune_block_cache(str(tmp_path), 500) == 6
+    assert sorted(os.listdir(tmp_path / "ab")) == [f"block-{i}" for i in range(6, 10)]
+
+
+def test_cutout_remote(remote):
+    url, path, requests = remote
+    spec = CutoutSpec(10, 20, "0.02deg")
+    remote_path, _, _ = spec.cutout("test", url, 0, 0)
+    local_path, _, _ = spec.cutout("test", "file://" + str(path), 0, 0)
+    np.testing.assert_array_equal(fits.getdata(remote_path), fits.getdata(local_path))
+    assert len(os.listdir(os.path.join(ENV.SBNSIS_CUTOUT_CACHE, "blocks"))) > 0
+
+    # a second cutout from the same image reuses the cached blocks
+    requests.clear()
+    CutoutSpec(10, 20, "0.01deg").cutout("test", url, 0, 0)
+    assert len(ranges(requests)) == 0
+
+
+def test_cutout_remote_replaced(remote):
+    url, path, requests = remote
+    CutoutSpec(10, 20, "0.02deg").cutout("test", url, 0, 0)
+
+    # same size, but a new version
+    with fits.open(path, mode="update") as hdul:
+        hdul[0].data += 1
+    mtime = os.stat(path).st_mtime + 10
+    os.utime(path, (mtime, mtime))
+
+    spec = CutoutSpec(10, 20, "0.01deg")
+    remote_path, _, _ = spec.cutout("test", url, 0, 0)
+    local_path, _, _ = spec.cutout("test", "file://" + str(path), 0, 0)
+    np.testing.assert_array_equal(fits.getdata(remote_path), fits.getdata(local_path))
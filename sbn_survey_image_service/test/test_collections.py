@@ -0,0 +1,89 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test collection profiles."""
+
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from .http_server import serve_directory
+from ..config.env import ENV
+from ..config.collections import (
+    CollectionProfile,
+    DEFAULT_PROFILE,
+    load_profiles,
+    save_profile,
+    profile,
+)
+from ..services.blockcache import DiskBlockCache, fsspec_options
+from ..services.benchmark import benchmark_block_sizes
+from ..services.image import image_extensions
+
+
+def test_profile():
+    neat = profile("urn:nasa:pds:gbo.ast.neat.survey:data_geodss:g19960417_obsdata")
+    assert neat.name == "neat"
+    assert neat.pixel_scale("urn:nasa:pds:gbo.ast.neat.survey:data_geodss:x") == (
+        1.43 / 3600
+    )
+    assert neat.pixel_scale("urn:nasa:pds:gbo.ast.neat.survey:data_tricam:x") == (
+        1.01 / 3600
+    )
+    assert image_extensions("urn:nasa:pds:gbo.ast.atlas.survey") == (1, 1)
+
+    assert profile("urn:nasa:pds:survey:test-collection") is DEFAULT_PROFILE
+    assert image_extensions("urn:nasa:pds:survey:test-collection") == (0, 0)
+    assert DEFAULT_PROFILE.pixel_scale("anything") is None
+
+    header = fits.Header({"XPIXELSZ": 1, "YPIXELSZ": 1, "NAXIS": 0})
+    assert list(neat.fix_header(header).keys()) == ["NAXIS"]
+
+
+def test_load_profiles(tmp_path):
+    path = str(tmp_path / "collections.json")
+    assert load_profiles(path)["atlas"].block_size is None
+
+    save_profile(path, "atlas", block_size=2**20)
+    save_profile(path, "example", lid_prefix="urn:nasa:pds:example", data_ext=2)
+    save_profile(path, "atlas", read_ahead=0)
+
+    profiles = load_profiles(path)
+    assert profiles["atlas"].block_size == 2**20
+    assert profiles["atlas"].read_ahead == 0
+    # unchanged settings
+    assert profiles["atlas"].image_suffix == ".fz"
+    assert profiles["example"].data_ext == 2
+    assert profiles["neat"] == load_profiles()["neat"]
+
+
+def test_fsspec_options(monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_BLOCK_CACHE_SIZE", 100)
+    url = "https://example.org/image.fits"
+
+    options = fsspec_options(url)
+    assert options["block_size"] == ENV.SBNSIS_BLOCK_SIZE
+    assert "read_ahead" not in options["cache_options"]
+
+    p = CollectionProfile("test", "urn:test", block_size=1024, read_ahead=0)
+    options = fsspec_options(url, p)
+    assert options["block_size"] == 1024
+    assert options["cache_type"] == DiskBlockCache.name
+    assert options["cache_options"]["read_ahead"] == 0
+
+    p = CollectionProfile("test", "urn:test", cache_type="readahead")
+    assert fsspec_options(url, p)["cache_type"] == "readahead"
+    assert fsspec_options("file:///image.fits")["cache_type"] == "bytes"
+
+
+def test_benchmark_block_sizes(tmp_path):
+    os.makedirs(tmp_path / "www")
+    data = np.zeros((300, 300), np.float32)
+    fits.writeto(tmp_path / "www" / "test.fits", data)
+
+    with serve_directory(str(tmp_path / "www")) as url:
+        times = benchmark_block_sizes(
+            [url + "test.fits"], [4096, 65536], DEFAULT_PROFILE, size=100
+        )
+
+    assert list(times.keys()) == [4096, 65536]
+    assert all(t > 0 for t in times.values())
@@ -0,0 +1,173 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test planned reads of tile-compressed images."""
+
+import os
+
+import pytest
+import fsspec
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from .http_server import serve_directory
+from ..config.env import ENV
+from ..services.blockcache import fsspec_options
+from ..services import compressed
+from ..services.compressed import (
+    tile_ranges,
+    coalesce_ranges,
+    decompress,
+    PlannedSection,
+)
+from ..services.image import CutoutSpec
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    """Serve a tile-compressed FITS image over HTTP."""
+
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path / "cache"))
+    monkeypatch.setattr(ENV, "SBNSIS_BLOCK_SIZE", 1024)
+    monkeypatch.setattr(ENV, "SBNSIS_READ_AHEAD", 0)
+    os.makedirs(tmp_path / "cache")
+    os.makedirs(tmp_path / "www")
+
+    rng = np.random.default_rng(37)
+    data = rng.integers(0, 1000, size=(256, 256)).astype(np.int32)
+    wcs = WCS()
+    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+    wcs.wcs.crpix = (128.5, 128.5)
+    wcs.wcs.crval = (10, 20)
+    wcs.wcs.cdelt = -0.001, 0.001
+    fits.HDUList(
+        [
+            fits.PrimaryHDU(),
+            fits.CompImageHDU(
+                data,
+                wcs.to_header(),
+                compression_type="RICE_1",
+                tile_shape=(16, 16),
+            ),
+        ]
+    ).writeto(tmp_path / "www" / "test.fits.fz")
+
+    requests = []
+    with serve_directory(str(tmp_path / "www"), requests) as url:
+        yield url + "test.fits.fz", tmp_path / "www" / "test.fits.fz", data, requests
+
+
+def ranges(requests):
+    return [r for r in requests if r[1] is not None]
+
+
+def test_coalesce_ranges():
+    assert coalesce_ranges([(20, 30), (0, 10), (10, 15)]) == [(0, 15), (20, 30)]
+    assert coalesce_ranges([(20, 30), (0, 10)], max_gap=10) == [(0, 30)]
+    assert coalesce_ranges([(0, 30), (5, 10)]) == [(0, 30)]
+    assert coalesce_ranges([]) == []
+
+
+def test_tile_ranges(remote):
+    url, path, data, requests = remote
+    with fits.open(path) as hdul:
+        hdu = hdul[1]
+
+        # one tile per row of tiles
+        assert len(tile_ranges(hdu, (slice(20, 40), slice(0, 16)))) == 2
+        # 3 × 2 tiles
+        assert len(tile_ranges(hdu, (slice(0, 48), slice(8, 24)))) == 6
+        assert len(tile_ranges(hdu, (slice(None), slice(None)))) == 256
+        assert tile_ranges(hdu, (slice(10, 10), slice(None))) == []
+
+        # adjacent tiles are adjacent in the heap
+        merged = coalesce_ranges(tile_ranges(hdu, (slice(0, 16), slice(None))))
+        assert len(merged) == 1
+
+        # the ranges are the compressed tiles
+        n = sum(stop - start for start, stop in tile_ranges(hdu, (slice(None),) * 2))
+        assert n == hdu._bintable.header["PCOUNT"]
+
+
+def test_planned_section(remote):
+    url, path, data, requests = remote
+    region = (slice(40, 100), slice(30, 90))
+    with (
+        fsspec.open(url, "rb", **fsspec_options(url)) as f,
+        fits.open(f, lazy_load_hdus=True) as hdul,
+    ):
+        section = PlannedSection(hdul[1], f)
+        requests.clear()
+        section.prefetch(region)
+
+        # 25 tiles in 5 rows, about one request per row of tiles
+        assert 0 < len(ranges(requests)) <= 6
+
+        # decompression reads from the cache
+        requests.clear()
+        np.testing.assert_array_equal(section[region], data[region])
+        assert len(ranges(requests)) == 0
+
+
+def test_cutout_remote_compressed(remote):
+    url, path, data, requests = remote
+    spec = CutoutSpec(10, 20, "0.05deg")
+    remote_path, _, _ = spec.cutout("test", url, 1, 1)
+    local_path, _, _ = spec.cutout("test", "file://" + str(path), 1, 1)
+    np.testing.assert_array_equal(fits.getdata(remote_path), fits.getdata(local_path))
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.float32])
+@pytest.mark.parametrize("threads", [1, 4])
+def test_decompress(tmp_path, dtype, threads):
+    rng = np.random.default_rng(38)
+    data = (rng.normal(size=(100, 90)) * 100).astype(dtype)
+    header = fits.Header({"BSCALE": 2, "BZERO": 10}) if dtype == np.int16 else None
+    fits.HDUList(
+        [
+            fits.PrimaryHDU(),
+            fits.CompImageHDU(
+                data, header, compression_type="RICE_1", tile_shape=(16, 32)
+            ),
+        ]
+    ).writeto(tmp_path / "test.fits.fz")
+
+    with fits.open(tmp_path / "test.fits.fz") as hdul:
+        hdu = hdul[1]
+        np.testing.assert_array_equal(decompress(hdu, threads=threads), hdu.data)
+        for region in [
+            (slice(0, 16), slice(0, 32)),
+            (slice(5, 95), slice(10, 89)),
+            (slice(90, None), slice(None, 3)),
+            (slice(40, 40), slice(None)),
+        ]:
+            expected = hdu.section[region]
+            result = decompress(hdu, region, threads=threads)
+            assert result.dtype == expected.dtype
+            np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize(
+    "patch",
+    [
+        ("decompress_image_data_section", None),
+        ("_TABLE_ATTRIBUTES", ["_not_an_attribute"]),
+    ],
+)
+def test_private_api_fallback(remote, monkeypatch, patch):
+    # without astropy's private functions or attributes, fall back to
+    # CompImageSection
+    monkeypatch.setattr(compressed, *patch)
+    url, path, data, requests = remote
+    region = (slice(40, 100), slice(30, 90))
+    with (
+        fsspec.open(url, "rb", **fsspec_options(url)) as f,
+        fits.open(f, lazy_load_hdus=True) as hdul,
+    ):
+        assert not compressed.private_api(hdul[1])
+        np.testing.assert_array_equal(decompress(hdul[1], region), data[region])
+
+        section = PlannedSection(hdul[1], f)
+        requests.clear()
+        section.prefetch(region)
+        assert len(ranges(requests)) == 0
+        np.testing.assert_array_equal(section[region], data[region])
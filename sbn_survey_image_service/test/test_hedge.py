@@ -0,0 +1,173 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test hedged reads from collection mirrors."""
+
+import os
+import time
+
+import pytest
+import numpy as np
+from astropy.io import fits
+
+from .http_server import serve_directory
+from ..config.env import ENV
+from ..config.collections import CollectionProfile
+from ..data import url_to_local_file
+from ..services import hedge
+from ..services.hedge import HedgeBudget, LatencyTracker, alternates, hedged_request
+from ..services.readers import open_image
+
+PRIMARY = "https://archive.example.org/pds4/"
+MIRROR = "https://mirror.example.org/pds4/"
+
+
+def use_mirrors(monkeypatch, primary, mirror):
+    """Register a mirror, and a budget and latency history that allow hedging."""
+
+    profile = CollectionProfile("test", "urn:test", mirrors=((primary, mirror),))
+    monkeypatch.setattr(hedge, "PROFILES", {"test": profile})
+    monkeypatch.setattr(hedge, "_budget", HedgeBudget(1))
+
+    latency = LatencyTracker()
+    for i in range(hedge.MIN_SAMPLES):
+        latency.record(0.05)
+    monkeypatch.setattr(hedge, "_latencies", {hedge.urlparse(primary).netloc: latency})
+
+
+@pytest.fixture(autouse=True)
+def settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path))
+    monkeypatch.setattr(hedge, "_latencies", {})
+    monkeypatch.setattr(hedge, "_budget", None)
+
+
+def test_latency_tracker():
+    latency = LatencyTracker()
+    assert latency.delay() is None
+    for i in range(100):
+        latency.record(i / 100)
+    assert np.isclose(latency.delay(95), 0.9405)
+
+
+def test_hedge_budget():
+    budget = HedgeBudget(0.5)
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_alternates(monkeypatch):
+    use_mirrors(monkeypatch, PRIMARY, MIRROR)
+    assert alternates(PRIMARY + "a/b.fits") == [MIRROR + "a/b.fits"]
+    assert alternates("https://elsewhere.org/a/b.fits") == []
+
+
+def test_hedged_request(monkeypatch):
+    use_mirrors(monkeypatch, PRIMARY, MIRROR)
+    # one extra request per two requests
+    monkeypatch.setattr(hedge, "_budget", HedgeBudget(0.5))
+    calls = []
+
+    def read(url, delay):
+        calls.append(url)
+        if url.startswith(PRIMARY):
+            time.sleep(delay)
+        return url
+
+    # fast enough
+    assert hedged_request(PRIMARY + "x", read, 0) == PRIMARY + "x"
+    assert calls == [PRIMARY + "x"]
+
+    # too slow
+    calls.clear()
+    t0 = time.monotonic()
+    assert hedged_request(PRIMARY + "x", read, 1) == MIRROR + "x"
+    assert time.monotonic() - t0 < 0.5
+    assert calls == [PRIMARY + "x", MIRROR + "x"]
+
+    # out of budget: wait for the primary
+    calls.clear()
+    assert hedged_request(PRIMARY + "x", read, 0.2) == PRIMARY + "x"
+    assert calls == [PRIMARY + "x"]
+
+
+def test_hedged_request_failover(monkeypatch):
+    use_mirrors(monkeypatch, PRIMARY, MIRROR)
+    monkeypatch.setattr(hedge, "_budget", HedgeBudget(0))
+
+    def read(url):
+        if url.startswith(PRIMARY):
+            raise FileNotFoundError(url)
+        return url
+
+    # errors do not need the budget
+    assert hedged_request(PRIMARY + "x", read) == MIRROR + "x"
+
+    def fail(url):
+        raise FileNotFoundError(url)
+
+    with pytest.raises(FileNotFoundError, match="archive"):
+        hedged_request(PRIMARY + "x", fail)
+
+
+def test_hedged_request_cancel(monkeypatch):
+    use_mirrors(monkeypatch, PRIMARY, MIRROR)
+    cancelled = []
+    cancel = hedge.Future.cancel
+
+    def spy(future):
+        cancelled.append(future)
+        return cancel(future)
+
+    monkeypatch.setattr(hedge.Future, "cancel", spy)
+
+    def read(url):
+        if url.startswith(PRIMARY):
+            time.sleep(1)
+        return url
+
+    # the slow primary request is abandoned
+    assert hedged_request(PRIMARY + "x", read) == MIRROR + "x"
+    assert len(cancelled) == 1
+    assert not cancelled[0].done()
+
+
+@pytest.fixture
+def servers(tmp_path):
+    """A slow primary archive and a fast mirror of the same image."""
+
+    os.makedirs(tmp_path / "www")
+    data = np.random.default_rng(45).normal(size=(100, 100)).astype(np.float32)
+    fits.writeto(tmp_path / "www" / "test.fits", data)
+
+    primary_requests = []
+    mirror_requests = []
+    with serve_directory(str(tmp_path / "www"), primary_requests, delay=1) as primary:
+        with serve_directory(str(tmp_path / "www"), mirror_requests) as mirror:
+            yield primary, mirror, data, primary_requests, mirror_requests
+
+
+def test_open_image(servers, monkeypatch):
+    primary, mirror, data, primary_requests, mirror_requests = servers
+    use_mirrors(monkeypatch, primary, mirror)
+    monkeypatch.setattr(ENV, "SBNSIS_BLOCK_SIZE", 4096)
+
+    t0 = time.monotonic()
+    with open_image(primary + "test.fits") as (hdul, f):
+        np.testing.assert_array_equal(hdul[0].section[10:20, 30:40], data[10:20, 30:40])
+    assert time.monotonic() - t0 < 0.9
+    assert len(primary_requests) > 0
+    assert len(mirror_requests) > 0
+
+
+def test_url_to_local_file(servers, monkeypatch):
+    primary, mirror, data, primary_requests, mirror_requests = servers
+    use_mirrors(monkeypatch, primary, mirror)
+
+    t0 = time.monotonic()
+    path = url_to_local_file(primary + "test.fits")
+    assert time.monotonic() - t0 < 0.9
+    np.testing.assert_array_equal(fits.getdata(path), data)
+    assert mirror_requests == [("/test.fits", None)]
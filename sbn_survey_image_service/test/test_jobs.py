@@ -0,0 +1,248 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test asynchronous image jobs."""
+
+import os
+import time
+import asyncio
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy.orm.session import Session
+
+from ..app import app
+from ..data.test import generate
+from ..services import admission, executors, jobs
+from ..services.admission import CLIENT
+from ..services.executors import run_io
+from ..services.jobs import JobQueue, job_id_for, result_url
+from ..services.database_provider import data_provider_session
+from ..config.env import ENV
+
+ID = "urn:nasa:pds:survey:test-collection:test-000023"
+# the cutout center, at dec=-25
+CUTOUT_ID = "urn:nasa:pds:survey:test-collection:test-000102"
+
+
+@pytest.fixture(autouse=True)
+def dummy_data():
+    session: Session
+    with data_provider_session() as session:
+        if not generate.exists(session):
+            generate.create_tables()
+            generate.create_data(session, ENV.TEST_DATA_PATH)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+@pytest.fixture
+def dead_pid():
+    # a process that has exited
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # an empty cache, also for the render processes
+    cache = str(tmp_path_factory.mktemp("cache"))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(ENV, "SBNSIS_CUTOUT_CACHE", cache)
+        mp.setenv("SBNSIS_CUTOUT_CACHE", cache)
+        with app.test_client() as client:
+            yield client
+
+
+def test_job_id_for():
+    a = job_id_for({"obs_id": ID, "format": "fits", "ra": None})
+    b = job_id_for({"ra": None, "format": "fits", "obs_id": ID})
+    assert a == b
+    assert a != job_id_for({"obs_id": ID, "format": "jpeg", "ra": None})
+
+
+def test_result_url(monkeypatch):
+    monkeypatch.setattr(ENV, "BASE_HREF", "https://example.org/api/")
+    url = result_url({"obs_id": "urn:a:b", "format": "jpeg", "align": True, "ra": None})
+    assert url == "https://example.org/api/images/urn%3Aa%3Ab?format=jpeg&align=true"
+
+
+def test_submit(queue):
+    job, start = queue.submit({"obs_id": ID})
+    assert start
+    assert job["phase"] == "QUEUED"
+    assert job["owner"] == os.getpid()
+
+    # identical requests share the job
+    same, start = queue.submit({"obs_id": ID})
+    assert same["job_id"] == job["job_id"]
+    assert not start
+
+
+def test_claim_finish(queue):
+    job, start = queue.submit({"obs_id": ID})
+    claimed = queue.claim(job["job_id"])
+    assert claimed["phase"] == "EXECUTING"
+    assert claimed["started"] is not None
+
+    # already executing
+    assert queue.claim(job["job_id"]) is None
+
+    queue.progress(job["job_id"], 0.5)
+    assert queue.get(job["job_id"])["progress"] == 0.5
+
+    queue.finish(job["job_id"])
+    job = queue.get(job["job_id"])
+    assert job["phase"] == "COMPLETED"
+    assert job["progress"] == 1
+    assert queue.describe(job)["result"].endswith("/result")
+    assert queue.claim(job["job_id"]) is None
+
+
+def test_error_resubmit(queue):
+    job, start = queue.submit({"obs_id": ID})
+    queue.claim(job["job_id"])
+    queue.finish(job["job_id"], "failed", 500)
+    job = queue.get(job["job_id"])
+    assert job["phase"] == "ERROR"
+    assert queue.describe(job)["error"] == "failed"
+
+    # failed jobs are tried again
+    job, start = queue.submit({"obs_id": ID})
+    assert start
+    assert job["phase"] == "QUEUED"
+
+
+def test_stalled(queue, dead_pid):
+    job, start = queue.submit({"obs_id": ID})
+    queue.claim(job["job_id"])
+    assert queue.stalled() == []
+
+    # the worker stopped
+    with queue._connect() as db:
+        db.execute("UPDATE jobs SET owner = ?", (dead_pid,))
+    assert queue.stalled() == [job["job_id"]]
+    assert queue.claim(job["job_id"])["owner"] == os.getpid()
+
+    # or an identical request takes it over
+    with queue._connect() as db:
+        db.execute("UPDATE jobs SET owner = ?", (dead_pid,))
+    job, start = queue.submit({"obs_id": ID})
+    assert start
+
+
+def test_expiry(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), expiry=1)
+    job, start = queue.submit({"obs_id": ID})
+    queue.finish(job["job_id"])
+    assert queue.get(job["job_id"]) is not None
+
+    with queue._connect() as db:
+        db.execute("UPDATE jobs SET finished = ?", (time.time() - 3601,))
+    assert queue.get(job["job_id"]) is None
+
+
+def wait_for(client, url):
+    for i in range(100):
+        job = client.get(url).json()
+        if job["phase"] in ["COMPLETED", "ERROR"]:
+            return job
+        time.sleep(0.1)
+    raise TimeoutError
+
+
+def test_post_job(client):
+    params = {
+        "id": CUTOUT_ID,
+        "ra": 0,
+        "dec": -25,
+        "size": "1deg",
+        "format": "jpeg",
+    }
+    response = client.post("/jobs", params=params)
+    assert response.status_code == 202
+    job = response.json()
+    assert response.headers["location"] == job["url"]
+    assert job["parameters"]["obs_id"] == CUTOUT_ID
+
+    job = wait_for(client, "/jobs/" + job["job_id"])
+    assert job["phase"] == "COMPLETED"
+    assert job["progress"] == 1
+
+    response = client.get("/jobs/" + job["job_id"] + "/result", follow_redirects=False)
+    assert response.status_code == 303
+    assert response.headers["location"] == result_url(job["parameters"])
+
+    response = client.get(response.headers["location"])
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+
+
+def test_job_errors(client):
+    response = client.get("/jobs/not-a-job")
+    assert response.status_code == 404
+
+    response = client.post("/jobs", params={"id": ID, "format": "label"})
+    assert response.status_code == 400
+
+    response = client.post("/jobs", params={"id": ID, "ra": 0})
+    assert response.status_code == 400
+
+    response = client.post("/jobs", params={"id": "not-a-real-id"})
+    job = wait_for(client, response.headers["location"])
+    assert job["phase"] == "ERROR"
+    # not completed: redirects to the job
+    response = client.get(job["url"] + "/result", follow_redirects=False)
+    assert response.status_code == 303
+    assert response.headers["location"] == job["url"]
+
+    response = client.get("/jobs/not-a-job/result")
+    assert response.status_code == 404
+
+
+def test_get_image_job(client, monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_JOB_THRESHOLD", 1)
+    params = {"ra": 0, "dec": -25, "size": "0.5deg", "format": "png"}
+    response = client.get("/images/" + CUTOUT_ID, params=params)
+    assert response.status_code == 202
+    job = wait_for(client, response.headers["location"])
+    assert job["phase"] == "COMPLETED"
+
+    # now cached
+    response = client.get("/images/" + CUTOUT_ID, params=params)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+
+
+def test_execute_admission_saturated(tmp_path, monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path))
+    # the client is at its render limit
+    monkeypatch.setattr(ENV, "SBNSIS_CLIENT_RENDERS", 1)
+    monkeypatch.setitem(admission._renders, "saturated", 1)
+    # a single I/O thread
+    io = ThreadPoolExecutor(1)
+    monkeypatch.setattr(executors, "_executor", io)
+
+    queue = jobs.job_queue()
+    job, start = queue.submit(
+        {"obs_id": CUTOUT_ID, "ra": 0, "dec": -25, "size": "0.2deg", "format": "fits"}
+    )
+
+    async def run():
+        CLIENT.set("saturated")
+        task = asyncio.create_task(jobs.execute(job["job_id"]))
+        await asyncio.sleep(0.5)
+
+        # the waiting job does not hold the I/O thread
+        waiting = await asyncio.wait_for(run_io(queue.get, job["job_id"]), 0.5)
+        assert waiting["phase"] == "EXECUTING"
+
+        del admission._renders["saturated"]
+        await task
+
+    asyncio.run(run())
+    assert queue.get(job["job_id"])["phase"] == "COMPLETED"
+    io.shutdown()
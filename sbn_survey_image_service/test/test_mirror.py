@@ -0,0 +1,99 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test access tracking and the remote image mirror."""
+
+import os
+
+import pytest
+import numpy as np
+from astropy.io import fits
+
+from .http_server import serve_directory
+from ..config.env import ENV
+from ..data import try_lock
+from ..services.access import AccessTracker
+from ..services.mirror import mirrored, record_access, remote_size, should_mirror
+from ..services.readers import open_image
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    """Serve a FITS image over HTTP, with caches in a temporary directory."""
+
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path / "cache"))
+    monkeypatch.setattr(ENV, "SBNSIS_BLOCK_SIZE", 8192)
+    monkeypatch.setattr(ENV, "SBNSIS_MIRROR_THRESHOLD", 2)
+    os.makedirs(tmp_path / "cache")
+    os.makedirs(tmp_path / "www")
+
+    data = np.random.default_rng(40).normal(size=(200, 200)).astype(np.float32)
+    fits.writeto(tmp_path / "www" / "test.fits", data)
+
+    requests = []
+    with serve_directory(str(tmp_path / "www"), requests) as url:
+        yield url + "test.fits", tmp_path / "www" / "test.fits", requests
+
+
+def test_try_lock(tmp_path):
+    path = str(tmp_path / "test.lock")
+    with try_lock(path) as locked:
+        assert locked
+        with try_lock(path) as again:
+            assert not again
+        assert os.path.exists(path)
+
+    # removed on release
+    assert not os.path.exists(path)
+    with try_lock(path) as locked:
+        assert locked
+
+
+def test_access_tracker(tmp_path):
+    tracker = AccessTracker(str(tmp_path / "access.db"), window=1)
+    assert tracker.record("a", 100) == (1, 100)
+    assert tracker.record("a", 50) == (2, 150)
+    assert tracker.record("b") == (1, 0)
+    assert tracker.count("a") == 2
+    tracker.forget("a")
+    assert tracker.count("a") == 0
+
+    # counts expire with the window
+    tracker = AccessTracker(str(tmp_path / "access.db"), window=0)
+    assert tracker.count("b") == 0
+    assert tracker.record("b", 10) == (1, 10)
+
+
+def test_should_mirror(monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_MIRROR_SIZE", 100)
+    monkeypatch.setattr(ENV, "SBNSIS_MIRROR_THRESHOLD", 5)
+    assert should_mirror(1000, 5, 1000)
+    assert not should_mirror(1000, 5, 999)
+    assert not should_mirror(None, 5, 10**6)
+    # larger than 10% of the mirror
+    assert not should_mirror(20 * 2**20, 5, 10**9)
+
+
+def test_mirror(remote):
+    url, path, requests = remote
+    assert remote_size(url) == os.path.getsize(path)
+
+    # read all the data once
+    with open_image(url) as (hdul, f):
+        assert f is not None
+        data = hdul[0].data.copy()
+    assert mirrored(url) is None
+
+    # a second access, e.g., from the block cache, starts the download
+    thread = record_access(url, 0)
+    assert thread is not None
+    thread.join()
+
+    local = mirrored(url)
+    assert local is not None
+    with open(path, "rb") as a, open(local, "rb") as b:
+        assert a.read() == b.read()
+
+    requests.clear()
+    with open_image(url) as (hdul, f):
+        assert f is None
+        np.testing.assert_array_equal(hdul[0].data, data)
+    assert len(requests) == 0
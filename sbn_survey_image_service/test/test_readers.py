@@ -0,0 +1,48 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test the scheme-aware image readers."""
+
+import mmap
+
+import numpy as np
+from astropy.io import fits
+
+from ..services.compressed import PlannedSection
+from ..services.readers import local_path, open_image, section
+
+
+def test_local_path():
+    assert local_path("file:///data/image.fits") == "/data/image.fits"
+    assert local_path("/data/image.fits") == "/data/image.fits"
+    assert local_path("https://example.org/image.fits") is None
+
+
+def test_section(tmp_path):
+    data = np.arange(100 * 80, dtype=np.int16).reshape(100, 80)
+    fits.HDUList(
+        [
+            fits.PrimaryHDU(data),
+            # stored as int16 with BZERO = 32768
+            fits.ImageHDU(data.astype(np.uint16)),
+            fits.CompImageHDU(data),
+        ]
+    ).writeto(tmp_path / "test.fits")
+
+    region = (slice(10, 30), slice(5, 60))
+    with open_image("file://" + str(tmp_path / "test.fits")) as (hdul, f):
+        assert f is None
+
+        # uncompressed, unscaled data are sliced from the memory map
+        s = section(hdul[0])
+        assert not s[region].flags.owndata
+        assert isinstance(s.base.base, mmap.mmap)
+        np.testing.assert_array_equal(s[region], data[region])
+
+        # scaled data are read via a section
+        s = section(hdul[1])
+        assert isinstance(s, fits.Section)
+        assert s[region].dtype == np.uint16
+        np.testing.assert_array_equal(s[region], data[region])
+
+        s = section(hdul[2])
+        assert isinstance(s, PlannedSection)
+        np.testing.assert_array_equal(s[region], data[region])
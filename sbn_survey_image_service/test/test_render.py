@@ -0,0 +1,227 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test browse image rendering."""
+
+from unittest import mock
+
+import pytest
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.visualization import ZScaleInterval, ManualInterval
+from reproject import reproject_interp
+
+from ..services import render
+from ..services.render import (
+    pixel_transform,
+    reproject_image,
+    block_average,
+    zscale_limits,
+    stretch,
+    render_memory,
+    MemoryTrace,
+)
+
+
+def make_wcs(pc, cdelt=(-0.001, 0.001), crpix=(25.5, 20.5), shape=(40, 50)):
+    wcs = WCS()
+    wcs.pixel_shape = shape[::-1]
+    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+    wcs.wcs.crpix = crpix
+    wcs.wcs.crval = (10, 20)
+    wcs.wcs.pc = pc
+    wcs.wcs.cdelt = cdelt
+    return wcs
+
+
+@pytest.fixture
+def data():
+    return np.random.default_rng(42).normal(size=(40, 50))
+
+
+def reference(data, wcs_in, wcs_out, shape_out):
+    return reproject_interp(
+        (data, wcs_in),
+        wcs_out,
+        shape_out=shape_out,
+        return_footprint=False,
+        order="nearest-neighbor",
+    )
+
+
+def test_identity(data):
+    wcs = make_wcs([[1, 0], [0, 1]])
+    transform = pixel_transform(wcs, wcs, data.shape)
+    assert transform.is_identity
+    assert reproject_image(data, wcs, wcs, data.shape) is data
+
+
+@pytest.mark.parametrize(
+    "pc",
+    (
+        [[-1, 0], [0, 1]],
+        [[1, 0], [0, -1]],
+        [[-1, 0], [0, -1]],
+        [[0, 1], [-1, 0]],
+        [[0, -1], [1, 0]],
+    ),
+)
+def test_permutations(data, pc):
+    wcs_in = make_wcs(pc)
+    if pc[0][0] == 0:
+        # 90° rotations swap the axes
+        shape_out = (50, 40)
+        wcs_out = make_wcs([[1, 0], [0, 1]], crpix=(20.5, 25.5), shape=shape_out)
+    else:
+        shape_out = data.shape
+        wcs_out = make_wcs([[1, 0], [0, 1]])
+
+    transform = pixel_transform(wcs_in, wcs_out, shape_out)
+    assert transform.is_permutation
+
+    with mock.patch.object(render, "reproject_interp") as reproject:
+        result = reproject_image(data, wcs_in, wcs_out, shape_out)
+        reproject.assert_not_called()
+
+    expected = reference(data, wcs_in, wcs_out, shape_out)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_permutation_partial_overlap(data):
+    wcs_in = make_wcs([[-1, 0], [0, 1]])
+    wcs_out = make_wcs([[1, 0], [0, 1]], crpix=(35.5, 20.5))
+    result = reproject_image(data, wcs_in, wcs_out, data.shape)
+    expected = reference(data, wcs_in, wcs_out, data.shape)
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_affine(data):
+    angle = np.radians(30)
+    pc = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+    wcs_in = make_wcs(pc)
+    wcs_out = make_wcs([[1, 0], [0, 1]])
+
+    transform = pixel_transform(wcs_in, wcs_out, data.shape)
+    assert transform is not None
+    assert not transform.is_permutation
+
+    with mock.patch.object(render, "reproject_interp") as reproject:
+        result = reproject_image(data, wcs_in, wcs_out, data.shape)
+        reproject.assert_not_called()
+
+    # nearest-neighbor rounding may differ for the rare pixel exactly between
+    # two input pixels
+    expected = reference(data, wcs_in, wcs_out, data.shape)
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+    good = np.isfinite(result)
+    assert np.mean(result[good] == expected[good]) > 0.99
+
+
+def test_distortion_falls_back_to_reproject(data):
+    wcs_in = make_wcs([[1, 0], [0, 1]], cdelt=(-1, 1))
+    wcs_in.wcs.ctype = "RA---ZEA", "DEC--ZEA"
+    wcs_out = make_wcs([[1, 0], [0, 1]], cdelt=(-1, 1))
+
+    assert pixel_transform(wcs_in, wcs_out, data.shape) is None
+
+    with mock.patch.object(render, "reproject_interp") as reproject:
+        reproject_image(data, wcs_in, wcs_out, data.shape)
+        reproject.assert_called_once()
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_block_average(tmp_path, compressed):
+    data = np.arange(35 * 22, dtype=np.float32).reshape(35, 22)
+    hdu = (
+        fits.CompImageHDU(data, quantize_level=0) if compressed else fits.ImageHDU(data)
+    )
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(tmp_path / "test.fits")
+
+    with fits.open(tmp_path / "test.fits") as hdul:
+        # small strips to exercise the row iteration
+        binned = block_average(hdul[1], 4, max_rows=8)
+
+    # partial blocks are discarded
+    expected = data[:32, :20].reshape(8, 4, 5, 4).mean(axis=(1, 3))
+    assert binned.dtype == np.float32
+    np.testing.assert_allclose(binned, expected)
+
+
+def test_block_average_too_large(tmp_path):
+    fits.writeto(tmp_path / "test.fits", np.zeros((10, 10)))
+    with fits.open(tmp_path / "test.fits") as hdul:
+        with pytest.raises(ValueError):
+            block_average(hdul[0], 11)
+
+
+def test_reproject_image_float32(data):
+    angle = np.radians(30)
+    pc = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+    wcs_in = make_wcs(pc)
+    wcs_out = make_wcs([[1, 0], [0, 1]])
+
+    # affine path, in small strips
+    result = render._apply_affine(
+        data.astype(np.int16),
+        pixel_transform(wcs_in, wcs_out, data.shape),
+        data.shape,
+        max_rows=7,
+    )
+    assert result.dtype == np.float32
+    expected = reproject_image(
+        data.astype(np.int16).astype(np.float32), wcs_in, wcs_out, data.shape
+    )
+    np.testing.assert_array_equal(result, expected)
+
+    # full reprojection
+    wcs_in.wcs.ctype = "RA---ZEA", "DEC--ZEA"
+    wcs_in.wcs.cdelt = wcs_out.wcs.cdelt = -1, 1
+    result = reproject_image(data.astype(np.float32), wcs_in, wcs_out, data.shape)
+    assert result.dtype == np.float32
+
+
+def test_zscale_limits():
+    rng = np.random.default_rng(52)
+    image = rng.normal(size=(100, 100)).astype(np.float32)
+
+    # no subsampling: same as astropy
+    assert np.allclose(zscale_limits(image), ZScaleInterval().get_limits(image))
+
+    image[:10] = np.nan
+    vmin, vmax = zscale_limits(image, n_samples=100)
+    assert np.isfinite([vmin, vmax]).all()
+    assert vmin < 0 < vmax
+
+    assert zscale_limits(np.full((10, 10), np.nan)) == (0, 1)
+
+
+def test_stretch():
+    rng = np.random.default_rng(32)
+    image = rng.normal(size=(50, 40)).astype(np.float32)
+    image[0, 0] = np.nan
+    original = image.copy()
+
+    scaled = stretch(image, (-1, 1), max_rows=8)
+    assert scaled.dtype == np.uint8
+    np.testing.assert_array_equal(image, original)
+
+    with np.errstate(invalid="ignore"):
+        expected = (ManualInterval(-1, 1)(image.astype(float)) * 255).astype(np.uint8)
+    expected[0, 0] = 0
+    # 32-bit arithmetic may differ by 1 at rounding boundaries
+    assert np.abs(scaled.astype(int) - expected).max() <= 1
+
+
+def test_render_memory():
+    assert render_memory((100, 100), 2) == 100 * 100 * (2 + 4 + 2)
+    assert render_memory((100, 100), 8, bin=4) == 25 * 25 * (4 + 8 + 2)
+
+
+def test_memory_trace():
+    with MemoryTrace(trace=True) as trace:
+        image = np.ones((1000, 1000))
+        del image
+
+    assert trace.peak_alloc >= 8e6
+    assert trace.max_rss > 0
+    assert trace.rss_growth >= 0
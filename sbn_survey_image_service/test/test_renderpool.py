@@ -0,0 +1,111 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test the render process pool."""
+
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ..config.exceptions import RenderQueueFull
+from ..services import executors, renderpool
+from ..services.executors import run_io
+from ..services.renderpool import (
+    Render,
+    RenderPool,
+    render,
+    run_renders,
+    run_renders_async,
+)
+
+
+def job(name, seconds=0):
+    time.sleep(seconds)
+    return name, os.getpid(), time.monotonic()
+
+
+def fail():
+    raise ValueError("failed")
+
+
+def steps(name, seconds=0):
+    result = yield Render(1, job, (name, seconds))
+    return result[0]
+
+
+def failing_steps():
+    try:
+        yield Render(1, fail)
+    except ValueError:
+        return "caught"
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = RenderPool(1, queue_size=2)
+    pool.warm()
+    yield pool
+    pool.shutdown()
+
+
+def test_render_inline():
+    assert renderpool._pool is None
+    assert render(1, job, "a")[1] == os.getpid()
+
+
+def test_submit(pool):
+    name, pid, t = pool.submit(1, job, "a").result()
+    assert name == "a"
+    assert pid != os.getpid()
+
+    with pytest.raises(ValueError):
+        pool.submit(1, fail).result()
+
+
+def test_priority(pool):
+    busy = pool.submit(1, job, "busy", 0.5)
+    # wait for it to start
+    time.sleep(0.1)
+
+    large = pool.submit(1e9, job, "large")
+    small = pool.submit(1e3, job, "small")
+    busy.result()
+    assert small.result()[2] < large.result()[2]
+
+
+def test_queue_full(pool):
+    busy = pool.submit(1, job, "busy", 0.5)
+    time.sleep(0.1)
+    waiting = [pool.submit(1, job, str(i)) for i in range(2)]
+
+    with pytest.raises(RenderQueueFull) as exc_info:
+        pool.submit(1, job, "rejected")
+    assert exc_info.value.code == 503
+    assert exc_info.value.retry_after >= 1
+
+    busy.result()
+    for future in waiting:
+        future.result()
+
+
+def test_run_renders():
+    assert run_renders(steps("a")) == "a"
+    assert run_renders(failing_steps()) == "caught"
+
+
+def test_run_renders_async(pool, monkeypatch):
+    # a single I/O thread
+    io = ThreadPoolExecutor(1)
+    monkeypatch.setattr(executors, "_executor", io)
+    monkeypatch.setattr(renderpool, "_pool", pool)
+
+    async def requests():
+        rendering = asyncio.create_task(run_renders_async(steps("slow", 0.5)))
+        await asyncio.sleep(0.1)
+        # the render is awaited, not waited for on the I/O thread
+        assert await asyncio.wait_for(run_io(sum, [1, 2]), 0.2) == 3
+        return await rendering, await run_renders_async(failing_steps())
+
+    assert asyncio.run(requests()) == ("slow", "caught")
+    io.shutdown()
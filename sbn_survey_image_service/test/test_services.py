@@ -16,10 +16,17 @@ from astropy.coordinates import Angle
 from ..data.test import generate
 from ..data import generate_cache_filename
 from ..services.database_provider import data_provider_session
-from ..services.image import image_query, create_browse_image
+from ..services.image import (
+    CutoutSpec,
+    ImageFormat,
+    image_query,
+    create_browse_image,
+    encoder_options,
+)
 from ..services.label import label_query
 from ..config.env import ENV
-from ..config.exceptions import InvalidImageID, ParameterValueError
+from ..config.collections import PROFILES
+from ..config.exceptions import InvalidImageID, ParameterValueError, ImageTooLarge
 
 
 @pytest.fixture(autouse=True)
@@ -130,6 +137,89 @@ def test_image_query_cutout():
     assert im[im.shape[0] // 2, im.shape[1] // 2] == -25
 
 
+def test_image_query_cutout_compressed():
+    image_path: str
+    download_filename: str
+    image_path, download_filename = image_query(
+        "urn:nasa:pds:survey:test-collection:test-000102",
+        ra=0,
+        dec=-25,
+        size="1deg",
+        format="fits",
+        compress="rice",
+    )
+    assert download_filename.endswith(".fits.fz")
+
+    with fits.open(image_path) as hdul:
+        assert isinstance(hdul[1], fits.CompImageHDU)
+        assert hdul[1].header["sis-oid"].endswith("test-000102")
+        compressed = hdul[1].data
+
+    # integer data are losslessly compressed
+    image_path, download_filename = image_query(
+        "urn:nasa:pds:survey:test-collection:test-000102",
+        ra=0,
+        dec=-25,
+        size="1deg",
+        format="fits",
+    )
+    np.testing.assert_array_equal(compressed, fits.getdata(image_path))
+
+    with pytest.raises(ParameterValueError):
+        image_query(
+            "urn:nasa:pds:survey:test-collection:test-000102",
+            format="fits",
+            compress="rice",
+        )
+
+    with pytest.raises(ParameterValueError):
+        image_query(
+            "urn:nasa:pds:survey:test-collection:test-000102",
+            ra=0,
+            dec=-25,
+            size="1deg",
+            format="fits",
+            quantize=4,
+        )
+
+
+@pytest.mark.parametrize(
+    "compress, quantize", [("rice", None), ("gzip", 4), ("gzip", None)]
+)
+def test_cutout_compressed_float(tmp_path, monkeypatch, compress, quantize):
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path))
+
+    rng = np.random.default_rng(35)
+    data = rng.normal(100, 5, (100, 100)).astype(np.float32)
+    wcs = WCS()
+    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+    wcs.wcs.crpix = (50.5, 50.5)
+    wcs.wcs.crval = (10, 20)
+    wcs.wcs.cdelt = -0.001, 0.001
+    fits.writeto(tmp_path / "test.fits", data, wcs.to_header())
+
+    spec = CutoutSpec(10, 20, "0.05deg")
+    path, wcs_ext, data_ext = spec.cutout(
+        "test",
+        f"file://{tmp_path}/test.fits",
+        0,
+        0,
+        compress=compress,
+        quantize=quantize,
+    )
+    assert (wcs_ext, data_ext) == (1, 1)
+
+    expected = data[25:75, 25:75]
+    cutout = fits.getdata(path, data_ext)
+    assert cutout.shape == expected.shape
+    if quantize is None and compress == "gzip":
+        np.testing.assert_array_equal(cutout, expected)
+    else:
+        # quantization step is the noise / quantize
+        step = 5 / (16 if quantize is None else quantize)
+        assert np.abs(cutout - expected).max() <= step
+
+
 def test_image_query_obs_id_fail():
     with pytest.raises(InvalidImageID):
         image_query("not a real obs ID")
@@ -140,6 +230,150 @@ def test_image_query_format_fail():
         image_query("", format="something else")
 
 
+def test_image_query_binned():
+    image_path: str
+    image_path, _ = image_query(
+        "urn:nasa:pds:survey:test-collection:test-000023", format="png", max_size=100
+    )
+
+    expected_path: str = generate_cache_filename(
+        "file://" + os.path.join(ENV.TEST_DATA_PATH, "test-000023.fits"),
+        "full_size",
+        "png",
+        "False",
+        "bin3",
+    )
+    assert image_path == expected_path
+    assert Image.open(image_path).size == (100, 100)
+
+    # bin takes precedence when it is the larger factor
+    image_path, _ = image_query(
+        "urn:nasa:pds:survey:test-collection:test-000023",
+        format="png",
+        max_size=100,
+        bin=4,
+    )
+    assert Image.open(image_path).size == (75, 75)
+
+
+def test_image_query_binned_fail():
+    obs_id: str = "urn:nasa:pds:survey:test-collection:test-000023"
+    with pytest.raises(ParameterValueError):
+        image_query(obs_id, format="fits", bin=2)
+
+    with pytest.raises(ParameterValueError):
+        image_query(obs_id, format="png", max_size=0)
+
+
+def test_image_query_webp():
+    image_path: str
+    download_filename: str
+    image_path, download_filename = image_query(
+        "urn:nasa:pds:survey:test-collection:test-000023", format="webp"
+    )
+    assert download_filename == "test-000023.webp"
+    assert Image.open(image_path).format == "WEBP"
+
+    # non-default encoder options are part of the file name
+    image_path2, _ = image_query(
+        "urn:nasa:pds:survey:test-collection:test-000023", format="webp", quality=50
+    )
+    assert image_path2 != image_path
+    assert os.path.getsize(image_path2) < os.path.getsize(image_path)
+
+
+def test_encoder_options():
+    assert encoder_options(ImageFormat.JPEG) == {"quality": 95}
+    assert encoder_options(ImageFormat.PNG, compress_level=9) == {"compress_level": 9}
+    assert encoder_options(ImageFormat.JPEG, subsampling="4:4:4") == {
+        "quality": 95,
+        "subsampling": "4:4:4",
+    }
+
+    with pytest.raises(ParameterValueError):
+        encoder_options(ImageFormat.PNG, quality=90)
+
+    with pytest.raises(ParameterValueError):
+        encoder_options(ImageFormat.WEBP, quality=101)
+
+    with pytest.raises(ParameterValueError):
+        encoder_options(ImageFormat.JPEG, subsampling="4:0:0")
+
+    with pytest.raises(ParameterValueError):
+        encoder_options(ImageFormat.FITS)
+
+    with pytest.raises(ParameterValueError):
+        image_query(
+            "urn:nasa:pds:survey:test-collection:test-000023", format="fits", quality=1
+        )
+
+
+def test_cutout_size_limit_from_wcs(tmp_path, monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path))
+    wcs = WCS()
+    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+    wcs.wcs.crpix = (50.5, 50.5)
+    wcs.wcs.crval = (10, 20)
+    wcs.wcs.cdelt = -0.001, 0.001
+    fits.writeto(tmp_path / "test.fits", np.zeros((100, 100)), wcs.to_header())
+
+    # no pixel scale is given, so the WCS is used: about 2000 pixels wide
+    with pytest.raises(ImageTooLarge):
+        CutoutSpec(10, 20, "2deg").cutout("test", str(tmp_path / "test.fits"), 0, 0)
+
+    CutoutSpec(10, 20, "0.05deg").cutout("test", str(tmp_path / "test.fits"), 0, 0)
+
+
+def test_create_browse_image_memory_limit(tmp_path, monkeypatch):
+    wcs = WCS()
+    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+    wcs.wcs.crpix = (512.5, 512.5)
+    wcs.wcs.crval = (10, 20)
+    wcs.wcs.cdelt = -0.001, 0.001
+    fits.writeto(
+        tmp_path / "test.fits", np.zeros((1024, 1024), np.float32), wcs.to_header()
+    )
+
+    # 4 MiB for the data, 6 MiB for the result
+    monkeypatch.setattr(ENV, "SBNSIS_RENDER_MEMORY_LIMIT", 8)
+    with pytest.raises(ImageTooLarge):
+        create_browse_image(
+            str(tmp_path / "test.fits"), str(tmp_path / "test.png"), "png", False, 0, 0
+        )
+
+    # binned: 0.25 MiB for the data, 1.5 MiB for the result
+    create_browse_image(
+        str(tmp_path / "test.fits"),
+        str(tmp_path / "test.png"),
+        "png",
+        False,
+        0,
+        0,
+        bin=2,
+    )
+    assert Image.open(tmp_path / "test.png").size == (512, 512)
+
+
+def test_create_browse_image_header_fixes(tmp_path):
+    wcs = WCS()
+    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+    wcs.wcs.crpix = (5.5, 5.5)
+    wcs.wcs.crval = (10, 20)
+    wcs.wcs.cdelt = -0.001, 0.001
+    header = wcs.to_header()
+    # these trigger DSS mode in wcslib
+    header["XPIXELSZ"] = 15
+    header["YPIXELSZ"] = 15
+    fits.writeto(tmp_path / "test.fits", np.zeros((10, 10), np.float32), header)
+
+    args = (str(tmp_path / "test.fits"), str(tmp_path / "test.png"), "png", True, 0, 0)
+    with pytest.raises(ValueError):
+        create_browse_image(*args)
+
+    create_browse_image(*args, profile=PROFILES["neat"])
+    assert Image.open(tmp_path / "test.png").size == (10, 10)
+
+
 def test_create_browse_image_alignment():
     im = np.zeros((10, 10))
     im[0, :] = 1  # first row is 1111111
@@ -179,3 +413,26 @@ def test_create_browse_image_alignment():
 
     for f in (dataf, imf, alignedf):
         os.unlink(f.name)
+
+
+def test_image_query_maximum_cutout_size():
+    # about 300 pixels per degree
+    obs_id: str = "urn:nasa:pds:survey:test-collection:test-000102"
+    image_query(obs_id, ra=0, dec=-25, size="3deg", format="fits")
+    with pytest.raises(ImageTooLarge):
+        image_query(obs_id, ra=0, dec=-25, size="4deg", format="fits")
+
+
+def test_image_query_render_cost_limit(tmp_path, monkeypatch):
+    obs_id: str = "urn:nasa:pds:survey:test-collection:test-000023"
+    # not cached
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path))
+
+    # 300 x 300 pixels read, 1.5 x 300 x 300 rendered
+    monkeypatch.setattr(ENV, "SBNSIS_RENDER_COST_LIMIT", 1.5e5)
+    image_path, download_filename = image_query(obs_id, format="png")
+    assert Image.open(image_path).size == (150, 150)
+
+    monkeypatch.setattr(ENV, "SBNSIS_RENDER_COST_LIMIT", 5e4)
+    with pytest.raises(ImageTooLarge):
+        image_query(obs_id, format="png")
@@ -0,0 +1,86 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test image display statistics."""
+
+import os
+
+import pytest
+import numpy as np
+from astropy.io import fits
+from PIL import Image as PIL_Image
+
+from ..data.test import generate
+from ..data import generate_cache_filename
+from ..models.image import Image
+from ..models.statistics import ImageStatistics
+from ..services.database_provider import data_provider_session
+from ..services.image import image_query
+from ..services.statistics import display_statistics, update_statistics
+from ..config.env import ENV
+
+OBS_ID = "urn:nasa:pds:survey:test-collection:test-000023"
+
+
+@pytest.fixture
+def statistics():
+    with data_provider_session() as session:
+        if not generate.exists(session):
+            generate.create_data(session, ENV.TEST_DATA_PATH)
+        generate.create_tables()
+
+    with data_provider_session() as session:
+        im = session.query(Image).filter(Image.obs_id == OBS_ID).one()
+        session.query(ImageStatistics).filter(
+            ImageStatistics.image_id == im.id
+        ).delete()
+        image_id = im.id
+
+    yield image_id
+
+    with data_provider_session() as session:
+        session.query(ImageStatistics).filter(
+            ImageStatistics.image_id == image_id
+        ).delete()
+
+
+def test_display_statistics(tmp_path):
+    data = np.random.default_rng(12).normal(100, 10, size=(200, 100))
+    data[5, 5] = np.nan
+    header = fits.Header({"SATURATE": 65535})
+    fits.writeto(tmp_path / "test.fits", data, header)
+    with fits.open(tmp_path / "test.fits") as hdul:
+        stats = display_statistics(hdul[0], n_rows=50)
+
+    assert np.isclose(stats["median"], 100, atol=1)
+    assert np.isclose(stats["mad"], 10 * 0.6745, rtol=0.1)
+    assert stats["zscale_min"] < 100 < stats["zscale_max"]
+    assert stats["saturation"] == 65535
+
+
+def test_stretch(statistics):
+    url = "file://" + os.path.join(ENV.TEST_DATA_PATH, "test-000023.fits")
+
+    # no statistics, so the local stretch is used
+    image_path, _ = image_query(OBS_ID, format="png")
+    assert image_path == generate_cache_filename(url, "full_size", "png", "False")
+
+    with data_provider_session() as session:
+        n = update_statistics(
+            session, collection="urn:nasa:pds:survey:test-collection", limit=1
+        )
+        assert n == 1
+
+        # narrow the limits to verify they are used
+        session.query(ImageStatistics).filter(
+            ImageStatistics.image_id == statistics
+        ).delete()
+        session.add(ImageStatistics(image_id=statistics, zscale_min=0, zscale_max=1))
+
+    image_path, _ = image_query(OBS_ID, format="png")
+    assert image_path == generate_cache_filename(
+        url, "full_size", "png", "False", "limits0.0:1.0"
+    )
+    data = np.array(PIL_Image.open(image_path))
+    assert set(np.unique(data)) <= {0, 255}
+
+    image_path, _ = image_query(OBS_ID, format="png", stretch="local")
+    assert image_path == generate_cache_filename(url, "full_size", "png", "False")
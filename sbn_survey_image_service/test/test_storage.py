@@ -0,0 +1,138 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test archive storage locations."""
+
+import io
+import os
+import json
+
+import pytest
+import numpy as np
+import fsspec
+from astropy.io import fits
+
+from ..config.env import ENV
+from ..services import storage
+from ..services.storage import (
+    Location,
+    LocalBackend,
+    StorageBackend,
+    load_locations,
+    locate,
+    local_file,
+    register_backend,
+)
+from ..services.readers import open_image
+
+ARCHIVE = "https://archive.example.org/pds4/"
+
+
+@pytest.fixture
+def locations(tmp_path, monkeypatch):
+    """An empty local mirror (nfs) and an in-memory object store (s3)."""
+
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path / "cache"))
+    os.makedirs(tmp_path / "cache")
+    os.makedirs(tmp_path / "nfs")
+
+    memory = fsspec.filesystem("memory")
+
+    locations = [
+        Location("nfs", ARCHIVE, str(tmp_path / "nfs") + "/"),
+        Location("mirror"),
+        Location("s3", ARCHIVE, "memory://s3/"),
+    ]
+    monkeypatch.setattr(storage, "LOCATIONS", locations)
+    yield tmp_path / "nfs", memory
+
+    if memory.exists("/s3"):
+        memory.rm("/s3", recursive=True)
+
+
+def fits_bytes(data: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    fits.writeto(buf, data)
+    return buf.getvalue()
+
+
+def test_locate(locations):
+    nfs, memory = locations
+    url = ARCHIVE + "data/image.fits"
+
+    # nowhere but the archive
+    assert locate(url) == (url, {}, False)
+    assert locate("/some/local/file.fits") == ("/some/local/file.fits", {}, True)
+
+    # s3 copy, existence check is remembered
+    memory.pipe("/s3/data/image.fits", b"s3")
+    assert locate(url) == (url, {}, False)
+    storage.LOCATIONS[2].backend._exists.clear()
+    assert locate(url) == ("memory://s3/data/image.fits", {}, False)
+
+    # the local mirror is preferred
+    os.makedirs(nfs / "data")
+    with open(nfs / "data" / "image.fits", "wb") as outf:
+        outf.write(b"nfs")
+    assert locate(url) == (str(nfs / "data" / "image.fits"), {}, True)
+    with open(local_file(url), "rb") as inf:
+        assert inf.read() == b"nfs"
+
+
+def test_local_file(locations):
+    _, memory = locations
+    memory.pipe("/s3/label.xml", b"<label/>")
+    path = local_file(ARCHIVE + "label.xml")
+    assert path.startswith(ENV.SBNSIS_CUTOUT_CACHE)
+    with open(path, "rb") as inf:
+        assert inf.read() == b"<label/>"
+
+
+def test_open_image(locations):
+    nfs, memory = locations
+    data = np.arange(100, dtype=np.float32).reshape(10, 10)
+    memory.pipe("/s3/image.fits", fits_bytes(data))
+
+    with open_image(ARCHIVE + "image.fits") as (hdul, f):
+        assert f is not None
+        np.testing.assert_array_equal(hdul[0].section[2:4, 3:5], data[2:4, 3:5])
+
+    fits.writeto(nfs / "image.fits", data * 2)
+    with open_image(ARCHIVE + "image.fits") as (hdul, f):
+        assert f is None
+        np.testing.assert_array_equal(hdul[0].data, data * 2)
+
+
+def test_load_locations(tmp_path):
+    assert [loc.name for loc in load_locations()] == ["mirror"]
+
+    path = str(tmp_path / "storage.json")
+    with open(path, "w") as outf:
+        json.dump([{"name": "nfs", "prefix": ARCHIVE, "root": "/mnt/archive/"}], outf)
+    locations = load_locations(path)
+    assert [loc.name for loc in locations] == ["mirror", "nfs"]
+    assert isinstance(locations[1].backend, LocalBackend)
+    assert locations[1].translate(ARCHIVE + "a/b.fits") == "/mnt/archive/a/b.fits"
+    assert locations[1].translate("https://elsewhere.org/a/b.fits") is None
+
+    with pytest.raises(ValueError):
+        Location("nfs", ARCHIVE)
+
+
+def test_register_backend(monkeypatch):
+    monkeypatch.setattr(storage, "BACKENDS", dict(storage.BACKENDS))
+
+    @register_backend
+    class EverythingBackend(StorageBackend):
+        protocols = ("everything",)
+
+        def exists(self, url: str) -> bool:
+            return True
+
+    location = Location("test", ARCHIVE, "everything://")
+    assert isinstance(location.backend, EverythingBackend)
+    assert locate(ARCHIVE + "x.fits", [location]) == ("everything://x.fits", {}, False)
+
+    class IncompleteBackend(StorageBackend):
+        protocols = ("incomplete",)
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()
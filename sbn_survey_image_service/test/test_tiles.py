@@ -0,0 +1,134 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test tile pyramids."""
+
+import os
+
+import pytest
+import numpy as np
+from astropy.io import fits
+from PIL import Image as PIL_Image
+
+from ..data.test import generate
+from ..services.database_provider import data_provider_session
+from ..services.tiles import (
+    level_shapes,
+    _downsample,
+    build_pyramid,
+    pyramid_directory,
+    tile_path,
+    tile_query,
+)
+from ..services.image import ImageFormat
+from ..services.render import stretch
+from ..config.env import ENV
+from ..config.exceptions import ImageTooLarge, InvalidTile
+
+
+@pytest.fixture
+def dummy_data():
+    with data_provider_session() as session:
+        if not generate.exists(session):
+            generate.create_tables()
+            generate.create_data(session, ENV.TEST_DATA_PATH)
+
+
+def test_level_shapes():
+    assert level_shapes((600, 1000), 256) == [(150, 250), (300, 500), (600, 1000)]
+    assert level_shapes((100, 100), 256) == [(100, 100)]
+
+
+def test_downsample():
+    image = np.array([[0, 4, 8], [4, 8, 12], [100, 100, 200]], dtype=np.uint8)
+    result = _downsample(image)
+    assert result.shape == (2, 2)
+    assert result.tolist() == [[4, 10], [100, 200]]
+
+
+def test_build_pyramid(tmp_path):
+    # left half 0, right half 1, first row (bottom when displayed) 2
+    data = np.zeros((300, 520), np.float32)
+    data[:, 260:] = 1
+    data[0] = 2
+    fn = str(tmp_path / "image.fits")
+    fits.writeto(fn, data)
+    url = "file://" + fn
+
+    pyramid = build_pyramid(url, 0, "png", limits=(0, 2), tile_size=128)
+    assert pyramid == {
+        "width": 520,
+        "height": 300,
+        "tile_size": 128,
+        "levels": 4,
+        "format": "png",
+    }
+
+    directory = pyramid_directory(url, ImageFormat.PNG, (0, 2))
+    lowest = np.array(PIL_Image.open(tile_path(directory, 0, 0, 0, ImageFormat.PNG)))
+    assert lowest.shape == (38, 65)
+
+    # native resolution, upper-left and lower-right tiles
+    upper_left = np.array(
+        PIL_Image.open(tile_path(directory, 3, 0, 0, ImageFormat.PNG))
+    )
+    assert upper_left.shape == (128, 128)
+    assert np.all(upper_left == 0)
+
+    lower_right = np.array(
+        PIL_Image.open(tile_path(directory, 3, 4, 2, ImageFormat.PNG))
+    )
+    assert lower_right.shape == (300 - 256, 520 - 512)
+    assert np.all(lower_right[:-1] == 127)
+    assert np.all(lower_right[-1] == 255)
+
+    # existing pyramids are not rebuilt
+    os.unlink(tile_path(directory, 3, 0, 0, ImageFormat.PNG))
+    build_pyramid(url, 0, "png", limits=(0, 2), tile_size=128)
+    assert not os.path.exists(tile_path(directory, 3, 0, 0, ImageFormat.PNG))
+
+    # unless the display limits change
+    build_pyramid(url, 0, "png", limits=(0, 1), tile_size=128)
+    directory = pyramid_directory(url, ImageFormat.PNG, (0, 1))
+    upper_right = np.array(
+        PIL_Image.open(tile_path(directory, 3, 3, 0, ImageFormat.PNG))
+    )
+    assert np.all(upper_right == 255)
+
+
+def test_build_pyramid_stretch(tmp_path):
+    # flat frames are stretched as for browse images
+    data = np.full((64, 64), 2, np.float32)
+    fn = str(tmp_path / "flat.fits")
+    fits.writeto(fn, data)
+    url = "file://" + fn
+
+    build_pyramid(url, 0, "png", limits=(1, 1))
+    directory = pyramid_directory(url, ImageFormat.PNG, (1, 1))
+    tile = np.array(PIL_Image.open(tile_path(directory, 0, 0, 0, ImageFormat.PNG)))
+    np.testing.assert_array_equal(tile, stretch(data, (1, 1)))
+
+
+def test_build_pyramid_memory_limit(tmp_path, monkeypatch):
+    fn = str(tmp_path / "image.fits")
+    fits.writeto(fn, np.zeros((600, 600), np.float32))
+
+    monkeypatch.setattr(ENV, "SBNSIS_RENDER_MEMORY_LIMIT", 1)
+    with pytest.raises(ImageTooLarge):
+        build_pyramid("file://" + fn, 0, "png", limits=(0, 1))
+
+
+def test_tile_query(dummy_data):
+    obs_id = "urn:nasa:pds:survey:test-collection:test-000023"
+
+    # 300×300 image: 2 levels
+    path, download_filename = tile_query(obs_id, 1, 1, 1)
+    assert download_filename == "test-000023_1_1_1.jpeg"
+    assert PIL_Image.open(path).size == (300 - 256, 300 - 256)
+
+    path, download_filename = tile_query(obs_id, 0, 0, 0, format="png")
+    assert PIL_Image.open(path).size == (150, 150)
+
+    with pytest.raises(InvalidTile):
+        tile_query(obs_id, 1, 2, 0)
+
+    with pytest.raises(InvalidTile):
+        tile_query(obs_id, 2, 0, 0)
@@ -0,0 +1,53 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test uncompressed copies of frequently read compressed images."""
+
+import os
+
+import pytest
+import numpy as np
+from astropy.io import fits
+
+from ..config.env import ENV
+from ..services.readers import open_image, section
+from ..services.transcode import record_access, transcoded
+
+
+@pytest.fixture
+def compressed(tmp_path, monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path / "cache"))
+    monkeypatch.setattr(ENV, "SBNSIS_TRANSCODE_THRESHOLD", 2)
+    os.makedirs(tmp_path / "cache")
+
+    data = np.random.default_rng(41).normal(size=(100, 120)).astype(np.float32)
+    header = fits.Header({"OBJECT": "test"})
+    fits.HDUList(
+        [
+            fits.PrimaryHDU(),
+            fits.CompImageHDU(data, header, compression_type="RICE_1"),
+            fits.BinTableHDU.from_columns([fits.Column("x", "E", array=[1, 2])]),
+        ]
+    ).writeto(tmp_path / "test.fits.fz")
+    return str(tmp_path / "test.fits.fz")
+
+
+def test_transcode(compressed):
+    with open_image(compressed) as (hdul, _):
+        expected = hdul[1].data.copy()
+    assert transcoded(compressed) is None
+
+    # a second access starts transcoding
+    thread = record_access(compressed)
+    assert thread is not None
+    thread.join()
+    assert transcoded(compressed) is not None
+
+    with open_image(compressed) as (hdul, _):
+        assert len(hdul) == 3
+        assert isinstance(hdul[1], fits.ImageHDU)
+        assert hdul[1].header["OBJECT"] == "test"
+        np.testing.assert_array_equal(hdul[2].data["x"], [1, 2])
+
+        # the copy is memory mapped
+        data = section(hdul[1])
+        assert not data.flags.owndata
+        np.testing.assert_array_equal(data, expected)
@@ -0,0 +1,165 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Test remote archive request limits, retries, and circuit breaking."""
+
+import os
+import time
+
+import pytest
+import numpy as np
+from astropy.io import fits
+
+from .http_server import serve_directory
+from ..config.env import ENV
+from ..config.exceptions import UpstreamUnavailable
+from ..services import upstream
+from ..services.upstream import CircuitBreaker, host_slot, is_transient, request
+from ..services.blockcache import fsspec_options
+from ..services.readers import open_image
+
+URL = "https://archive.example.org/image.fits"
+
+
+@pytest.fixture(autouse=True)
+def settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_CUTOUT_CACHE", str(tmp_path))
+    monkeypatch.setattr(ENV, "SBNSIS_RETRIES", 2)
+    monkeypatch.setattr(ENV, "SBNSIS_BREAKER_THRESHOLD", 5)
+    monkeypatch.setattr(upstream, "BACKOFF", 0.001)
+    monkeypatch.setattr(upstream, "_breakers", {})
+
+
+class Flaky:
+    """Fails ``n`` times, then returns True."""
+
+    def __init__(self, n, exc=TimeoutError):
+        self.n = n
+        self.exc = exc
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.n:
+            raise self.exc("failed")
+        return True
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker("host", threshold=2, reset=0.2)
+    breaker.before()
+    breaker.failure()
+    breaker.before()
+    breaker.failure()
+    assert breaker.state == "open"
+    with pytest.raises(UpstreamUnavailable) as exc_info:
+        breaker.before()
+    assert exc_info.value.code == 503
+    assert exc_info.value.retry_after >= 1
+
+    # one trial request after the reset time
+    time.sleep(0.25)
+    breaker.before()
+    assert breaker.state == "half-open"
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before()
+
+    # a failed trial opens the breaker again
+    breaker.failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.25)
+    breaker.before()
+    breaker.success()
+    assert breaker.state == "closed"
+
+
+def test_is_transient():
+    assert is_transient(TimeoutError())
+    assert is_transient(ConnectionResetError())
+    assert not is_transient(FileNotFoundError())
+    assert not is_transient(ValueError())
+
+    exc = FileNotFoundError()
+    exc.__cause__ = ConnectionRefusedError()
+    assert is_transient(exc)
+
+
+def test_request_retries():
+    func = Flaky(2)
+    assert request(URL, func)
+    assert func.calls == 3
+
+    # not retried
+    func = Flaky(1, FileNotFoundError)
+    with pytest.raises(FileNotFoundError):
+        request(URL, func)
+    assert func.calls == 1
+
+    # local files are not retried
+    func = Flaky(1)
+    with pytest.raises(TimeoutError):
+        request("file:///image.fits", func)
+
+    func = Flaky(10)
+    with pytest.raises(UpstreamUnavailable):
+        request(URL, func)
+    assert func.calls == 3
+
+
+def test_request_circuit_breaker(monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_BREAKER_THRESHOLD", 3)
+    with pytest.raises(UpstreamUnavailable):
+        request(URL, Flaky(10))
+
+    # fails fast
+    func = Flaky(0)
+    with pytest.raises(UpstreamUnavailable):
+        request(URL, func)
+    assert func.calls == 0
+
+    # other hosts are unaffected
+    assert request("https://other.example.org/image.fits", func)
+
+
+def test_host_slot(monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_HOST_CONCURRENCY", 2)
+    with host_slot("example.org"):
+        with host_slot("example.org"):
+            with pytest.raises(UpstreamUnavailable):
+                with host_slot("example.org", wait=0.1):
+                    pass
+            # other hosts have their own slots
+            with host_slot("example.com", wait=0.1):
+                pass
+
+        with host_slot("example.org", wait=0.1):
+            pass
+
+
+def test_fsspec_options():
+    timeout = fsspec_options(URL)["client_kwargs"]["timeout"]
+    assert timeout.sock_connect == ENV.SBNSIS_CONNECT_TIMEOUT
+    assert timeout.sock_read == ENV.SBNSIS_READ_TIMEOUT
+    assert "client_kwargs" not in fsspec_options("file:///image.fits")
+
+
+def test_open_image_unavailable(tmp_path, monkeypatch):
+    monkeypatch.setattr(ENV, "SBNSIS_RETRIES", 0)
+    monkeypatch.setattr(ENV, "SBNSIS_BREAKER_THRESHOLD", 1)
+    os.makedirs(tmp_path / "www")
+    fits.writeto(tmp_path / "www" / "test.fits", np.zeros((10, 10)))
+
+    with serve_directory(str(tmp_path / "www")) as url:
+        with open_image(url + "test.fits") as (hdul, f):
+            assert hdul[0].data.shape == (10, 10)
+
+    # the server is gone
+    with pytest.raises(UpstreamUnavailable):
+        with open_image(url + "other.fits"):
+            pass
+
+    # fails fast, without a request
+    t0 = time.monotonic()
+    with pytest.raises(UpstreamUnavailable):
+        with open_image(url + "test.fits"):
+            pass
+    assert time.monotonic() - t0 < 0.5